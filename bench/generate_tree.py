@@ -0,0 +1,115 @@
+import os
+import io
+import random
+import struct
+import argparse
+import datetime
+from PIL import Image
+
+# Names reused across folders to produce many destination name collisions
+DUPLICATE_NAMES = [f'IMG_{i:04d}.JPG' for i in range(1, 21)]
+ARTISTS = ['Artist A', 'Artist B', 'Artist C', 'Artist D']
+ALBUMS = ['First', 'Second', 'Live', 'Greatest Hits']
+MP3_FRAME = bytes([0xFF, 0xFB, 0x90, 0x64]) + b'\x00' * 413  # one silent MPEG-1 Layer III frame
+
+
+def _syncsafe(n: int) -> bytes:
+    return bytes([(n >> 21) & 0x7F, (n >> 14) & 0x7F, (n >> 7) & 0x7F, n & 0x7F])
+
+
+def id3_tag(artist: str, album: str, title: str) -> bytes:
+    """
+    Build a minimal ID3v2.4 tag with TPE1/TALB/TIT2 frames, without going through mutagen.
+    """
+    frames = b''
+    for frame_id, text in (('TPE1', artist), ('TALB', album), ('TIT2', title)):
+        data = b'\x03' + text.encode('utf-8')  # encoding 3 = UTF-8
+        frames += frame_id.encode('ascii') + _syncsafe(len(data)) + b'\x00\x00' + data
+    return b'ID3\x04\x00\x00' + _syncsafe(len(frames)) + frames
+
+
+def jpeg_templates(count: int = 8, size=(640, 480)) -> list:
+    templates = []
+    for i in range(count):
+        buf = io.BytesIO()
+        Image.new('RGB', size, (i * 30 % 256, 80, 160)).save(buf, 'JPEG', quality=70)
+        templates.append(buf.getvalue())
+    return templates
+
+
+def generate_tree(root: str, files: int, depth: int = 4, fanout: int = 8, jpeg_ratio: float = 0.3,
+                  mp3_ratio: float = 0.2, duplicate_name_ratio: float = 0.3, duplicate_content_ratio: float = 0.05,
+                  seed: int = 0) -> dict:
+    """
+    Create a synthetic backup tree under root and return a summary dict (files, bytes, by type).
+    JPEGs get unique trailing bytes after the EOI marker so their contents differ while staying decodable;
+    a duplicate_content_ratio share of files are byte copies of an earlier file.
+    Modification times are spread over several years so the galleries get many months.
+    """
+    rng = random.Random(seed)
+    templates = jpeg_templates()
+    directories = [root]
+    for level in range(depth):
+        directories += [os.path.join(d, f'dir{level}_{i}') for d in directories[-fanout ** level:] for i in range(fanout)]
+        if len(directories) > max(1, files // 10):
+            break
+    for directory in directories:
+        os.makedirs(directory, exist_ok=True)
+    start = datetime.datetime(2015, 1, 1).timestamp()
+    span = datetime.datetime(2025, 1, 1).timestamp() - start
+    summary = {'files': 0, 'bytes': 0, 'jpeg': 0, 'mp3': 0, 'other': 0}
+    written = []
+    for n in range(files):
+        directory = rng.choice(directories)
+        roll = rng.random()
+        if written and rng.random() < duplicate_content_ratio:
+            kind, data = rng.choice(written)
+            name = f'copy_{n}' + ('.jpg' if kind == 'jpeg' else '.mp3' if kind == 'mp3' else '.dat')
+        elif roll < jpeg_ratio:
+            kind = 'jpeg'
+            data = rng.choice(templates) + n.to_bytes(8, 'little')
+            name = rng.choice(DUPLICATE_NAMES) if rng.random() < duplicate_name_ratio else f'photo_{n}.jpg'
+        elif roll < jpeg_ratio + mp3_ratio:
+            kind = 'mp3'
+            data = id3_tag(rng.choice(ARTISTS), rng.choice(ALBUMS), f'Track {n}') + MP3_FRAME * rng.randint(4, 40)
+            name = f'track_{n}.mp3'
+        else:
+            kind = 'other'
+            data = struct.pack('<Q', n) * rng.randint(1, 512)
+            name = f'doc_{n}.dat'
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            path = os.path.join(directory, f'{n}_{name}')
+        with open(path, 'wb') as f:
+            f.write(data)
+        mtime = start + rng.random() * span
+        os.utime(path, (mtime, mtime))
+        if len(written) < 1000:
+            written.append((kind, data))
+        summary['files'] += 1
+        summary['bytes'] += len(data)
+        summary[kind] += 1
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic backup tree for benchmarking.')
+    parser.add_argument('root', help='Directory to create the tree in')
+    parser.add_argument('--files', type=int, default=10000, help='Number of files to create')
+    parser.add_argument('--depth', type=int, default=4, help='Maximum directory nesting depth')
+    parser.add_argument('--fanout', type=int, default=8, help='Subdirectories per directory')
+    parser.add_argument('--jpeg-ratio', type=float, default=0.3, help='Share of files that are JPEGs')
+    parser.add_argument('--mp3-ratio', type=float, default=0.2, help='Share of files that are tagged MP3s')
+    parser.add_argument('--duplicate-names', type=float, default=0.3,
+                        help='Share of JPEGs named from a small pool of IMG_NNNN.JPG names')
+    parser.add_argument('--duplicate-content', type=float, default=0.05,
+                        help='Share of files that are byte copies of another file')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed, for reproducible trees')
+    args = parser.parse_args()
+    summary = generate_tree(args.root, args.files, args.depth, args.fanout, args.jpeg_ratio, args.mp3_ratio,
+                            args.duplicate_names, args.duplicate_content, args.seed)
+    print(summary)
+
+
+if __name__ == '__main__':
+    main()
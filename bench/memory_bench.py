@@ -0,0 +1,109 @@
+import os
+import gc
+import json
+import random
+import argparse
+import tracemalloc
+from collections import defaultdict
+
+from utils.file_utils import FileRecord
+from utils.file_table import FileTable
+
+EXTENSIONS = [('.jpg', 'image', 'images'), ('.mp4', 'video', 'videos'), ('.mp3', 'audio', 'audio'),
+              ('.pdf', 'other', 'other')]
+
+
+def synthetic_files(count: int, seed: int = 0, root: str = '/data/source', destination: str = '/data/organized'):
+    """
+    Yield (FileRecord, category, destination) for count files spread over a few thousand nested folders,
+    without touching the disk. Destinations follow the organizer's layout (year/month folders for media).
+    """
+    rng = random.Random(seed)
+    folders = [os.path.join(root, f'{rng.randrange(50):02d}-archive', f'set_{rng.randrange(40):03d}', f'roll_{i:05d}')
+               for i in range(max(1, count // 200))]
+    for i in range(count):
+        ext, ftype, category = rng.choice(EXTENSIONS)
+        folder = rng.choice(folders)
+        name = f'file_{i:08d}{ext}'
+        record = FileRecord(os.path.join(folder, name), rng.randrange(1, 1 << 24), 1.6e9 + i, 1.6e9 + i,
+                            1000 + i, 2049)
+        record.type = ftype
+        record.captured = 0
+        if ftype == 'other':
+            dest = os.path.join(destination, 'other', os.path.relpath(folder, root), name)
+        elif ftype == 'audio':
+            record.extra_metadata = {'artist': f'Artist {i % 300}', 'album': f'Album {i % 900}',
+                                     'title': f'Title {i}'}
+            dest = os.path.join(destination, 'audio', f'Artist {i % 300}', f'Album {i % 900}', name)
+        else:
+            year = 2010 + rng.randrange(14)
+            dest = os.path.join(destination, category, str(year), f'{rng.randrange(1, 13):02d}-{year}', name)
+        yield record, category, dest
+
+
+def build_dicts(files) -> tuple:
+    """
+    The former shared store: a list of records plus nested category -> {source: destination} dicts for the
+    categorized and the conflict-resolved destinations (copied_files was the resolved dict).
+    """
+    file_metadata = []
+    categorized = defaultdict(dict)
+    resolved = defaultdict(dict)
+    operations = {}
+    for record, category, dest in files:
+        file_metadata.append(record)
+        categorized[category][record.path] = dest
+        # Conflict resolution produces a new path string per file
+        resolved[category][record.path] = os.path.join(os.path.dirname(dest), os.path.basename(dest))
+        operations[record.path] = 'copy'
+    return file_metadata, categorized, resolved, operations
+
+
+def build_table(files) -> FileTable:
+    table = FileTable()
+    for record, category, dest in files:
+        row = table.add(record)
+        row.category, row.destination, row.resolved = category, dest, dest
+        row.action = row.operation = 'copy'
+    return table
+
+
+def measure(build, count: int, seed: int) -> dict:
+    """
+    Bytes still allocated once build's result is complete (the records are consumed as they are produced).
+    """
+    gc.collect()
+    tracemalloc.start()
+    result = build(synthetic_files(count, seed))
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return {'bytes': current, 'peak_bytes': peak, 'bytes_per_file': round(current / count, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the memory held by the nested-dict shared store and '
+                                                 'the columnar FileTable for the same synthetic files.')
+    parser.add_argument('--files', type=int, default=200000, help='Number of synthetic files')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the synthetic paths')
+    parser.add_argument('--output', help='Where to write the JSON results')
+    args = parser.parse_args()
+    results = {
+        'files': args.files,
+        'dicts': measure(build_dicts, args.files, args.seed),
+        'file_table': measure(build_table, args.files, args.seed),
+    }
+    results['ratio'] = round(results['dicts']['bytes'] / results['file_table']['bytes'], 2)
+    for name in ('dicts', 'file_table'):
+        stats = results[name]
+        print(f"{name:12} {stats['bytes'] / 1e6:>10.1f} MB {stats['bytes_per_file']:>8.1f} B/file "
+              f"{stats['peak_bytes'] / 1e6:>10.1f} MB peak")
+    print(f"{'ratio':12} {results['ratio']:>10.2f}x")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+import os
+import sys
+import json
+import time
+import shutil
+import resource
+import argparse
+import platform
+import tempfile
+import subprocess
+
+from utils.file_utils import scan_files, categorize_files, copy_files
+from utils.conflict_resolver import DestinationIndex, resolve_conflicts
+from utils.html_report import generate_html_report
+from utils.xls_report import generate_csv_report, generate_excel_report, generate_master_report
+from bench.generate_tree import generate_tree
+
+
+def peak_rss_mb() -> float:
+    """
+    Peak resident set size of this process so far, in MB (ru_maxrss is KiB on Linux, bytes on macOS).
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def timed(results: dict, name: str, files, nbytes: int, fn, *args, **kwargs):
+    """
+    Run fn, store seconds, files/s, MB/s and peak RSS under results[name], and return fn's result.
+    files=None counts the items of the result. Peak RSS is process-wide, so it is the high-water
+    mark up to and including this stage.
+    """
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    if files is None:
+        files = len(result)
+    results[name] = {
+        'seconds': round(elapsed, 4),
+        'files': files,
+        'files_per_s': round(files / elapsed, 1) if elapsed else None,
+        'mb_per_s': round(nbytes / elapsed / 1e6, 2) if elapsed and nbytes else None,
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    }
+    return result
+
+
+def resolve_all(categorized_files: dict, file_metadata: list) -> dict:
+    records = {meta['path']: meta for meta in file_metadata}
+    index = DestinationIndex()
+    resolved = {}
+    for category, files in categorized_files.items():
+        strategy = category[:-1] if category.endswith('s') else category
+        resolved[category] = {src: resolve_conflicts(records[src], dest, strategy, index)[0]
+                              for src, dest in files.items()}
+    return resolved
+
+
+def run_benchmarks(source: str, destination: str) -> dict:
+    stages = {}
+    file_metadata = timed(stages, 'scan_files', None, 0, scan_files, source)
+    count = len(file_metadata)
+    total_bytes = sum(meta['size'] for meta in file_metadata)
+    categorized = timed(stages, 'categorize_files', count, 0, categorize_files, file_metadata, destination, source)
+    resolved = timed(stages, 'resolve_conflicts', count, 0, resolve_all, categorized, file_metadata)
+    timed(stages, 'copy_files', count, total_bytes, copy_files, resolved, destination)
+    for category in ('images', 'videos'):
+        if resolved.get(category):
+            timed(stages, f'generate_html_report[{category}]', len(resolved[category]), 0,
+                  generate_html_report, resolved, destination, category)
+    if resolved.get('audio'):
+        timed(stages, 'generate_csv_report[audio]', len(resolved['audio']), 0,
+              generate_csv_report, resolved, destination, 'audio')
+    if resolved.get('other'):
+        timed(stages, 'generate_excel_report', len(resolved['other']), 0,
+              generate_excel_report, resolved, destination)
+    timed(stages, 'generate_master_report', count, 0,
+          generate_master_report, file_metadata, categorized, resolved, destination)
+    return {'files': count, 'bytes': total_bytes, 'stages': stages}
+
+
+def environment() -> dict:
+    try:
+        revision = subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                                  cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        revision = None
+    return {
+        'revision': revision,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def compare(current: dict, baseline: dict):
+    print(f"{'stage':40} {'baseline s':>12} {'current s':>12} {'change':>8}")
+    for name, stats in current['stages'].items():
+        old = baseline.get('stages', {}).get(name)
+        if not old:
+            continue
+        change = (stats['seconds'] - old['seconds']) / old['seconds'] * 100 if old['seconds'] else 0
+        print(f"{name:40} {old['seconds']:>12.3f} {stats['seconds']:>12.3f} {change:>+7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time each organizer stage on a synthetic or existing tree.')
+    parser.add_argument('--source', help='Existing source tree to benchmark (default: generate one)')
+    parser.add_argument('--files', type=int, default=10000, help='Files to generate when no source is given')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the generated tree')
+    parser.add_argument('--workdir', help='Directory for the generated tree and destination (default: a temp dir)')
+    parser.add_argument('--output', default='bench_results.json', help='Where to write the JSON results')
+    parser.add_argument('--compare', help='Previous results JSON to compare against')
+    parser.add_argument('--keep', action='store_true', help='Keep the generated tree and destination')
+    args = parser.parse_args()
+
+    temporary = args.workdir is None
+    workdir = tempfile.mkdtemp(prefix='organizer-bench-') if temporary else args.workdir
+    os.makedirs(workdir, exist_ok=True)
+    source = args.source
+    generated = None
+    if source is None:
+        source = os.path.join(workdir, 'source')
+        generated = generate_tree(source, args.files, seed=args.seed)
+    destination = os.path.join(workdir, 'destination')
+    shutil.rmtree(destination, ignore_errors=True)
+    try:
+        results = run_benchmarks(source, destination)
+    finally:
+        if not args.keep:
+            shutil.rmtree(destination, ignore_errors=True)
+            if generated is not None:
+                shutil.rmtree(source, ignore_errors=True)
+            if temporary:
+                shutil.rmtree(workdir, ignore_errors=True)
+    results['environment'] = environment()
+    results['generated'] = generated
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    for name, stats in results['stages'].items():
+        print(f"{name:40} {stats['seconds']:>9.3f}s {stats['files_per_s'] or 0:>12.1f} files/s "
+              f"{stats['mb_per_s'] or 0:>9.2f} MB/s {stats['peak_rss_mb']:>9.1f} MB peak")
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,43 @@
 
-from nodes import SharedStore, FileScannerNode, FileCategorizerNode, ConflictResolverNode, FileCopierNode, ReportGeneratorNode
+import os
+import sys
+import time
+import signal
+import threading
+import subprocess
+from collections import defaultdict
+from nodes import SharedStore, FileScannerNode, FileCategorizerNode, ConflictResolverNode, FileCopierNode, ReportGeneratorNode, \
+    classifier_for
+from utils.metadata_cache import CACHE_FILENAME, MetadataCache
+from utils.dedup import HASH_INDEX_FILENAME, HashIndex, find_duplicates, is_within
+from utils.pipeline import Pipeline, Stage
+from utils.instrumentation import Instrumentation
+from utils.journal import CopyJournal, entry_for, record_from_entry
+from utils.file_table import FileTable
+from utils.checksums import ChecksumStore, write_audit_report
+from utils.copy_engine import remove_stale_temps
+from utils.watcher import Debouncer, WatchStatus, open_watcher
+from utils.sharding import journal_filename, manifest_path, plan_shards, read_manifest, read_plan, write_manifest, write_plan
 
 class FileOrganizerFlow:
-    def __init__(self, source_directory, destination_directory):
+    def __init__(self, source_directory, destination_directory, use_cache=True, workers=None, per_device=None,
+                 dedup=True, report_format='xlsx', instrumentation=None, resume=False, mode='copy',
+                 classifier=None, verify=None, io_scheduler=None):
         self.shared = SharedStore()
+        self.shared['instrumentation'] = self.instrumentation = instrumentation or Instrumentation()
+        self.shared['dedup'] = dedup
+        self.shared['report_format'] = report_format
+        self.shared['copy_workers'] = workers
+        self.shared['copy_per_device'] = per_device
+        self.shared['mode'] = mode
+        self.shared['classifier'] = classifier
+        self.shared['verify'] = verify
+        self.shared['io_scheduler'] = io_scheduler
+        self.shared['destination_directory'] = destination_directory
         self.source_directory = source_directory
         self.destination_directory = destination_directory
+        self.use_cache = use_cache
+        self.resume = resume
         self.nodes = [
             FileScannerNode(self.shared),
             FileCategorizerNode(self.shared),
@@ -13,9 +45,476 @@ class FileOrganizerFlow:
             FileCopierNode(self.shared),
             ReportGeneratorNode(self.shared)
         ]
+    def _open_stores(self):
+        if self.use_cache:
+            self.shared['cache'] = MetadataCache(self.destination_directory,
+                                                 classifier=classifier_for(self.shared).signature())
+        if self.shared['dedup']:
+            self.shared['hash_index'] = HashIndex(self.destination_directory)
+        if self.shared['verify']:
+            self.shared['checksums'] = ChecksumStore(self.destination_directory)
+        return CopyJournal(self.destination_directory)
+
+    def _close_stores(self):
+        for key in ('cache', 'hash_index', 'checksums', 'journal'):
+            store = self.shared.pop(key, None)
+            if store is not None:
+                store.close()
+
     def run(self):
-        self.nodes[0].run(self.source_directory)
-        self.nodes[1].run(self.destination_directory)
-        self.nodes[2].run()
-        self.nodes[3].run(self.destination_directory)
-        self.nodes[4].run(self.destination_directory)
\ No newline at end of file
+        try:
+            journal = self.shared['journal'] = self._open_stores()
+            plan = None
+            if self.resume:
+                plan, done, complete = journal.load()
+                if not plan or complete:
+                    print("No interrupted run to resume; running normally")
+                    plan = None
+            journal.open(append=plan is not None)
+            self.instrumentation.start()
+            try:
+                if plan is not None:
+                    self._resume_nodes(plan, done)
+                else:
+                    self._run_nodes()
+            finally:
+                self.instrumentation.stop()
+            journal.complete()
+            self._after_run(resumed=plan is not None)
+        finally:
+            self._close_stores()
+
+    def _after_run(self, resumed):
+        cache = self.shared.get('cache')
+        if cache is not None:
+            # Only a completed run has seen every source file, so only then drop stale entries.
+            # A resumed run never rescans the source, so it keeps them.
+            if not resumed:
+                cache.compact()
+            print(cache.summary())
+        checksums = self.shared.get('checksums')
+        if checksums is not None:
+            with self.instrumentation.span('export_checksums'):
+                checksums.export()
+
+    def audit(self, rehash_all=False) -> dict:
+        """
+        Re-check the files recorded by verified runs against their checksums: only files whose size or mtime
+        changed are re-hashed (every file with rehash_all). Problems are written to audit_report.csv.
+        """
+        checksums = ChecksumStore(self.destination_directory)
+        try:
+            self.instrumentation.start()
+            try:
+                with self.instrumentation.span('audit'):
+                    result = checksums.audit(rehash_all, workers=self.shared['copy_workers'])
+                self.instrumentation.count('audited', result['checked'])
+                self.instrumentation.count('re-hashed', result['rehashed'])
+                write_audit_report(self.destination_directory, result['problems'])
+                checksums.export()
+            finally:
+                self.instrumentation.stop()
+        finally:
+            checksums.close()
+        print(f"Audit: {result['checked']} files, {result['rehashed']} re-hashed, {len(result['problems'])} problems")
+        return result
+
+    def _restore(self, entries, done=None) -> tuple:
+        """
+        Rebuild the file table from journal or manifest entries, so nothing is rescanned, re-categorized
+        or rehashed. done maps already placed sources to (destination, operation).
+        Returns the directories of files still to be copied and their number.
+        """
+        done = done or {}
+        table = self.shared['file_table'] = FileTable()
+        self.shared['content_hashes'] = {}
+        self.shared['source_directory'] = self.source_directory
+        self.shared['journal_done'] = done
+        pending_dirs, left = set(), 0
+        for entry in entries:
+            src, dest, action = entry['src'], entry['dest'], entry['action']
+            row = table.add(record_from_entry(entry))
+            row.category, row.destination, row.action = entry['category'], dest, action
+            operation, checksum = entry.get('operation'), entry.get('sha256')
+            if src in done:
+                dest, operation, checksum = done[src]
+            row.resolved, row.operation, row.checksum = dest, operation, checksum
+            row.error = entry.get('error')
+            row.replace = entry.get('replace', False)
+            if action == 'copy' and src not in done:
+                left += 1
+                pending_dirs.add(os.path.dirname(dest))
+        return pending_dirs, left
+
+    def _resume_nodes(self, plan, done):
+        """
+        Finish an interrupted run from its journal: only copies without a 'done' entry are redone.
+        """
+        pending_dirs, left = self._restore(plan, done)
+        removed = remove_stale_temps(pending_dirs)
+        print(f"Resuming: {left} of {len(plan)} planned files left to copy, {removed} partial copies removed")
+        with self.instrumentation.span('FileCopierNode'):
+            self.nodes[3].run(self.destination_directory)
+        self._finish()
+
+    def _run_nodes(self):
+        span = self.instrumentation.span
+        with span('FileScannerNode'):
+            self.nodes[0].run(self.source_directory)
+        # Scanning is lazy, so most of the walk is timed as part of categorization
+        with span('FileCategorizerNode'):
+            self.nodes[1].run(self.destination_directory)
+        with span('ConflictResolverNode'):
+            self.nodes[2].run()
+        with span('FileCopierNode'):
+            self.nodes[3].run(self.destination_directory)
+        self._finish()
+
+    def _finish(self):
+        with self.instrumentation.span('ReportGeneratorNode'):
+            self.nodes[4].run(self.destination_directory)
+
+
+class PipelinedFileOrganizerFlow(FileOrganizerFlow):
+    """
+    Runs scanning, categorization (type detection and tag reads), conflict resolution and copying
+    as concurrent stages connected by bounded queues, so copying starts as soon as the first files
+    are scanned. Reports are still generated once, at the end.
+    """
+
+    def __init__(self, source_directory, destination_directory, queue_size=1024, classify_workers=4, **kwargs):
+        super().__init__(source_directory, destination_directory, **kwargs)
+        self.queue_size = queue_size
+        self.classify_workers = classify_workers
+        self.pipeline = None
+
+    def _run_nodes(self):
+        scanner, categorizer, resolver, copier = self.nodes[:4]
+        records = scanner.records(self.source_directory)
+        resolver.start()
+        copier.start()
+        self.pipeline = Pipeline(records, [
+            Stage('categorize', lambda meta: categorizer.process(meta, self.destination_directory),
+                  self.classify_workers),
+            Stage('resolve', resolver.process),
+            Stage('copy', copier.process, copier._engine.workers),
+            Stage('record', lambda item: copier.record(*item)),
+        ], maxsize=self.queue_size)
+        self.instrumentation.watch_queues(self.pipeline.depths)
+        with self.instrumentation.span('pipeline'):
+            self.pipeline.run()
+        self._finish()
+
+
+# Options every step of a sharded run must agree on; the plan records them and workers and reduce use its values
+PLAN_OPTIONS = ('mode', 'dedup')
+
+
+def apply_plan_options(shared, plan: dict):
+    for key, value in plan.get('options', {}).items():
+        if key in PLAN_OPTIONS and shared[key] != value:
+            print(f"Using {key}={value!r} from the shard plan instead of {shared[key]!r}")
+            shared[key] = value
+
+
+class ShardWorkerFlow(FileOrganizerFlow):
+    """
+    Map step of a sharded run: scan, categorize, resolve and copy one shard of the source tree (as listed
+    in the shard plan in the destination), then write the shard's manifest instead of reports.
+    The metadata cache and hash index are only read; files are published without ever replacing a file
+    another worker created under the same name. Several workers, on one or more hosts sharing the
+    destination, can run at the same time. Mode and dedup come from the plan.
+    """
+
+    def __init__(self, source_directory, destination_directory, shard_id, **kwargs):
+        super().__init__(source_directory, destination_directory, **kwargs)
+        self.shard_id = shard_id
+        self.shared['no_clobber'] = True
+
+    def _open_stores(self):
+        apply_plan_options(self.shared, read_plan(self.destination_directory))
+        if self.use_cache and os.path.exists(os.path.join(self.destination_directory, CACHE_FILENAME)):
+            self.shared['cache'] = MetadataCache(self.destination_directory, readonly=True,
+                                                 classifier=classifier_for(self.shared).signature())
+        if self.shared['dedup'] and os.path.exists(os.path.join(self.destination_directory, HASH_INDEX_FILENAME)):
+            self.shared['hash_index'] = HashIndex(self.destination_directory, readonly=True)
+        return CopyJournal(self.destination_directory, journal_filename(self.shard_id))
+
+    def _run_nodes(self):
+        plan = read_plan(self.destination_directory)
+        units = plan['shards'][self.shard_id]['units']
+        span = self.instrumentation.span
+        with span('FileScannerNode'):
+            self.shared['file_records'] = self.nodes[0].records(plan['source'], units)
+        with span('FileCategorizerNode'):
+            self.nodes[1].run(self.destination_directory)
+        with span('ConflictResolverNode'):
+            self.nodes[2].run()
+        with span('FileCopierNode'):
+            self.nodes[3].run(self.destination_directory)
+        self._finish()
+
+    def _finish(self):
+        with self.instrumentation.span('write_manifest'):
+            write_manifest(self.destination_directory, self.shard_id, self._manifest_entries())
+
+    def _manifest_entries(self):
+        hashes = self.shared.get('content_hashes', {})
+        for row in self.shared['file_table']:
+            action = row.action or 'failed'
+            entry = entry_for(row, row.category, row.resolved if action != 'failed' else None, action)
+            entry['shard'] = self.shard_id
+            entry['operation'] = row.operation
+            entry['sha256'] = row.checksum
+            if action == 'failed':
+                entry['error'] = row.error
+            entry['partial'], entry['full'] = hashes.get(entry['src'], (None, None))
+            yield entry
+
+    def _after_run(self, resumed):
+        cache = self.shared.get('cache')
+        if cache is not None:
+            print(cache.summary())
+
+
+class ShardedFileOrganizerFlow(FileOrganizerFlow):
+    """
+    Map-reduce over the source tree. plan() splits it into shards of similar file counts; each shard is
+    processed by a ShardWorkerFlow in its own process (run() starts them locally, or they can be started
+    as separate commands on other hosts); reduce() merges the manifests, records the results in the
+    metadata cache and hash index, and generates every report once.
+    The plan records the mode and dedup setting (PLAN_OPTIONS), and workers and reduce use those, so a
+    hand-typed command cannot run with settings that disagree with the rest of the run.
+    """
+
+    def __init__(self, source_directory, destination_directory, shards=None, worker_args=(), **kwargs):
+        super().__init__(source_directory, destination_directory, **kwargs)
+        self.shard_count = shards or os.cpu_count() or 1
+        self.worker_args = list(worker_args)
+
+    def plan(self) -> dict:
+        """
+        Write the shard plan to the destination and prepare the shared stores the workers read.
+        """
+        with self.instrumentation.span('plan_shards'):
+            shards = plan_shards(self.source_directory, self.shard_count)
+        # Workers open these read-only, so create, migrate and refresh them here
+        self._open_stores()
+        self._close_stores()
+        for shard in shards:
+            path = manifest_path(self.destination_directory, shard['id'])
+            if os.path.exists(path):
+                os.remove(path)
+        plan = {'source': os.path.abspath(self.source_directory), 'shards': shards,
+                'options': {key: self.shared[key] for key in PLAN_OPTIONS}}
+        write_plan(self.destination_directory, plan)
+        return plan
+
+    def run(self):
+        plan = self.plan()
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+        workers = [subprocess.Popen([sys.executable, script, self.source_directory, self.destination_directory,
+                                     '--shard', str(shard['id'])] + self.worker_args)
+                   for shard in plan['shards']]
+        with self.instrumentation.span('shard workers'):
+            failed = [shard_id for shard_id, worker in enumerate(workers) if worker.wait() != 0]
+        if failed:
+            raise RuntimeError(f"Shard workers failed: {failed}; rerun them with --shard N --resume, then --reduce")
+        self.reduce()
+
+    def reduce(self):
+        plan = read_plan(self.destination_directory)
+        missing = [shard['id'] for shard in plan['shards']
+                   if not os.path.exists(manifest_path(self.destination_directory, shard['id']))]
+        if missing:
+            raise RuntimeError(f"No manifest yet for shards {missing}")
+        self.source_directory = plan['source']
+        apply_plan_options(self.shared, plan)
+        try:
+            self._open_stores()
+            self.instrumentation.start()
+            try:
+                with self.instrumentation.span('merge_manifests'):
+                    entries = [entry for shard in plan['shards']
+                               for entry in read_manifest(self.destination_directory, shard['id'])]
+                    if self.shared['dedup'] and self.shared['mode'] != 'move':
+                        self._settle_duplicates(entries)
+                    self._restore(entries)
+                    self._merge(entries)
+                self._finish()
+            finally:
+                self.instrumentation.stop()
+            self._after_run(resumed=False)
+        finally:
+            self._close_stores()
+
+    def _settle_duplicates(self, entries):
+        """
+        Workers only detect duplicates within their shard and against files indexed before the run.
+        Copies of the same content made by different shards are found here (sizes shared between shards
+        first, then staged hashes of the copies); later copies are removed and reported as duplicates.
+        Skipped in move mode, and files that were moved ('move', 'copy+delete') are never removed: there the
+        placed file is the only remaining instance of its source.
+        """
+        copies = [entry for entry in entries
+                  if entry['action'] == 'copy' and entry['operation'] in ('copy', 'hardlink', 'symlink')]
+        shards_by_size = defaultdict(set)
+        for entry in copies:
+            shards_by_size[entry['size']].add(entry['shard'])
+        candidates = [{'path': entry['dest'], 'size': entry['size']} for entry in copies
+                      if len(shards_by_size[entry['size']]) > 1]
+        with self.instrumentation.span('find_duplicates'):
+            duplicates, _ = find_duplicates(candidates)
+        if not duplicates:
+            return
+        removed = saved = 0
+        for entry in copies:
+            original = duplicates.get(entry['dest'])
+            if original is None:
+                continue
+            try:
+                os.remove(entry['dest'])
+            except OSError as e:
+                print(f"Error removing duplicate {entry['dest']}: {e}")
+                continue
+            entry['action'], entry['dest'], entry['operation'] = 'duplicate', original, None
+            removed += 1
+            saved += entry['size']
+        self.instrumentation.count('duplicates', removed, saved)
+        print(f"Removed {removed} copies duplicated across shards")
+
+    def _merge(self, entries):
+        """
+        Apply the workers' results to the stores: cache entries, hash index rows and checksums (operations
+        and final destinations are already in the file table). Workers never replace each other's files, so two copies
+        claiming one destination mean a worker ran on a filesystem without hard links; those are reported.
+        """
+        cache = self.shared.get('cache')
+        hash_index = self.shared.get('hash_index')
+        checksums = self.shared.get('checksums')
+        claimed = {}
+        for entry, row in zip(entries, self.shared['file_table']):
+            src, dest, action = entry['src'], entry['dest'], entry['action']
+            if action == 'copy' and entry['operation']:
+                if claimed.setdefault(dest, src) != src:
+                    print(f"Destination collision between shards: {claimed[dest]} and {src} -> {dest}")
+                if hash_index is not None:
+                    hash_index.add(dest, row.size, row.mtime, entry['partial'], entry['full'] or entry.get('sha256'))
+                if checksums is not None and entry.get('sha256'):
+                    checksums.add(dest, row.size, row.mtime, entry['sha256'])
+            placed = action == 'copy' and entry['operation'] or action == 'duplicate'
+            if cache is not None and placed and is_within(dest, self.destination_directory):
+                cache.update(row, dest)
+
+
+class WatchFileOrganizerFlow(FileOrganizerFlow):
+    """
+    Long-running mode: after one full run to catch up, the source tree is watched (inotify, or polling where
+    it is unavailable) and files written or moved into it are ingested in batches once they have settled.
+    Each batch is scanned, categorized, resolved and copied on its own; only the gallery pages of months that
+    received files are rewritten and the reports (kept as CSV) get the batch's rows appended.
+    A status file in the destination shows the queue depth and ingest rate. Stops on SIGINT or SIGTERM.
+    """
+
+    def __init__(self, source_directory, destination_directory, settle=2.0, batch_size=1000, poll=False,
+                 poll_interval=5.0, status_interval=5.0, **kwargs):
+        super().__init__(source_directory, destination_directory, **kwargs)
+        self.settle = settle
+        self.batch_size = batch_size
+        self.poll = poll
+        self.poll_interval = poll_interval
+        self.status_interval = status_interval
+        self.shared['watch'] = True
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    def _on_signal(self, signum, frame):
+        # A second signal interrupts the batch in progress
+        if self._stop.is_set():
+            raise KeyboardInterrupt
+        print("Stopping after the current batch")
+        self.stop()
+
+    def run(self):
+        handlers = {}
+        if threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                handlers[signum] = signal.signal(signum, self._on_signal)
+        # Watch before catching up, so files arriving during the first run are not missed
+        watcher = open_watcher(self.source_directory, self.poll, self.poll_interval)
+        scheduler = self.shared['io_scheduler']
+        status = WatchStatus(self.destination_directory, watcher.backend,
+                             io_stats=scheduler.stats if scheduler is not None else None)
+        debouncer = Debouncer(self.settle)
+        try:
+            self.shared['journal'] = self._open_stores()
+            self.instrumentation.start()
+            try:
+                status.write('catching up')
+                self._batch(status)
+                print(f"Watching {self.source_directory} ({watcher.backend}); stop with Ctrl+C")
+                next_status = 0
+                while not self._stop.is_set():
+                    for path in watcher.read(min(self.settle / 2, 1.0)):
+                        debouncer.add(path)
+                    if watcher.overflowed:
+                        watcher.overflowed = False
+                        print("Watch events were lost; rescanning the source")
+                        status.write('rescanning', len(debouncer))
+                        self._batch(status)
+                        continue
+                    ready = debouncer.ready(self.batch_size)
+                    if ready:
+                        status.write('ingesting', len(debouncer), len(ready))
+                        self._batch(status, ready)
+                        next_status = 0
+                    if time.monotonic() >= next_status:
+                        status.write('watching', len(debouncer))
+                        next_status = time.monotonic() + self.status_interval
+            finally:
+                self.instrumentation.stop()
+        finally:
+            watcher.close()
+            status.write('stopped', len(debouncer))
+            self._close_stores()
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+
+    def _batch(self, status, paths=None):
+        """
+        Run the nodes over the given files, or over the whole source tree (regenerating the reports) without paths.
+        Each batch is journaled as a run of its own and the stores are committed after it.
+        """
+        started = time.monotonic()
+        journal = self.shared['journal']
+        journal.open()
+        self.shared['append_reports'] = paths is not None
+        span = self.instrumentation.span
+        with span('FileScannerNode'):
+            self.shared['file_records'] = self.nodes[0].records(self.source_directory, paths=paths)
+        with span('FileCategorizerNode'):
+            self.nodes[1].run(self.destination_directory)
+        with span('ConflictResolverNode'):
+            self.nodes[2].run()
+        with span('FileCopierNode'):
+            self.nodes[3].run(self.destination_directory)
+        self._finish()
+        journal.complete()
+        journal.close()
+        table = self.shared['file_table']
+        placed = [row for row in table.rows('copy') if row.operation]
+        if paths is None:
+            self._after_run(resumed=False)
+        else:
+            checksums = self.shared.get('checksums')
+            if checksums is not None:
+                with span('append_checksums'):
+                    checksums.append_sums(row.resolved for row in placed if row.checksum)
+        for key in ('cache', 'hash_index', 'checksums'):
+            store = self.shared.get(key)
+            if store is not None:
+                store.commit()
+        status.batch(len(placed), sum(row.size for row in placed), time.monotonic() - started,
+                     errors=sum(1 for _ in table.rows('failed')))
@@ -1,13 +1,182 @@
+import os
+import sys
+import json
+import shlex
 import argparse
-from flow import FileOrganizerFlow
+import cProfile
+from flow import (FileOrganizerFlow, PipelinedFileOrganizerFlow, ShardWorkerFlow, ShardedFileOrganizerFlow,
+                  WatchFileOrganizerFlow)
+from utils.instrumentation import Instrumentation
+from utils.file_types import FileTypeClassifier, RAW_EXTENSIONS
+from utils.io_scheduler import ORDERS, PRIORITIES, IOScheduler, parse_rate
+
+def worker_arguments(args) -> list:
+    """
+    Command-line options a shard worker needs to behave like the coordinating run.
+    """
+    worker_args = ['--mode', args.mode]
+    if args.verify:
+        worker_args += ['--verify', args.verify]
+    for flag, enabled in (('--no-cache', args.no_cache), ('--no-dedup', args.no_dedup),
+                          ('--sniff', args.sniff), ('--raw', args.raw)):
+        if enabled:
+            worker_args.append(flag)
+    if args.io_adaptive is False:
+        worker_args.append('--no-io-adapt')
+    for flag, value in (('--workers', args.workers), ('--per-device', args.per_device),
+                        ('--io-order', args.io_order), ('--io-priority', args.io_priority)):
+        if value is not None:
+            worker_args += [flag, str(value)]
+    # Workers run side by side, so each gets its share of the I/O caps
+    shards = args.shards or args.plan_shards or 1
+    for flag, value in (('--io-bandwidth', args.io_bandwidth), ('--io-iops', args.io_iops)):
+        if value is not None:
+            worker_args += [flag, f'{value / shards:.3f}']
+    return worker_args
+
+def rate_argument(value: str) -> float:
+    try:
+        return parse_rate(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid rate {value!r} (expected a positive number, e.g. 500, 20M or 1.5G)")
+
+def shard_commands(args) -> list:
+    options = ' '.join(shlex.quote(arg) for arg in worker_arguments(args))
+    commands = [f"python main.py {shlex.quote(args.source)} {shlex.quote(args.destination)} --shard {k} {options}"
+                for k in range(args.plan_shards)]
+    commands.append(f"python main.py {shlex.quote(args.source)} {shlex.quote(args.destination)} --reduce "
+                    f"--report-format {shlex.quote(args.report_format)} {options}")
+    return commands
 
 def main():
     parser = argparse.ArgumentParser(description='Organize files from source to destination directory.')
     parser.add_argument('source', help='Source directory to organize')
     parser.add_argument('destination', help='Destination directory for organized files')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Ignore the metadata cache and reprocess every file')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of parallel copy workers (default: based on CPU count)')
+    parser.add_argument('--per-device', type=int, default=None,
+                        help='Maximum concurrent copies per destination device (default: no extra limit)')
+    parser.add_argument('--no-dedup', action='store_true',
+                        help='Copy files even if their content already exists in the destination')
+    parser.add_argument('--report-format', choices=['xlsx', 'csv'], default='xlsx',
+                        help='Format of the master report; csv suits very large runs')
+    parser.add_argument('--pipelined', action='store_true',
+                        help='Run scan, categorize, resolve and copy as concurrent stages')
+    parser.add_argument('--queue-size', type=int, default=1024,
+                        help='Maximum items waiting between pipelined stages')
+    parser.add_argument('--progress', action='store_true',
+                        help='Show a live progress line on stderr')
+    parser.add_argument('--trace', metavar='FILE',
+                        help='Write a Chrome trace (JSON) of node timings, counters and queue depths to FILE')
+    parser.add_argument('--profile', metavar='FILE',
+                        help='Run under cProfile (main thread) and write the stats to FILE')
+    parser.add_argument('--mode', choices=['copy', 'move', 'hardlink', 'symlink'], default='copy',
+                        help='How files are placed; move and hardlink avoid copying data on the same filesystem '
+                             '(across devices a move copies then deletes the source, a hardlink copies)')
+    parser.add_argument('--sniff', action='store_true',
+                        help='Identify files by their first bytes, so missing or wrong extensions are handled')
+    parser.add_argument('--raw', action='store_true',
+                        help='Treat camera RAW files (CR2, NEF, ARW, DNG, ...) as images')
+    parser.add_argument('--resume', action='store_true',
+                        help='Finish an interrupted run from its journal instead of starting over')
+    parser.add_argument('--shards', type=int, metavar='N',
+                        help='Split the source into N shards, process each in its own worker process, then merge')
+    parser.add_argument('--plan-shards', type=int, metavar='N',
+                        help='Only write a plan of N shards to the destination, for workers started with --shard')
+    parser.add_argument('--shard', type=int, metavar='K',
+                        help='Run the worker for shard K of the plan in the destination (any host sharing it)')
+    parser.add_argument('--reduce', action='store_true',
+                        help='Merge the manifests of all finished shards and generate the reports')
+    parser.add_argument('--verify', nargs='?', const='quick', choices=['quick', 'full'],
+                        help='Hash files while copying, check each copy before it is published (quick: re-read its '
+                             'first and last 64 KiB; full: re-read all of it from disk) and record SHA-256 '
+                             'checksums in the master report and a SHA256SUMS file in the destination')
+    parser.add_argument('--audit', nargs='?', const='changed', choices=['changed', 'all'],
+                        help='Re-check the destination against the recorded checksums, re-hashing only files whose '
+                             'size or mtime changed (or all of them) and writing audit_report.csv')
+    parser.add_argument('--watch', action='store_true',
+                        help='Keep running: after a full run, watch the source (inotify, or polling) and ingest new '
+                             'files in batches, updating only the affected gallery pages and appending to the '
+                             'reports (kept as CSV); status is written to .organizer_status.json in the destination')
+    parser.add_argument('--settle', type=float, default=2.0, metavar='SECONDS',
+                        help='With --watch, how long a new file must stay unchanged before it is ingested')
+    parser.add_argument('--batch-size', type=int, default=1000,
+                        help='With --watch, maximum files ingested per batch')
+    parser.add_argument('--poll', nargs='?', type=float, const=5.0, metavar='SECONDS',
+                        help='With --watch, poll the source every SECONDS (default 5) instead of using inotify')
+    parser.add_argument('--io-bandwidth', type=rate_argument, metavar='RATE',
+                        help='Cap the bytes read and copied per second across all stages, e.g. 50M or 1G')
+    parser.add_argument('--io-iops', type=rate_argument, metavar='RATE',
+                        help='Cap the file operations (listings, stats, header reads, copies) per second')
+    parser.add_argument('--io-order', choices=ORDERS,
+                        help='Order reads by inode or by physical extent: on spinning disks (auto), always '
+                             '(inode, extent) or never (none)')
+    parser.add_argument('--io-priority', choices=PRIORITIES,
+                        help='low or idle: ionice-style I/O priority, plus backing off sooner when device latency '
+                             'rises and half the concurrency per device')
+    parser.add_argument('--no-io-adapt', dest='io_adaptive', action='store_false', default=None,
+                        help='Keep the per-device concurrency at --per-device instead of adapting it to latency')
+    parser.add_argument('--io-stats', metavar='FILE',
+                        help='Write the I/O scheduler statistics (per stage and per device) as JSON to FILE')
     args = parser.parse_args()
-    flow = FileOrganizerFlow(args.source, args.destination)
-    flow.run()
+    instrumentation = Instrumentation(progress=args.progress, trace=bool(args.trace))
+    classifier = FileTypeClassifier(sniff=args.sniff)
+    if args.raw:
+        classifier.add('image', *RAW_EXTENSIONS)
+    io_scheduler = None
+    if any(value is not None for value in (args.io_bandwidth, args.io_iops, args.io_order, args.io_priority,
+                                           args.io_adaptive, args.io_stats)):
+        # Created before any worker threads or processes, so they inherit the I/O priority
+        io_scheduler = IOScheduler(
+            bytes_per_second=args.io_bandwidth, iops=args.io_iops,
+            max_per_device=args.per_device or args.workers or min(32, (os.cpu_count() or 1) * 4),
+            adaptive=args.io_adaptive is not False, order=args.io_order or 'auto',
+            priority=args.io_priority or 'normal')
+    options = dict(use_cache=not args.no_cache, workers=args.workers, per_device=args.per_device,
+                   dedup=not args.no_dedup, report_format=args.report_format, instrumentation=instrumentation,
+                   resume=args.resume, mode=args.mode,
+                   classifier=classifier, verify=args.verify, io_scheduler=io_scheduler)
+    run = 'run'
+    if args.audit:
+        flow = FileOrganizerFlow(args.source, args.destination, **options)
+        run = 'audit'
+    elif args.shard is not None:
+        flow = ShardWorkerFlow(args.source, args.destination, args.shard, **options)
+    elif args.shards or args.plan_shards or args.reduce:
+        flow = ShardedFileOrganizerFlow(args.source, args.destination, shards=args.shards or args.plan_shards,
+                                        worker_args=worker_arguments(args), **options)
+        run = 'reduce' if args.reduce else 'plan' if args.plan_shards else 'run'
+    elif args.watch:
+        flow = WatchFileOrganizerFlow(args.source, args.destination, settle=args.settle, batch_size=args.batch_size,
+                                      poll=args.poll is not None, poll_interval=args.poll or 5.0, **options)
+    elif args.pipelined:
+        flow = PipelinedFileOrganizerFlow(args.source, args.destination, queue_size=args.queue_size, **options)
+    else:
+        flow = FileOrganizerFlow(args.source, args.destination, **options)
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        result = flow.audit(args.audit == 'all') if run == 'audit' else getattr(flow, run)()
+        if run == 'plan':
+            for command in shard_commands(args):
+                print(command)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+        if args.trace:
+            instrumentation.export_trace(args.trace)
+        if args.io_stats:
+            with open(args.io_stats, 'w', encoding='utf-8') as f:
+                json.dump(io_scheduler.stats(), f, indent=2)
+    print(instrumentation.summary())
+    if io_scheduler is not None:
+        print(io_scheduler.summary())
+    if run == 'audit' and result['problems']:
+        sys.exit(1)
 
 if __name__ == '__main__':
     main()
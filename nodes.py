@@ -1,70 +1,382 @@
-from utils.file_utils import scan_files, categorize_files, detect_file_type, extract_audio_metadata, copy_files
-from utils.conflict_resolver import resolve_conflicts
-from utils.html_report import generate_html_report
+import os
+from utils.file_utils import iter_files, stat_files, categorize_file, detect_file_type, extract_audio_metadata_batch
+from utils.copy_engine import CopyEngine
+from utils.conflict_resolver import KEEP, REPLACE, DestinationIndex, resolve_conflicts
+from utils.dedup import PARTIAL_SIZE, DuplicateFinder, find_duplicates, is_within
+from utils.html_report import THUMBNAIL_DIRNAME, generate_html_report, generate_thumbnails_batch, video_placeholder
 from utils.xls_report import generate_csv_report
+from utils.instrumentation import instrumentation_for
+from utils.io_scheduler import io_scheduler_for
+from utils.file_types import DEFAULT_CLASSIFIER
+from utils.capture_date import read_capture_dates
+from utils.file_table import FileTable
 
 class SharedStore(dict):
     pass
 
+def classifier_for(shared):
+    return shared.get('classifier') or DEFAULT_CLASSIFIER
+
 class FileScannerNode:
     def __init__(self, shared):
         self.shared = shared
     def run(self, source_directory):
+        # Rows are produced lazily; FileCategorizerNode consumes them in a single pass
+        self.shared['file_records'] = self.records(source_directory)
+
+    def records(self, source_directory, units=None, paths=None):
+        # units limits the scan to (directory, recursive) parts of the tree, e.g. one shard;
+        # paths limits it to the given files, e.g. a batch reported by a watcher.
+        # Each scanned file is added to a new file table and yielded as its row.
         self.shared['source_directory'] = source_directory
-        self.shared['file_metadata'] = scan_files(source_directory)
+        table = self.shared['file_table'] = FileTable()
+        scheduler = io_scheduler_for(self.shared)
+        if paths is not None:
+            files = stat_files(paths)
+        elif units is None:
+            files = iter_files(source_directory, scheduler=scheduler, on_error=self._on_error)
+        else:
+            files = (record for directory, recursive in units
+                     for record in iter_files(directory, recursive, scheduler, self._on_error))
+        rows = (table.add(record) for record in instrumentation_for(self.shared).counted('scanned', files))
+        cache = self.shared.get('cache')
+        if cache is not None:
+            rows = self._apply_cache(rows, cache)
+        return rows
+
+    def _on_error(self, path, error):
+        # Unreadable files and directories are skipped, but counted so the run summary shows them
+        print(f"Error reading {path}: {error}")
+        instrumentation_for(self.shared).count('scanned', errors=1)
+
+    def _apply_cache(self, rows, cache):
+        # Restore type, tags and capture date of unchanged files; remember where they were already placed.
+        # Without a type (classified under another --sniff/--raw setting) the file is categorized again.
+        for row in rows:
+            entry = cache.lookup(row)
+            if entry:
+                row.type = entry['type']
+                row.extra_metadata = entry['tags'] or None
+                row.captured = entry['captured']
+                if entry['type'] and entry['destination'] and os.path.exists(entry['destination']):
+                    row.action = 'unchanged'
+                    row.resolved = entry['destination']
+            yield row
 
 class FileCategorizerNode:
     def __init__(self, shared):
         self.shared = shared
     def run(self, destination_directory):
         source_directory = self.shared.get('source_directory')
-        # Extract audio metadata for audio files
-        for meta in self.shared['file_metadata']:
-            if detect_file_type(meta['path']) == 'audio':
-                meta['extra_metadata'] = extract_audio_metadata(meta['path'])
-        self.shared['categorized_files'] = categorize_files(
-            self.shared['file_metadata'], destination_directory, source_directory)
+        for _ in self.shared.pop('file_records', ()):
+            pass  # the scan fills the file table
+        table = self.shared['file_table']
+        instrumentation = instrumentation_for(self.shared)
+        scheduler = io_scheduler_for(self.shared)
+        # Types not restored from the cache are detected in one batch (header reads run in parallel when sniffing)
+        with instrumentation.span('classify_batch'):
+            types = classifier_for(self.shared).classify_batch(
+                (row.path for row in table if row.type is None), self.shared.get('sniff_workers'), scheduler)
+        pending_audio = []
+        for row in table:
+            if row.type is None:
+                row.type = types[row.path]
+            if row.type == 'audio' and not row.extra_metadata:
+                pending_audio.append(row.path)
+        # Capture dates of photos and videos come from their headers, read in parallel
+        with instrumentation.span('read_capture_dates'):
+            captured = read_capture_dates(
+                (row.path for row in table
+                 if row.type in ('image', 'video') and row.captured is None and row.action != 'unchanged'),
+                self.shared.get('capture_workers'), scheduler)
+        instrumentation.count('capture dates read', len(captured))
+        for path, timestamp in captured.items():
+            table.find(path).captured = timestamp or 0
+        # Read every audio file's tags once, in one batch, then share them with categorization and reports
+        with instrumentation.span('extract_audio_metadata_batch'):
+            tags = extract_audio_metadata_batch(pending_audio, self.shared.get('tag_workers'), scheduler)
+        instrumentation.count('audio tags read', len(pending_audio))
+        for path, audio_metadata in tags.items():
+            table.find(path).extra_metadata = audio_metadata
+        with instrumentation.span('categorize_files'):
+            for row in table:
+                row.category, row.destination = categorize_file(row, destination_directory, source_directory,
+                                                                known_destinations=table.unchanged)
+
+    def process(self, row, destination_directory):
+        """
+        Categorize one row for the pipelined flow. Returns (row, category, destination).
+        Safe to call from several threads: each call only updates its own row.
+        """
+        scheduler = io_scheduler_for(self.shared)
+        if scheduler is not None and row.action != 'unchanged':
+            # Type sniffing, capture date and tags are header reads of this one file
+            with scheduler.io(row.path, 'tags'):
+                category, dest = self._categorize(row, destination_directory)
+        else:
+            category, dest = self._categorize(row, destination_directory)
+        row.category, row.destination = category, dest
+        instrumentation_for(self.shared).count('categorized', 1)
+        return row, category, dest
+
+    def _categorize(self, row, destination_directory):
+        if row.type is None:
+            row.type = detect_file_type(row.path, classifier_for(self.shared))
+        return categorize_file(row, destination_directory, self.shared.get('source_directory'),
+                               self.shared['file_table'].unchanged)
 
 class ConflictResolverNode:
     def __init__(self, shared):
         self.shared = shared
     def run(self):
-        resolved = {}
-        for category, files in self.shared['categorized_files'].items():
-            resolved[category] = {}
-            for src, dest in files.items():
-                strategy = category[:-1] if category.endswith('s') else category
-                resolved[category][src] = resolve_conflicts(self.shared['file_metadata'][0], dest, strategy)
-        self.shared['conflict_resolved_files'] = resolved
+        table = self.shared['file_table']
+        # Content duplicates (of destination files or of earlier files in this run) are not copied
+        duplicates, hashes = {}, {}
+        instrumentation = instrumentation_for(self.shared)
+        if self.shared.get('dedup', True):
+            with instrumentation.span('find_duplicates'):
+                duplicates, hashes = find_duplicates(
+                    (row for row in table if row.action != 'unchanged'), self.shared.get('hash_index'))
+            for src in duplicates:
+                table.find(src).action = 'duplicate'
+            instrumentation.count('duplicates', len(duplicates), sum(table.find(src).size for src in duplicates))
+        self.shared['content_hashes'] = hashes
+        # One listing per destination folder; also catches collisions between files of this run
+        index = self.shared['destination_index'] = DestinationIndex()
+        for row in table.rows('unchanged'):
+            index.claim(row.resolved)
+        with instrumentation.span('resolve_conflicts'):
+            self._resolve_all(table, index)
+        # Point each duplicate at the destination that holds its content. An original from this run that is not
+        # copied (an existing file won its conflict) holds none, so its first duplicate is copied in its place.
+        replacements = {}
+        for src, original in duplicates.items():
+            row = table.find(src)
+            holder = table.find(replacements.get(original, original))
+            if holder is not None and holder.action == 'kept':
+                replacements[original] = src
+                self._resolve(row, row.destination, index)
+                continue
+            row.resolved = holder.resolved if holder is not None else original
+        journal = self.shared.get('journal')
+        if journal is not None:
+            for row in table:
+                journal.plan(row, row.category, row.resolved, row.action, row.replace)
+
+    def _resolve_all(self, table, index):
+        for row in table:
+            if row.action is not None:
+                continue  # already organized by a previous run, or a duplicate
+            self._resolve(row, row.destination, index)
+
+    @staticmethod
+    def _resolve(row, dest, index):
+        # An existing destination file that wins the conflict is kept and the file is not copied ('kept');
+        # otherwise the file is copied, over the existing file if it wins (row.replace)
+        category = row.category
+        strategy = category[:-1] if category.endswith('s') else category
+        row.resolved, decision = resolve_conflicts(row, dest, strategy, index)
+        row.action = 'kept' if decision == KEEP else 'copy'
+        row.replace = decision == REPLACE
+
+    def start(self):
+        table = self.shared['file_table']
+        self._index = self.shared['destination_index'] = DestinationIndex()
+        self._destinations = table.resolved.by_source()
+        # In move mode an earlier source may already be at its destination when a later file is compared to it
+        self._finder = DuplicateFinder(self.shared.get('hash_index'), moved=self._destinations) \
+            if self.shared.get('dedup', True) else None
+        self.shared['content_hashes'] = self._finder.hashes if self._finder else {}
+
+    def process(self, item):
+        """
+        Resolve one categorized file for the pipelined flow (single worker only).
+        Returns (row, destination, action) with action 'copy', 'unchanged', 'duplicate' or 'kept'.
+        """
+        row, category, dest = item
+        if row.action == 'unchanged':
+            self._index.claim(dest)
+        elif self._finder is not None and (original := self._finder.check(row.path, row.size)) is not None:
+            row.resolved = dest = self._destinations.get(original, original)
+            row.action = 'duplicate'
+            instrumentation_for(self.shared).count('duplicates', 1, row.size)
+        else:
+            self._resolve(row, dest, self._index)
+            dest = row.resolved
+            if row.action == 'kept' and self._finder is not None:
+                self._finder.discard(row.path, row.size)  # not copied, so later files cannot duplicate it
+        journal = self.shared.get('journal')
+        if journal is not None:
+            journal.plan(row, category, dest, row.action, row.replace)
+        return row, dest, row.action
 
 class FileCopierNode:
     def __init__(self, shared):
         self.shared = shared
     def run(self, destination_directory):
-        copy_files(self.shared['conflict_resolved_files'], destination_directory)
-        self.shared['copied_files'] = self.shared['conflict_resolved_files']
+        table = self.shared['file_table']
+        # When resuming, files the journal already records as copied are not copied again
+        done = self.shared.get('journal_done') or {}
+        pending = [row for row in table.rows('copy') if not done or row.path not in done]
+        scheduler = io_scheduler_for(self.shared)
+        if scheduler is not None:
+            # On spinning disks, sources are read in inode (or extent) order rather than scan order
+            pending = scheduler.order(pending, path=lambda row: row.path, inode=lambda row: row.ino)
+        pending = [(row.path, row.resolved, row.destination, row.replace) for row in pending]
+        engine = CopyEngine(workers=self.shared.get('copy_workers'),
+                            per_device_limit=self.shared.get('copy_per_device'),
+                            on_copied=self._on_copied, mode=self.shared.get('mode', 'copy'),
+                            no_clobber=self.shared.get('no_clobber', False),
+                            index=self.shared.get('destination_index'), verify=self.shared.get('verify'),
+                            scheduler=scheduler, on_failed=self._on_failed, on_existing=self._on_existing)
+        instrumentation = instrumentation_for(self.shared)
+        with instrumentation.span('copy_files'):
+            failed = engine.copy_all(pending)
+        instrumentation.count('copy errors', errors=len(failed))
+        for src, *_ in failed:
+            table.find(src).action = 'failed'
+        for row in table:
+            if row.action == 'copy' or row.action == 'duplicate':
+                self.record(row, row.resolved, row.action)
+
+    def start(self):
+        self._engine = CopyEngine(workers=self.shared.get('copy_workers'),
+                                  per_device_limit=self.shared.get('copy_per_device'),
+                                  on_copied=self._on_copied, mode=self.shared.get('mode', 'copy'),
+                                  verify=self.shared.get('verify'), scheduler=io_scheduler_for(self.shared),
+                                  on_failed=self._on_failed, on_existing=self._on_existing)
+
+    def _on_copied(self, src, dest, operation, checksum=None):
+        # Remember what was actually done (a move may have fallen back to copy+delete), where the file
+        # ended up (no_clobber may have picked another name) and its checksum for the reports
+        row = self.shared['file_table'].find(src)
+        row.operation = operation
+        row.checksum = checksum
+        if dest != row.resolved:
+            row.resolved = dest
+        journal = self.shared.get('journal')
+        if journal is not None:
+            journal.done(src, dest, operation, checksum)
+
+    def _on_existing(self, src, dest):
+        # The destination already holds a file under this name, which is kept instead of this one
+        self.shared['file_table'].find(src).action = 'kept'
+
+    def _on_failed(self, src, dest, error):
+        # Keep the reason with the row, so the master report (and shard manifests) can show it
+        print(f"Error placing {src} at {dest}: {error}")
+        self.shared['file_table'].find(src).error = str(error)
+
+    def process(self, item):
+        """
+        Copy one resolved file for the pipelined flow. Returns the item (with action 'kept' if an existing file
+        was kept instead), or None if the copy failed.
+        """
+        row, dest, action = item
+        if action == 'copy':
+            operation = self._engine.copy(row.path, dest, row.destination, row.replace)
+            if not operation:
+                instrumentation_for(self.shared).count('copy errors', errors=1)
+                row.action = 'failed'
+                return None
+            if operation == 'existing':
+                return row, dest, row.action
+        return item
+
+    def record(self, meta, dest, action):
+        """
+        Record a finished file in the hash index and metadata cache (single thread only).
+        Only files the engine actually placed in the destination are indexed and cached, and duplicates only
+        when the file holding their content is in the destination.
+        """
+        destination_directory = self.shared.get('destination_directory')
+        if destination_directory is not None and not is_within(dest, destination_directory):
+            return
+        if action == 'copy':
+            if not meta.operation:
+                return  # not placed by this run
+            instrumentation_for(self.shared).count('copied', 1, meta['size'])
+            checksum = meta.checksum
+            hash_index = self.shared.get('hash_index')
+            if hash_index is not None:
+                partial, full = self.shared.get('content_hashes', {}).get(meta['path'], (None, None))
+                if checksum is not None:
+                    # The verified copy's checksum is the full hash dedup would otherwise compute later
+                    full = full or checksum
+                    if partial is None and meta['size'] <= 2 * PARTIAL_SIZE:
+                        partial = checksum
+                hash_index.add(dest, meta['size'], meta['mtime'], partial, full)
+            checksums = self.shared.get('checksums')
+            if checksums is not None and checksum is not None:
+                checksums.add(dest, meta['size'], meta['mtime'], checksum)
+        cache = self.shared.get('cache')
+        if cache is not None and action in ('copy', 'duplicate'):
+            cache.update(meta, dest)
 
 class ReportGeneratorNode:
     def __init__(self, shared):
         self.shared = shared
     def run(self, destination_directory):
-        # HTML reports for images and videos
+        # HTML galleries for images and videos, showing cached thumbnails instead of the originals.
+        # Only month pages that received files this run are rewritten.
+        instrumentation = instrumentation_for(self.shared)
+        table = self.shared['file_table']
         for category in ['images', 'videos']:
-            files = self.shared['copied_files'].get(category, {})
+            files = table.resolved.get(category, {})
             if files:
-                generate_html_report(self.shared['copied_files'], destination_directory, category)
+                changed_months = {_month_of(row.resolved) for row in table.rows('copy', category) if row.operation}
+                mtimes = {row.resolved: row.mtime for row in table.rows(category=category)
+                          if row.action != 'duplicate' and row.resolved and _month_of(row.resolved) in changed_months}
+                cache_dir = os.path.join(destination_directory, category, THUMBNAIL_DIRNAME)
+                if category == 'images':
+                    with instrumentation.span('generate_thumbnails_batch'):
+                        thumbnails = generate_thumbnails_batch(files.values(), cache_dir,
+                                                               workers=self.shared.get('thumbnail_workers'),
+                                                               scheduler=io_scheduler_for(self.shared))
+                    with instrumentation.span('generate_html_report[images]'):
+                        generate_html_report(table.resolved, destination_directory, category, thumbnails,
+                                             mtimes=mtimes, changed_months=changed_months)
+                else:
+                    with instrumentation.span('generate_html_report[videos]'):
+                        generate_html_report(table.resolved, destination_directory, category,
+                                             mtimes=mtimes, changed_months=changed_months,
+                                             default_thumbnail=video_placeholder(cache_dir))
+        # Watch mode keeps every report as CSV so each batch can append its rows instead of rewriting the report
+        watch = self.shared.get('watch', False)
+        append = self.shared.get('append_reports', False)
         # CSV report for audio
-        if self.shared['copied_files'].get('audio', {}):
-            generate_csv_report(self.shared['copied_files'], destination_directory, 'audio')
+        if table.resolved.get('audio', {}):
+            with instrumentation.span('generate_csv_report[audio]'):
+                generate_csv_report(table.resolved, destination_directory, 'audio',
+                                    audio_metadata=table.audio_metadata, append=append)
         # Excel report for other
-        if self.shared['copied_files'].get('other', {}):
-            from utils.xls_report import generate_excel_report
-            generate_excel_report(self.shared['copied_files'], destination_directory)
+        if table.resolved.get('other', {}):
+            if watch:
+                with instrumentation.span('generate_csv_report[other]'):
+                    generate_csv_report(table.resolved, destination_directory, 'other', mtimes=table.mtimes,
+                                        append=append)
+            else:
+                from utils.xls_report import generate_excel_report
+                with instrumentation.span('generate_excel_report'):
+                    generate_excel_report(table.resolved, destination_directory, mtimes=table.mtimes)
         # Master Excel report for all files
         from utils.xls_report import generate_master_report
-        generate_master_report(
-            self.shared['file_metadata'],
-            self.shared['categorized_files'],
-            self.shared['copied_files'],
-            destination_directory
-        )
\ No newline at end of file
+        with instrumentation.span('generate_master_report'):
+            generate_master_report(
+                table,
+                table.planned,
+                table.resolved,
+                destination_directory,
+                duplicates=table.duplicates,
+                operations=table.operations,
+                checksums=table.checksums if self.shared.get('verify') else None,
+                failed=table.failed,
+                unchanged=table.unchanged,
+                kept=table.kept,
+                output_format='csv' if watch else self.shared.get('report_format', 'xlsx'),
+                append=append
+            )
+
+def _month_of(dest):
+    # (year, month) gallery folder of a destination path
+    return tuple(dest.split(os.sep)[-3:-1])
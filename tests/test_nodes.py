@@ -1,32 +1,118 @@
-# Design Doc: File Organization Tool
+import argparse
+import csv
+import os
+import shlex
+import sqlite3
 
-> Please DON'T remove notes for AI
+import pytest
 
-## Requirements
+import nodes
+from flow import FileOrganizerFlow, PipelinedFileOrganizerFlow, ShardedFileOrganizerFlow, ShardWorkerFlow
+from main import shard_commands
+from utils.conflict_resolver import PLACE
 
-> Notes for AI: Keep it simple and clear.
-> If the requirements are abstract, write concrete user stories
+FLOWS = [FileOrganizerFlow, PipelinedFileOrganizerFlow]
 
-1. **User Story 1**: As a user, I want to categorize files from a source directory into a destination directory based on file type, creation date, and last modified date.
-2. **User Story 2**: As a user, I want the system to handle name conflicts by renaming files appropriately.
-3. **User Story 3**: As a user, I want to generate HTML and CSV reports of the organized files for record-keeping.
 
-## Flow Design
+def _write(path, text, mtime=None):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+    return path
 
-> Notes for AI:
-> 1. Consider the design patterns of agent, map-reduce, rag, and workflow. Apply them if they fit.
-> 2. Present a concise, high-level description of the workflow.
 
-### Applicable Design Pattern:
+def _report(destination):
+    with open(os.path.join(destination, 'master_report.csv'), newline='') as f:
+        return {row['Source Path']: row for row in csv.DictReader(f)}
 
-1. **Map-Reduce**: Map files into categories based on type and date, then reduce them into organized directories.
-2. **Agentic File Organizer**:
-   - *Context*: The source directory containing files.
-   - *Action*: Organize files into the destination directory.
 
-### Flow High-level Design:
+def _indexed(destination):
+    conn = sqlite3.connect(os.path.join(destination, '.organizer_hashes.sqlite'))
+    try:
+        return [row[0] for row in conn.execute('SELECT path FROM hashes')]
+    finally:
+        conn.close()
 
-1. **File Discovery Node**: This node scans the source directory and retrieves file metadata.
-2. **File Categorization Node**: This node categorizes files based on type, creation date, and last modified date.
-3. **Conflict Resolution Node**: This node handles name conflicts by renaming files.
-4. **Report Generation Node**: This node generates HTML and CSV reports of the organized files.
\ No newline at end of file
+
+def _args(**overrides):
+    args = dict(source='/photos in', destination='/out', plan_shards=2, shards=None, mode='copy', verify=None,
+                no_cache=False, no_dedup=False, sniff=False, raw=False, io_adaptive=None, workers=None,
+                per_device=None, io_order=None, io_priority=None, io_bandwidth=None, io_iops=None,
+                report_format='csv')
+    args.update(overrides)
+    return argparse.Namespace(**args)
+
+
+def test_shard_commands_pass_options_to_workers_and_reduce():
+    commands = shard_commands(_args(mode='move', no_dedup=True, io_bandwidth=100.0))
+    assert len(commands) == 3
+    for command in commands:
+        argv = shlex.split(command)
+        assert argv[2:4] == ['/photos in', '/out']
+        assert argv[argv.index('--mode') + 1] == 'move' and '--no-dedup' in argv
+        assert argv[argv.index('--io-bandwidth') + 1] == '50.000'
+    assert '--shard' in shlex.split(commands[1]) and '--reduce' in shlex.split(commands[-1])
+
+
+def test_sharded_move_reduce_keeps_cross_shard_duplicates(tmp_path):
+    source, destination = tmp_path / 'src', str(tmp_path / 'dst')
+    for i in range(3):
+        _write(source / 'a' / f'x{i}.txt', f'same {i}')
+        _write(source / 'b' / f'y{i}.txt', f'same {i}')
+    plan = ShardedFileOrganizerFlow(str(source), destination, shards=2, mode='move', dedup=False,
+                                    report_format='csv').plan()
+    assert plan['options'] == {'mode': 'move', 'dedup': False}
+    for shard in plan['shards']:
+        ShardWorkerFlow(str(source), destination, shard['id'], mode='move', dedup=False, report_format='csv').run()
+    # A hand-typed reduce without the run's options still uses the plan's
+    ShardedFileOrganizerFlow(str(source), destination, report_format='csv').reduce()
+    placed = sorted(name for _, _, names in os.walk(os.path.join(destination, 'other')) for name in names
+                    if name.endswith('.txt'))
+    assert placed == sorted(f'{prefix}{i}.txt' for prefix in 'xy' for i in range(3))
+    assert not any(names for _, _, names in os.walk(source))
+
+
+@pytest.mark.parametrize('flow_class', FLOWS)
+def test_only_destination_files_are_indexed(tmp_path, flow_class):
+    source, destination = tmp_path / 'src', tmp_path / 'dst'
+    notes = _write(source / 'notes.txt', 'my notes', mtime=1_500_000_000)
+    copy = _write(source / 'sub' / 'copy.txt', 'my notes', mtime=1_500_000_000)
+    _write(destination / 'other' / 'notes.txt', 'other notes')  # newer, so it is kept
+    flow_class(str(source), str(destination), report_format='csv').run()
+    report = _report(destination)
+    assert report[str(notes)]['Result'] == 'Kept existing'
+    assert report[str(copy)]['Result'] == 'Copied'
+    assert (destination / 'other' / 'sub' / 'copy.txt').read_text() == 'my notes'
+    assert all(path.startswith(str(destination) + os.sep) for path in _indexed(destination))
+    # The next run finds everything already in place
+    flow_class(str(source), str(destination), report_format='csv').run()
+    assert _report(destination)[str(copy)]['Result'] == 'Unchanged'
+
+
+@pytest.mark.parametrize('flow_class', FLOWS)
+def test_existing_destination_is_reported_as_kept(tmp_path, monkeypatch, flow_class):
+    source, destination = tmp_path / 'src', tmp_path / 'dst'
+    new = _write(source / 'a.txt', 'new')
+    # Another process creates the destination after conflict resolution
+    monkeypatch.setattr(nodes, 'resolve_conflicts', lambda row, dest, strategy, index: (dest, PLACE))
+    _write(destination / 'other' / 'a.txt', 'old')
+    flow_class(str(source), str(destination), report_format='csv').run()
+    assert (destination / 'other' / 'a.txt').read_text() == 'old'
+    result = _report(destination)[str(new)]
+    assert result['Result'] == 'Kept existing' and result['Operation'] == ''
+
+
+@pytest.mark.parametrize('flow_class', FLOWS)
+def test_conflicts_keep_or_replace_the_existing_file(tmp_path, flow_class):
+    source, destination = tmp_path / 'src', tmp_path / 'dst'
+    older = _write(source / 'old.txt', 'from source', mtime=1_500_000_000)
+    newer = _write(source / 'new.txt', 'from source', mtime=1_800_000_000)
+    _write(destination / 'other' / 'old.txt', 'in destination', mtime=1_600_000_000)
+    _write(destination / 'other' / 'new.txt', 'in destination', mtime=1_600_000_000)
+    flow_class(str(source), str(destination), report_format='csv', dedup=False).run()
+    assert (destination / 'other' / 'old.txt').read_text() == 'in destination'
+    assert (destination / 'other' / 'new.txt').read_text() == 'from source'
+    report = _report(destination)
+    assert report[str(older)]['Result'] == 'Kept existing'
+    assert report[str(newer)]['Result'] == 'Copied'
@@ -1,34 +1,159 @@
-# Design Doc: File Organization Tool
+import io
+import os
+import struct
+import datetime
 
-> Please DON'T remove notes for AI
+import pytest
 
-## Requirements
+from utils.capture_date import MP4_EPOCH_OFFSET, jpeg_capture_date, mp4_capture_date, tiff_capture_date
+from utils.conflict_resolver import DestinationIndex
+from utils.dedup import HashIndex
+from utils.file_table import FileTable
+from utils.file_types import FileTypeClassifier, sniff_type
+from utils.file_utils import FileRecord
+from utils.io_scheduler import TokenBucket, parse_rate
+from utils.watcher import Debouncer
 
-> Notes for AI: Keep it simple and clear.
-> If the requirements are abstract, write concrete user stories
+TAKEN = datetime.datetime(2021, 6, 5, 14, 30, 0)
 
-1. **User Story 1**: As a user, I want to categorize files from a source directory into a destination directory based on file type, so that I can easily find my files.
-2. **User Story 2**: As a user, I want to organize files based on their creation date and last modified date, so that I can prioritize my recent files.
-3. **User Story 3**: As a user, I want to handle name conflicts by renaming files, so that I do not lose any files during the organization process.
-4. **User Story 4**: As a user, I want to generate HTML and CSV reports of the organized files, so that I can keep track of my file organization.
 
-## Flow Design
+def _tiff(when: datetime.datetime) -> bytes:
+    # Little-endian TIFF with one IFD holding DateTime (ASCII, 20 bytes) right after it
+    value = when.strftime('%Y:%m:%d %H:%M:%S').encode() + b'\x00'
+    return b'II*\x00' + struct.pack('<I', 8) + struct.pack('<HHHII', 1, 0x0132, 2, len(value), 26) \
+        + struct.pack('<I', 0) + value
 
-> Notes for AI:
-> 1. Consider the design patterns of agent, map-reduce, rag, and workflow. Apply them if they fit.
-> 2. Present a concise, high-level description of the workflow.
 
-### Applicable Design Pattern:
+def _box(kind: bytes, payload: bytes) -> bytes:
+    return struct.pack('>I', 8 + len(payload)) + kind + payload
 
-1. **Map-Reduce**: Map files into categories based on type, creation date, and last modified date, then reduce them into organized folders.
-2. **Agentic File Organizer**:
-   - *Context*: The entire set of files in the source directory.
-   - *Action*: Organize files into the destination directory.
 
-### Flow High-level Design:
+def test_allocate_continues_suffixes_on_disk(tmp_path):
+    for name in ('a.jpg', 'a_1.jpg', 'a_4.jpg'):
+        (tmp_path / name).write_bytes(b'')
+    index = DestinationIndex()
+    assert index.exists(str(tmp_path / 'a.jpg'))
+    assert index.allocate(str(tmp_path / 'a.jpg')) == str(tmp_path / 'a_5.jpg')
+    assert index.allocate(str(tmp_path / 'a.jpg')) == str(tmp_path / 'a_6.jpg')
+    assert index.exists(str(tmp_path / 'a_6.jpg')) and not index.on_disk(str(tmp_path / 'a_6.jpg'))
 
-1. **File Discovery Node**: Scans the source directory and retrieves file metadata.
-2. **File Categorization Node**: Categorizes files based on type, creation date, and last modified date.
-3. **Conflict Resolution Node**: Handles name conflicts by renaming files.
-4. **File Movement Node**: Moves files to the destination directory.
-5. **Report Generation Node**: Generates HTML and CSV reports of the organized files.
\ No newline at end of file
+
+def test_allocate_claims_names_within_a_run(tmp_path):
+    index = DestinationIndex()
+    path = str(tmp_path / 'b.txt')
+    assert not index.exists(path)
+    index.claim(path)
+    assert index.allocate(path) == str(tmp_path / 'b_1.txt')
+
+
+def test_file_table_views():
+    table = FileTable()
+    rows = [table.add(FileRecord(f'/src/{name}', size, 0.0, 0.0)) for size, name in enumerate('abcde')]
+    for row in rows:
+        row.category = 'other'
+        row.destination = row.resolved = '/dst/other/' + row.name
+    rows[0].action = 'copy'
+    rows[1].action, rows[1].resolved = 'duplicate', '/dst/other/a'
+    rows[2].action = 'unchanged'
+    rows[3].action, rows[3].error = 'failed', 'disk full'
+    rows[4].action, rows[4].resolved = 'kept', '/dst/other/old_e'
+    assert table.find('/src/c').size == 2 and table.find('/src/x') is None
+    assert [row.path for row in table.rows('copy')] == ['/src/a']
+    assert dict(table.resolved.by_source()) == {'/src/a': '/dst/other/a', '/src/c': '/dst/other/c'}
+    assert dict(table.duplicates) == {'/src/b': '/dst/other/a'}
+    assert dict(table.kept) == {'/src/e': '/dst/other/old_e'}
+    assert table.failed['/src/d'] == 'disk full'
+    assert list(table.resolved) == ['other'] and len(table.planned['other']) == 5
+
+
+@pytest.mark.parametrize('header, expected', [
+    (b'\xff\xd8\xff\xe0' + bytes(12), 'image'),
+    (b'\x89PNG\r\n\x1a\n' + bytes(8), 'image'),
+    (b'\x00\x00\x00\x18ftypheic' + bytes(4), 'image'),
+    (b'\x00\x00\x00\x18ftypisom' + bytes(4), 'video'),
+    (b'\x00\x00\x00\x18ftypM4A ' + bytes(4), 'audio'),
+    (b'ID3\x04' + bytes(12), 'audio'),
+    (b'fLaC' + bytes(12), 'audio'),
+    (bytes([0xFF, 0xFB, 0x90, 0x64]) + bytes(12), 'audio'),  # MPEG-1 layer III, 128 kbit/s, 44.1 kHz
+    (b'\xff' * 16, None),  # padding: bad bitrate index
+    (bytes([0xFF, 0xFB, 0x00, 0x64]) + bytes(12), None),  # free bitrate
+    (bytes([0xFF, 0xFB, 0x9C, 0x64]) + bytes(12), None),  # reserved sample rate
+    (b'hello world12345', None),
+])
+def test_sniff_type(header, expected):
+    assert sniff_type(header) == expected
+
+
+def test_utf16_text_is_not_sniffed_as_audio(tmp_path):
+    path = tmp_path / 'notes.txt'
+    path.write_bytes('﻿Hello, world'.encode('utf-16-le'))
+    assert FileTypeClassifier(sniff=True).classify(str(path)) == 'other'
+    assert sniff_type(path.read_bytes()[:16], weak=False) is None
+
+
+def test_sniffing_still_recognizes_mp3_without_extension(tmp_path):
+    path = tmp_path / 'track'
+    path.write_bytes(bytes([0xFF, 0xFB, 0x90, 0x64]) + bytes(60))
+    assert FileTypeClassifier(sniff=True).classify(str(path)) == 'audio'
+    assert FileTypeClassifier(sniff=False).classify(str(path)) == 'other'
+
+
+def test_tiff_and_jpeg_capture_date():
+    tiff = _tiff(TAKEN)
+    assert tiff_capture_date(tiff) == TAKEN.timestamp()
+    segment = b'Exif\x00\x00' + tiff
+    jpeg = b'\xff\xd8' + b'\xff\xe1' + struct.pack('>H', 2 + len(segment)) + segment + b'\xff\xda'
+    assert jpeg_capture_date(jpeg) == TAKEN.timestamp()
+    assert tiff_capture_date(_tiff(TAKEN)[:-20] + b'0000:00:00 00:00:00\x00') is None
+    assert jpeg_capture_date(b'\xff\xd8\xff\xda') is None
+
+
+def test_mp4_capture_date():
+    created = 1_600_000_000
+    mvhd = _box(b'mvhd', b'\x00\x00\x00\x00' + struct.pack('>I', created + MP4_EPOCH_OFFSET) + bytes(24))
+    data = _box(b'ftyp', b'isom' + bytes(4)) + _box(b'mdat', bytes(100)) + _box(b'moov', mvhd)
+    assert mp4_capture_date(io.BytesIO(data), len(data)) == created
+    assert mp4_capture_date(io.BytesIO(data[:-len(mvhd) - 8]), len(data) - len(mvhd) - 8) is None
+
+
+def test_debouncer_waits_for_files_to_settle(tmp_path):
+    path = tmp_path / 'incoming.jpg'
+    path.write_bytes(b'part')
+    debouncer = Debouncer(settle=2.0)
+    debouncer.add(str(path), now=0.0)
+    assert debouncer.ready(now=1.0) == []
+    path.write_bytes(b'partial write')  # still growing: re-armed
+    assert debouncer.ready(now=2.5) == [] and len(debouncer) == 1
+    assert debouncer.ready(now=5.0) == [str(path)] and len(debouncer) == 0
+    debouncer.add(str(tmp_path / 'vanished'), now=0.0)
+    assert debouncer.ready(now=5.0) == [] and len(debouncer) == 0
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('500', 500), ('20M', 20 * 1024 ** 2), ('1.5G', 1.5 * 1024 ** 3), ('64kb/s', 64 * 1024),
+])
+def test_parse_rate(value, expected):
+    assert parse_rate(value) == expected
+
+
+@pytest.mark.parametrize('value', ['0', '-5M', 'nan', 'fast', ''])
+def test_parse_rate_rejects_invalid(value):
+    with pytest.raises(ValueError):
+        parse_rate(value)
+
+
+def test_token_bucket_allows_burst_then_paces():
+    bucket = TokenBucket(rate=1000)
+    assert bucket.take(1000) == 0.0
+    assert 0.05 < bucket.take(100) <= 0.1
+
+
+def test_hash_index_ignores_paths_outside_destination(tmp_path):
+    destination = tmp_path / 'dst'
+    destination.mkdir()
+    index = HashIndex(str(destination))
+    index.add(str(tmp_path / 'src' / 'notes.txt'), 5, 0.0)
+    index.add(str(destination / 'other' / 'notes.txt'), 5, 0.0)
+    paths = [row[0] for row in index.conn.execute('SELECT path FROM hashes')]
+    index.close()
+    assert paths == [str(destination / 'other' / 'notes.txt')]
@@ -0,0 +1,184 @@
+import os
+import struct
+import datetime
+from typing import Dict
+from concurrent.futures import ThreadPoolExecutor
+from utils.file_types import HEIF_BRANDS
+
+HEADER_SIZE = 64 * 1024  # EXIF lives in the first APP1 segment, which is at most 64 KiB
+MAX_TOP_LEVEL_BOXES = 64
+MP4_EPOCH_OFFSET = 2082844800  # seconds from 1904-01-01 (QuickTime epoch) to 1970-01-01
+CAPTURE_MIN_PARALLEL = 32
+
+# EXIF tags, in order of preference
+EXIF_IFD_POINTER = 0x8769
+DATETIME_ORIGINAL = 0x9003
+DATETIME_DIGITIZED = 0x9004
+DATETIME = 0x0132
+QUICKTIME_BOXES = {b'ftyp', b'moov', b'mdat', b'free', b'skip', b'wide', b'pnot', b'uuid'}
+
+
+def _exif_datetime(value: bytes):
+    try:
+        text = value.split(b'\x00', 1)[0].decode('ascii').strip()
+        return datetime.datetime.strptime(text[:19], '%Y:%m:%d %H:%M:%S').timestamp()
+    except (ValueError, OverflowError, OSError):
+        return None  # empty, '0000:00:00 00:00:00' or otherwise malformed
+
+
+def _read_ifd(tiff: bytes, offset: int, endian: str) -> dict:
+    """
+    Return tag -> raw entry (type, count, value/offset field) for one IFD of a TIFF structure.
+    """
+    entries = {}
+    if offset + 2 > len(tiff):
+        return entries
+    count = struct.unpack_from(endian + 'H', tiff, offset)[0]
+    for i in range(count):
+        pos = offset + 2 + i * 12
+        if pos + 12 > len(tiff):
+            break
+        tag, ftype, n = struct.unpack_from(endian + 'HHI', tiff, pos)
+        entries[tag] = (ftype, n, pos + 8)
+    return entries
+
+
+def _ascii_value(tiff: bytes, entry, endian: str) -> bytes:
+    ftype, n, field = entry
+    if ftype != 2:
+        return b''
+    if n <= 4:
+        return tiff[field:field + n]
+    offset = struct.unpack_from(endian + 'I', tiff, field)[0]
+    return tiff[offset:offset + n]
+
+
+def tiff_capture_date(tiff: bytes):
+    """
+    DateTimeOriginal (or DateTimeDigitized, or DateTime) from a TIFF/EXIF block, as a local timestamp.
+    """
+    if tiff[:4] == b'II*\x00':
+        endian = '<'
+    elif tiff[:4] == b'MM\x00*':
+        endian = '>'
+    else:
+        return None
+    try:
+        ifd0 = _read_ifd(tiff, struct.unpack_from(endian + 'I', tiff, 4)[0], endian)
+        exif = {}
+        if EXIF_IFD_POINTER in ifd0:
+            pointer = struct.unpack_from(endian + 'I', tiff, ifd0[EXIF_IFD_POINTER][2])[0]
+            exif = _read_ifd(tiff, pointer, endian)
+        for ifd, tag in ((exif, DATETIME_ORIGINAL), (exif, DATETIME_DIGITIZED), (ifd0, DATETIME)):
+            if tag in ifd:
+                timestamp = _exif_datetime(_ascii_value(tiff, ifd[tag], endian))
+                if timestamp is not None:
+                    return timestamp
+    except struct.error:
+        pass
+    return None
+
+
+def jpeg_capture_date(header: bytes):
+    """
+    Walk the JPEG segments in header up to the image data and parse the first EXIF APP1 segment.
+    """
+    pos = 2
+    while pos + 4 <= len(header) and header[pos] == 0xFF:
+        marker = header[pos + 1]
+        if marker == 0xDA or marker == 0xD9:  # start of scan / end of image
+            break
+        length = struct.unpack_from('>H', header, pos + 2)[0]
+        if marker == 0xE1 and header[pos + 4:pos + 10] == b'Exif\x00\x00':
+            return tiff_capture_date(header[pos + 10:pos + 2 + length])
+        pos += 2 + length
+    return None
+
+
+def _boxes(f, start: int, end: int):
+    """
+    Yield (type, payload offset, box end) for the ISO base media boxes between start and end, reading only headers.
+    """
+    pos = start
+    for _ in range(MAX_TOP_LEVEL_BOXES):
+        if pos + 8 > end:
+            return
+        f.seek(pos)
+        head = f.read(16)
+        if len(head) < 8:
+            return
+        size, kind = struct.unpack_from('>I4s', head)
+        payload = pos + 8
+        if size == 1 and len(head) == 16:
+            size = struct.unpack_from('>Q', head, 8)[0]
+            payload = pos + 16
+        elif size == 0:
+            size = end - pos
+        if size < payload - pos:
+            return
+        yield kind, payload, pos + size
+        pos += size
+
+
+def mp4_capture_date(f, file_size: int):
+    """
+    Creation time from the movie header (moov/mvhd) of an MP4/QuickTime file, as a UTC timestamp.
+    Only box headers are read while looking for moov, so a moov at the end of a large file is cheap to reach.
+    """
+    for kind, payload, end in _boxes(f, 0, file_size):
+        if kind != b'moov':
+            continue
+        for child, child_payload, child_end in _boxes(f, payload, end):
+            if child != b'mvhd':
+                continue
+            f.seek(child_payload)
+            data = f.read(min(32, child_end - child_payload))
+            if len(data) < 8:
+                return None
+            if data[0] == 1 and len(data) >= 12:
+                created = struct.unpack_from('>Q', data, 4)[0]
+            else:
+                created = struct.unpack_from('>I', data, 4)[0]
+            return created - MP4_EPOCH_OFFSET if created > MP4_EPOCH_OFFSET else None
+        return None
+    return None
+
+
+def read_capture_date(path: str):
+    """
+    Capture date of a photo or video as a timestamp, read from the file header only (no decoding),
+    or None if the file has none. Handles EXIF in JPEG and TIFF-based RAW files, an EXIF block found in the
+    header of other images (e.g. HEIC) and the mvhd creation time of MP4/QuickTime files.
+    """
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(HEADER_SIZE)
+            if header[:2] == b'\xff\xd8':
+                return jpeg_capture_date(header)
+            if header[:4] in (b'II*\x00', b'MM\x00*'):
+                return tiff_capture_date(header)
+            if header[4:8] in QUICKTIME_BOXES and not (header[4:8] == b'ftyp' and header[8:12] in HEIF_BRANDS):
+                return mp4_capture_date(f, os.fstat(f.fileno()).st_size)
+            exif = header.find(b'Exif\x00\x00')
+            if exif >= 0:
+                return tiff_capture_date(header[exif + 6:])
+    except OSError as e:
+        print(f"Error reading capture date of {path}: {e}")
+    return None
+
+
+def read_capture_dates(paths, workers: int = None, scheduler=None) -> Dict[str, float]:
+    """
+    Read capture dates for many files on a thread pool (the work is small reads, so it suits slow or
+    network storage). Returns path -> timestamp or None.
+    With a scheduler (utils.io_scheduler.IOScheduler), the reads go through it, in its order.
+    """
+    paths = list(paths)
+    read = read_capture_date
+    if scheduler is not None:
+        paths = scheduler.order(paths)
+        read = scheduler.wrap(read_capture_date, 'tags', HEADER_SIZE)
+    if len(paths) < CAPTURE_MIN_PARALLEL:
+        return {path: read(path) for path in paths}
+    with ThreadPoolExecutor(max_workers=workers or min(32, (os.cpu_count() or 1) * 4)) as pool:
+        return dict(zip(paths, pool.map(read, paths)))
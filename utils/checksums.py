@@ -0,0 +1,133 @@
+import os
+import csv
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from utils.dedup import full_hash
+
+CHECKSUMS_FILENAME = '.organizer_checksums.sqlite'
+SUMS_FILENAME = 'SHA256SUMS'
+AUDIT_REPORT_FILENAME = 'audit_report.csv'
+
+
+def sums_line(checksum: str, rel_path: str) -> str:
+    """
+    One line in GNU sha256sum format; names containing a backslash or newline are escaped the way sha256sum does.
+    """
+    if '\\' in rel_path or '\n' in rel_path:
+        escaped = rel_path.replace('\\', '\\\\').replace('\n', '\\n')
+        return '\\' + checksum + '  ' + escaped + '\n'
+    return f"{checksum}  {rel_path}\n"
+
+
+class ChecksumStore:
+    """
+    SHA-256 of every file the organizer verified into the destination, with the size and mtime it had then,
+    stored as SQLite in the destination directory. export() writes them as a sha256sum-compatible SHA256SUMS
+    sidecar; audit() re-checks the archive, re-hashing only files whose size or mtime changed since.
+    """
+
+    def __init__(self, destination_directory: str, filename: str = CHECKSUMS_FILENAME):
+        self.destination_directory = destination_directory
+        self.path = os.path.join(destination_directory, filename)
+        self.lock = threading.RLock()  # the connection is shared by pipeline stages
+        os.makedirs(destination_directory, exist_ok=True)
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS checksums (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, sha256 TEXT)')
+
+    def add(self, path: str, size: int, mtime: float, checksum: str):
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO checksums (path, size, mtime, sha256) VALUES (?, ?, ?, ?)',
+                              (path, size, mtime, checksum))
+
+    def export(self, filename: str = SUMS_FILENAME) -> str:
+        """
+        Write every checksum to the sidecar file (paths relative to the destination, so
+        'cd destination && sha256sum -c SHA256SUMS' checks the archive). Replaced atomically.
+        """
+        report_path = os.path.join(self.destination_directory, filename)
+        tmp = report_path + '.tmp'
+        with self.lock:
+            self.conn.commit()
+            rows = self.conn.execute('SELECT path, sha256 FROM checksums ORDER BY path')
+            with open(tmp, 'w', encoding='utf-8', newline='\n') as f:
+                for path, checksum in rows:
+                    f.write(sums_line(checksum, os.path.relpath(path, self.destination_directory)))
+        os.replace(tmp, report_path)
+        return report_path
+
+    def append_sums(self, paths, filename: str = SUMS_FILENAME) -> str:
+        """
+        Append the checksums of the given destination paths to the sidecar file, without rewriting it.
+        """
+        report_path = os.path.join(self.destination_directory, filename)
+        with self.lock:
+            self.conn.commit()
+            with open(report_path, 'a', encoding='utf-8', newline='\n') as f:
+                for path in sorted(paths):
+                    row = self.conn.execute('SELECT sha256 FROM checksums WHERE path = ?', (path,)).fetchone()
+                    if row:
+                        f.write(sums_line(row[0], os.path.relpath(path, self.destination_directory)))
+        return report_path
+
+    def audit(self, rehash_all: bool = False, workers: int = None) -> dict:
+        """
+        Check every recorded file. Files whose size and mtime are unchanged are trusted (unless rehash_all);
+        the others are re-hashed on a thread pool. A changed file whose content still matches gets its new size
+        and mtime recorded. Returns {'checked', 'rehashed', 'problems': [(path, status, expected, actual)]} with
+        status 'missing', 'changed' or 'unreadable'.
+        """
+        with self.lock:
+            rows = self.conn.execute('SELECT path, size, mtime, sha256 FROM checksums').fetchall()
+        problems = []
+        suspects = []
+        for path, size, mtime, checksum in rows:
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                problems.append((path, 'missing', checksum, None))
+                continue
+            except OSError:
+                problems.append((path, 'unreadable', checksum, None))
+                continue
+            if rehash_all or (st.st_size, st.st_mtime) != (size, mtime):
+                suspects.append((path, checksum, st))
+
+        def rehash(item):
+            try:
+                return full_hash(item[0])
+            except OSError:
+                return None
+
+        with ThreadPoolExecutor(max_workers=workers or min(32, (os.cpu_count() or 1) * 4)) as pool:
+            digests = list(pool.map(rehash, suspects))
+        with self.lock:
+            for (path, checksum, st), digest in zip(suspects, digests):
+                if digest is None:
+                    problems.append((path, 'unreadable', checksum, None))
+                elif digest != checksum:
+                    problems.append((path, 'changed', checksum, digest))
+                else:
+                    self.conn.execute('UPDATE checksums SET size = ?, mtime = ? WHERE path = ?',
+                                      (st.st_size, st.st_mtime, path))
+            self.conn.commit()
+        return {'checked': len(rows), 'rehashed': len(suspects), 'problems': problems}
+
+    def commit(self):
+        with self.lock:
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+
+
+def write_audit_report(destination_directory: str, problems: list) -> str:
+    report_path = os.path.join(destination_directory, AUDIT_REPORT_FILENAME)
+    with open(report_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Path', 'Status', 'Expected SHA-256', 'Actual SHA-256'])
+        writer.writerows(sorted(problems))
+    return report_path
@@ -1,32 +1,111 @@
 import os
-import shutil
+import re
+from utils.dedup import same_content
 
-def resolve_conflicts(file_info: dict, destination_path: str, strategy: str) -> str:
+_SUFFIX_RE = re.compile(r'^(.*)_(\d+)$')
+# Decisions of resolve_conflicts
+PLACE = 'place'      # the destination is free (possibly under an '_N' name)
+KEEP = 'keep'        # the existing destination file is kept and the file is not copied
+REPLACE = 'replace'  # the file overwrites the existing destination file
+
+
+class DestinationIndex:
+    """
+    In-memory index of destination file names used for conflict resolution.
+    Each target folder is listed once with os.scandir; afterwards existence checks and suffix
+    allocation are O(1) dict/set lookups. Paths handed out during the current run are claimed,
+    so two source files mapping to the same destination do not collide with each other either.
+    """
+
+    def __init__(self):
+        self._names = {}     # directory -> set of names on disk or claimed in this run
+        self._on_disk = {}   # directory -> set of names that existed when first listed
+        self._suffixes = {}  # directory -> {(stem, ext): highest numeric suffix in use}
+
+    def _listing(self, directory: str) -> set:
+        names = self._names.get(directory)
+        if names is None:
+            try:
+                with os.scandir(directory) as it:
+                    names = {entry.name for entry in it}
+            except OSError:
+                names = set()
+            self._names[directory] = names
+            self._on_disk[directory] = set(names)
+            suffixes = self._suffixes[directory] = {}
+            for name in names:
+                self._note_suffix(suffixes, name)
+        return names
+
+    @staticmethod
+    def _note_suffix(suffixes: dict, name: str):
+        stem, ext = os.path.splitext(name)
+        match = _SUFFIX_RE.match(stem)
+        if match:
+            key = (match.group(1), ext)
+            suffixes[key] = max(suffixes.get(key, 0), int(match.group(2)))
+
+    def exists(self, path: str) -> bool:
+        directory, name = os.path.split(path)
+        return name in self._listing(directory)
+
+    def on_disk(self, path: str) -> bool:
+        directory, name = os.path.split(path)
+        self._listing(directory)
+        return name in self._on_disk[directory]
+
+    def claim(self, path: str):
+        directory, name = os.path.split(path)
+        self._listing(directory).add(name)
+        self._note_suffix(self._suffixes[directory], name)
+
+    def allocate(self, path: str) -> str:
+        """
+        Claim and return the next free '<stem>_<n><ext>' variant of path.
+        The highest suffix per stem is tracked, so no per-candidate probing is needed.
+        """
+        directory, name = os.path.split(path)
+        names = self._listing(directory)
+        stem, ext = os.path.splitext(name)
+        idx = self._suffixes[directory].get((stem, ext), 0) + 1
+        while f"{stem}_{idx}{ext}" in names:
+            idx += 1
+        new_path = os.path.join(directory, f"{stem}_{idx}{ext}")
+        self.claim(new_path)
+        return new_path
+
+
+def resolve_conflicts(file_info: dict, destination_path: str, strategy: str, index: DestinationIndex = None) -> tuple:
     """
     Resolve name conflicts based on file type and strategy.
+    Returns (destination, decision): PLACE to put the file at a free destination, KEEP when the existing
+    destination file wins (nothing is copied; destination is that file), REPLACE when the file should
+    overwrite the existing destination file. The destination is never the source path.
     Strategies:
-    - images/videos: if same size, keep original; if different, add index
+    - images/videos: if same content, keep original; if different, add index
     - audio: keep larger file
     - other: keep newer file
+    With an index, collisions with paths already claimed in this run are always resolved by adding an index,
+    and the returned destination is claimed.
     """
-    if not os.path.exists(destination_path):
-        return destination_path
+    if index is None:
+        index = DestinationIndex()
+    if not index.exists(destination_path):
+        index.claim(destination_path)
+        return destination_path, PLACE
+    if not index.on_disk(destination_path):
+        # Another file of this run already maps here
+        return index.allocate(destination_path), PLACE
     src_size = file_info.get('size', 0)
-    dest_size = os.path.getsize(destination_path)
+    dest_stat = os.stat(destination_path)
+    dest_size = dest_stat.st_size
     if strategy in ['image', 'video']:
-        if src_size == dest_size:
-            return destination_path  # keep original
+        if src_size == dest_size and same_content(file_info['path'], destination_path, src_size):
+            return destination_path, KEEP  # keep original
         else:
-            base, ext = os.path.splitext(destination_path)
-            idx = 1
-            new_path = f"{base}_{idx}{ext}"
-            while os.path.exists(new_path):
-                idx += 1
-                new_path = f"{base}_{idx}{ext}"
-            return new_path
+            return index.allocate(destination_path), PLACE
     elif strategy == 'audio':
-        return destination_path if dest_size > src_size else file_info['path']
+        keep = dest_size > src_size
     else:  # other
-        src_mtime = file_info.get('modified')
-        dest_mtime = os.path.getmtime(destination_path)
-        return destination_path if dest_mtime > src_mtime.timestamp() else file_info['path']
\ No newline at end of file
+        keep = dest_stat.st_mtime > file_info.get('modified').timestamp()
+    return destination_path, KEEP if keep else REPLACE
@@ -0,0 +1,460 @@
+import os
+import sys
+import errno
+import shutil
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from utils.conflict_resolver import DestinationIndex
+from utils.dedup import PARTIAL_SIZE, full_hash, partial_hash
+
+CHUNK_SIZE = 64 * 1024 * 1024
+TEMP_PREFIX = '.organizer-tmp-'
+FICLONE = 0x40049409  # Linux ioctl for reflink clones (btrfs, xfs, ...)
+# Errors that mean "this fast path is not available here", not "the copy failed"
+_UNSUPPORTED = {errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF, errno.ETXTBSY}
+# Errors from os.rename/os.link that mean "not on this filesystem pair", so the engine copies instead
+_NO_LINK = {errno.EXDEV, errno.EPERM, errno.EMLINK, errno.EOPNOTSUPP, errno.ENOTSUP}
+MODES = ('copy', 'move', 'hardlink', 'symlink')
+VERIFY_MODES = ('quick', 'full')
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+class VerificationError(OSError):
+    pass
+
+
+class ShortCopyError(OSError):
+    pass
+
+
+def _try_reflink(src_fd: int, dst_fd: int) -> bool:
+    if not sys.platform.startswith('linux'):
+        return False
+    try:
+        import fcntl
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+        return True
+    except (ImportError, OSError):
+        return False
+
+
+def _copy_range(copy_fn, src_fd: int, dst_fd: int, size: int, chunk_size: int, throttle=None) -> bool:
+    """
+    Copy size bytes with copy_fn in chunk_size pieces. Returns False if the call is unsupported
+    before any data has been written, so the caller can fall back to another method.
+    Raises ShortCopyError if the source ends before size bytes were copied (e.g. it was truncated meanwhile).
+    throttle(nbytes), if given, is called after each piece.
+    """
+    offset = 0
+    while offset < size:
+        try:
+            sent = copy_fn(src_fd, dst_fd, offset, min(chunk_size, size - offset))
+        except OSError as e:
+            if offset == 0 and e.errno in _UNSUPPORTED:
+                return False
+            raise
+        if sent == 0:
+            raise ShortCopyError(errno.EIO, f'Short copy: source ended after {offset} of {size} bytes')
+        offset += sent
+        if throttle is not None:
+            throttle(sent)
+    return True
+
+
+def _copy_file_range(src_fd, dst_fd, offset, count):
+    return os.copy_file_range(src_fd, dst_fd, count, offset, offset)
+
+
+def _sendfile(src_fd, dst_fd, offset, count):
+    return os.sendfile(dst_fd, src_fd, offset, count)
+
+
+def fast_copy(src: str, dest: str, chunk_size: int = CHUNK_SIZE, throttle=None, sync: bool = False) -> str:
+    """
+    Copy src to dest, preferring kernel-side methods: reflink clone, then os.copy_file_range,
+    then os.sendfile, falling back to a buffered copy. Large files are copied in chunk_size pieces.
+    throttle(nbytes), if given, is called as data is copied (a reflink copies none), e.g. to cap bandwidth.
+    Metadata is copied like shutil.copy2. Returns the method that was used.
+    Raises ShortCopyError if dest does not end up with as many bytes as the source had when opened.
+    With sync=True dest's data is flushed to the device (fsync) before it is closed.
+    """
+    with open(src, 'rb') as fsrc, open(dest, 'wb') as fdst:
+        src_fd, dst_fd = fsrc.fileno(), fdst.fileno()
+        size = os.fstat(src_fd).st_size
+        if size and _try_reflink(src_fd, dst_fd):
+            method = 'reflink'
+        elif size and hasattr(os, 'copy_file_range') \
+                and _copy_range(_copy_file_range, src_fd, dst_fd, size, chunk_size, throttle):
+            method = 'copy_file_range'
+        elif size and hasattr(os, 'sendfile') and sys.platform.startswith('linux') \
+                and _copy_range(_sendfile, src_fd, dst_fd, size, chunk_size, throttle):
+            method = 'sendfile'
+        elif throttle is not None:
+            while True:
+                buf = fsrc.read(min(chunk_size, 1024 * 1024))
+                if not buf:
+                    break
+                fdst.write(buf)
+                throttle(len(buf))
+            method = 'buffered'
+        else:
+            shutil.copyfileobj(fsrc, fdst, min(chunk_size, 1024 * 1024))
+            method = 'buffered'
+        fdst.flush()
+        copied = os.fstat(dst_fd).st_size
+        if copied != size:
+            raise ShortCopyError(errno.EIO, f'Short copy: {copied} of {size} bytes copied ({method})', src)
+        if sync:
+            os.fsync(dst_fd)
+    shutil.copystat(src, dest)
+    return method
+
+
+def hashing_copy(src: str, dest: str, block_size: int = HASH_BLOCK_SIZE, drop_cache: bool = False,
+                 throttle=None, sync: bool = False) -> tuple:
+    """
+    Copy src to dest through user space, hashing the data as it streams, so the source is read only once.
+    Metadata is copied like shutil.copy2. With drop_cache=True dest is synced and evicted from the page cache,
+    so a following read-back comes from the device. Returns (bytes copied, partial hash, SHA-256), where the
+    partial hash is the one utils.dedup.partial_hash computes for a file of that size.
+    throttle(nbytes), if given, is called after each block. With sync=True dest is fsynced before it is closed.
+    """
+    h = hashlib.sha256()
+    head = b''
+    tail = b''
+    size = 0
+    buf = bytearray(block_size)
+    view = memoryview(buf)
+    with open(src, 'rb', buffering=0) as fsrc, open(dest, 'wb', buffering=0) as fdst:
+        while True:
+            n = fsrc.readinto(buf)
+            if not n:
+                break
+            chunk = view[:n]
+            h.update(chunk)  # hashlib releases the GIL here, so workers hash in parallel
+            pos = 0
+            while pos < n:
+                pos += fdst.write(chunk[pos:])
+            if size < PARTIAL_SIZE:
+                head += chunk[:PARTIAL_SIZE - size]
+            tail = (tail + chunk[-PARTIAL_SIZE:])[-PARTIAL_SIZE:]
+            size += n
+            if throttle is not None:
+                throttle(n)
+        if drop_cache or sync:
+            os.fsync(fdst.fileno())
+        if drop_cache:
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(fdst.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+    shutil.copystat(src, dest)
+    full = h.hexdigest()
+    partial = full if size <= 2 * PARTIAL_SIZE else hashlib.sha256(head + tail).hexdigest()
+    return size, partial, full
+
+
+def fsync_directory(directory: str):
+    """
+    Flush a directory's entries (e.g. a file just renamed into it) to the device.
+    A no-op where directories cannot be opened (Windows).
+    """
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError as e:
+        if e.errno not in (errno.EINVAL, errno.EBADF):
+            raise
+    finally:
+        os.close(fd)
+
+
+def temp_path_for(dest: str) -> str:
+    """
+    Hidden, unique temporary name in dest's directory (same filesystem, so the final rename is atomic).
+    """
+    directory, name = os.path.split(dest)
+    return os.path.join(directory, f"{TEMP_PREFIX}{name}.{os.getpid()}.{threading.get_ident()}.part")
+
+
+def is_temp_name(name: str) -> bool:
+    return name.startswith(TEMP_PREFIX) and name.endswith('.part')
+
+
+def remove_stale_temps(directories) -> int:
+    """
+    Delete temporary files left in the given directories by an interrupted run. Returns the number removed.
+    """
+    removed = 0
+    for directory in directories:
+        try:
+            with os.scandir(directory) as it:
+                stale = [entry.path for entry in it if is_temp_name(entry.name)]
+        except OSError:
+            continue
+        for path in stale:
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+    return removed
+
+
+class CopyEngine:
+    """
+    Copies files on a bounded thread pool.
+    Destination directories are created once, and at most per_device_limit copies
+    run at the same time against any one destination device.
+    mode selects how a file is placed: 'copy', 'move' (os.rename), 'hardlink' (os.link) or 'symlink'.
+    Moves and hard links fall back to a copy when source and destination are on different devices;
+    a move then deletes the source once the copy is in place.
+    With no_clobber=True (several processes writing into one destination) a file is published with
+    os.link, which never replaces an existing file; if another process took the name after conflict
+    resolution, the next free '_N' name from index (a DestinationIndex) is used instead.
+    With verify set, copies stream through user space and are hashed on the way (see hashing_copy), then checked
+    before they are published: 'quick' re-reads the first and last PARTIAL_SIZE bytes of the copy, 'full' syncs
+    it, drops it from the page cache and re-hashes all of it. Files placed without copying (rename, link,
+    symlink) are hashed once after placing. The SHA-256 is passed to on_copied.
+    With a scheduler (utils.io_scheduler.IOScheduler), each placement counts as one I/O operation, copied bytes
+    are charged as they are transferred and copies take the scheduler's adaptive per-device slots (on the source
+    and destination devices) instead of the fixed per_device_limit.
+    Durability: a copy's data is fsynced before it is renamed (or linked) to its final name, and after any
+    placement the destination directory is fsynced before on_copied runs, so once on_copied (and the journal's
+    'done' entry it writes) has seen a file, the file survives a crash or power loss under its final name;
+    a moved source is only deleted after that.
+    Failures are passed to on_failed(src, dest, error) (or printed if it is not set); a partial copy is never left
+    under the final name. A file not placed because dest already exists is passed to on_existing(src, dest).
+    """
+
+    def __init__(self, workers: int = None, per_device_limit: int = None, chunk_size: int = CHUNK_SIZE,
+                 on_copied=None, mode: str = 'copy', no_clobber: bool = False, index=None, verify: str = None,
+                 scheduler=None, on_failed=None, on_existing=None):
+        if mode not in MODES:
+            raise ValueError(f'Unknown mode: {mode}')
+        if verify is not None and verify not in VERIFY_MODES:
+            raise ValueError(f'Unknown verify mode: {verify}')
+        self.workers = workers or min(32, (os.cpu_count() or 1) * 4)
+        # Called as on_copied(src, dest, operation, checksum) after each finished file (checksum is None unless verifying)
+        self.on_copied = on_copied
+        # Called as on_failed(src, dest, error) with the OSError of each file that could not be placed
+        self.on_failed = on_failed
+        # Called as on_existing(src, dest) for each file left unplaced because dest already exists
+        self.on_existing = on_existing
+        self.per_device_limit = per_device_limit or self.workers
+        self.chunk_size = chunk_size
+        self.mode = mode
+        self.no_clobber = no_clobber
+        self.index = index
+        self.verify = verify
+        self.scheduler = scheduler
+        self._lock = threading.Lock()
+        self._created_dirs = set()
+        self._dir_devices = {}
+        self._device_slots = {}
+
+    def _ensure_dir(self, directory: str):
+        with self._lock:
+            if directory in self._created_dirs:
+                return
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            self._created_dirs.add(directory)
+
+    def _slot_for(self, src: str, directory: str):
+        if self.scheduler is not None:
+            # The operation itself was charged when placing started
+            return self.scheduler.io((src, os.path.join(directory, '')), 'copy', ops=0)
+        with self._lock:
+            dev = self._dir_devices.get(directory)
+        if dev is None:
+            dev = os.stat(directory).st_dev
+            with self._lock:
+                self._dir_devices[directory] = dev
+        with self._lock:
+            slot = self._device_slots.get(dev)
+            if slot is None:
+                slot = self._device_slots[dev] = threading.Semaphore(self.per_device_limit)
+            return slot
+
+    def _copy_atomic(self, src: str, dest: str, directory: str):
+        # Data goes to a hidden temporary file next to dest, is synced and atomically renamed into place,
+        # so an interrupted run (or a crash) never leaves a partial file under the final name.
+        # Returns the SHA-256 of the data when verifying.
+        tmp = temp_path_for(dest)
+        checksum = None
+        throttle = self.scheduler.throttle if self.scheduler is not None else None
+        try:
+            with self._slot_for(src, directory):
+                if self.verify is None:
+                    fast_copy(src, tmp, self.chunk_size, throttle, sync=True)
+                else:
+                    size, partial, checksum = hashing_copy(src, tmp, drop_cache=self.verify == 'full',
+                                                           throttle=throttle, sync=True)
+                    self._check(tmp, size, partial, checksum)
+            if self.no_clobber:
+                self._publish(tmp, dest)
+            else:
+                os.replace(tmp, dest)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        fsync_directory(directory)
+        return checksum
+
+    def _check(self, path: str, size: int, partial: str, checksum: str):
+        copied = os.path.getsize(path)
+        if copied != size:
+            raise VerificationError(errno.EIO, f'Verification failed: copy has {copied} bytes, source had {size}', path)
+        if self.verify == 'full':
+            if self.scheduler is not None:
+                self.scheduler.throttle(size)
+            ok = full_hash(path) == checksum
+        else:
+            ok = partial_hash(path, size) == partial
+        if not ok:
+            raise VerificationError(errno.EIO, 'Verification failed: copy differs from the data read', path)
+
+    @staticmethod
+    def _publish(path: str, dest: str):
+        # Link then unlink: unlike a rename, os.link fails with FileExistsError instead of replacing dest
+        try:
+            os.link(path, dest)
+        except FileExistsError:
+            raise
+        except OSError as e:
+            if e.errno not in _NO_LINK:
+                raise
+            if os.path.lexists(dest):  # no hard links here; best effort
+                raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), dest)
+            os.rename(path, dest)
+            return
+        os.remove(path)
+
+    @staticmethod
+    def _create_over(create, dest: str):
+        # Create a link under a temporary name with create(path), then rename it over dest
+        tmp = temp_path_for(dest)
+        create(tmp)
+        try:
+            os.replace(tmp, dest)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+
+    def _place_once(self, src: str, dest: str, directory: str, replace: bool = False) -> tuple:
+        # Returns (operation, SHA-256 of the data when verifying). With replace an existing dest is overwritten.
+        if self.mode == 'symlink':
+            if replace:
+                self._create_over(lambda path: os.symlink(os.path.abspath(src), path), dest)
+            else:
+                os.symlink(os.path.abspath(src), dest)
+            fsync_directory(directory)
+            return 'symlink', self._checksum(dest)
+        if self.mode in ('move', 'hardlink'):
+            try:
+                if self.mode == 'hardlink':
+                    if replace:
+                        self._create_over(lambda path: os.link(src, path), dest)
+                    else:
+                        os.link(src, dest)
+                elif self.no_clobber:
+                    self._publish(src, dest)
+                elif replace:
+                    os.replace(src, dest)
+                else:
+                    os.rename(src, dest)
+                fsync_directory(directory)
+                return self.mode, self._checksum(dest)
+            except FileExistsError:
+                raise
+            except OSError as e:
+                if e.errno not in _NO_LINK:
+                    raise
+        checksum = self._copy_atomic(src, dest, directory)
+        if self.mode == 'move':
+            os.remove(src)
+            return 'copy+delete', checksum
+        return 'copy', checksum
+
+    def _checksum(self, path: str):
+        return full_hash(path) if self.verify is not None else None
+
+    def _existed(self, dest: str) -> bool:
+        # Whether dest was already there when conflict resolution listed its folder
+        with self._lock:
+            return self.index is None or self.index.on_disk(dest)
+
+    def _allocate(self, dest: str) -> str:
+        with self._lock:
+            if self.index is None:
+                self.index = DestinationIndex()
+            return self.index.allocate(dest)
+
+    def _place(self, src: str, dest: str, directory: str, planned: str, replace: bool = False) -> tuple:
+        while True:
+            try:
+                return self._place_once(src, dest, directory, replace) + (dest,)
+            except FileExistsError:
+                if not self.no_clobber:
+                    raise
+                dest = self._allocate(planned)
+
+    def copy(self, src: str, dest: str, planned: str = None, replace: bool = False):
+        """
+        Place one file at dest according to the mode, unless dest already exists (with replace, when conflict
+        resolution decided the file wins over the existing one, dest is overwritten atomically instead;
+        with no_clobber, which never overwrites, the file then gets the next free '_N' name).
+        planned is the destination before conflict resolution added any '_N' suffix; with no_clobber, names
+        taken by other processes are replaced by the next free '_N' variant of it (of dest if not given), so the
+        numbering continues the conflict resolver's instead of stacking suffixes.
+        Returns the operation performed ('copy', 'move', 'hardlink', 'symlink' or 'copy+delete'),
+        'existing' if dest was already there, or None on failure (including a short copy or a failed
+        verification; the copy is then removed and a moved source kept), after passing the error to on_failed.
+        With no_clobber the file may end up under another name; on_copied receives the final path.
+        """
+        directory = os.path.dirname(dest)
+        try:
+            self._ensure_dir(directory)
+            if replace and self.no_clobber:
+                dest, replace = self._allocate(planned or dest), False
+            if os.path.lexists(dest) and not replace:
+                if not self.no_clobber or self._existed(dest):
+                    # Conflict resolution should have already handled naming; the existing file is kept
+                    if self.on_existing is not None:
+                        self.on_existing(src, dest)
+                    return 'existing'
+                dest = self._allocate(planned or dest)  # created by another process after conflict resolution
+            if self.scheduler is not None:
+                self.scheduler.throttle(ops=1, stage='copy')
+            operation, checksum, dest = self._place(src, dest, directory, planned or dest, replace)
+            if self.on_copied is not None:
+                self.on_copied(src, dest, operation, checksum)
+            return operation
+        except OSError as e:
+            if self.on_failed is not None:
+                self.on_failed(src, dest, e)
+            else:
+                print(f"Error placing {src} at {dest}: {e}")
+            return None
+
+    def copy_all(self, pairs) -> list:
+        """
+        Copy an iterable of (src, dest) pairs (or (src, dest, planned, replace), see copy()) in parallel.
+        Returns the pairs that failed.
+        """
+        failed = []
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            pairs = list(pairs)
+            for pair, ok in zip(pairs, pool.map(lambda p: self.copy(*p), pairs)):
+                if not ok:
+                    failed.append(pair)
+        return failed
@@ -0,0 +1,342 @@
+import os
+import sqlite3
+import threading
+import hashlib
+from collections import defaultdict
+
+PARTIAL_SIZE = 64 * 1024  # bytes hashed from each end of a file in the partial stage
+HASH_INDEX_FILENAME = '.organizer_hashes.sqlite'
+
+
+def partial_hash(path: str, size: int, partial_size: int = PARTIAL_SIZE) -> str:
+    """
+    Hash the first and last partial_size bytes of a file.
+    Files no larger than 2 * partial_size are hashed whole, so the result is also their full hash.
+    """
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        if size <= 2 * partial_size:
+            h.update(f.read())
+        else:
+            h.update(f.read(partial_size))
+            f.seek(-partial_size, os.SEEK_END)
+            h.update(f.read(partial_size))
+    return h.hexdigest()
+
+
+def is_within(path: str, directory: str) -> bool:
+    """
+    Whether path is directory or lies below it.
+    """
+    path, directory = os.path.abspath(path), os.path.abspath(directory)
+    try:
+        return os.path.commonpath([path, directory]) == directory
+    except ValueError:  # different drives
+        return False
+
+
+def full_hash(path: str, block_size: int = 1024 * 1024) -> str:
+    """
+    SHA-256 of the whole file.
+    """
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def same_content(path_a: str, path_b: str, size: int) -> bool:
+    """
+    Compare two files of the same size in stages: partial hash first, full hash only if still needed.
+    """
+    if partial_hash(path_a, size) != partial_hash(path_b, size):
+        return False
+    if size <= 2 * PARTIAL_SIZE:
+        return True
+    return full_hash(path_a) == full_hash(path_b)
+
+
+class HashIndex:
+    """
+    Persistent index of destination file contents, stored as SQLite in the destination directory.
+    Rows are keyed by destination path; partial and full hashes are filled in lazily, the first
+    time a same-size source file needs to be compared against them.
+    With readonly=True (shard workers) hashes computed on demand are not stored and add() is skipped.
+    """
+
+    def __init__(self, destination_directory: str, filename: str = HASH_INDEX_FILENAME, readonly: bool = False):
+        self.destination_directory = destination_directory
+        self.path = os.path.join(destination_directory, filename)
+        self.readonly = readonly
+        self.lock = threading.RLock()  # the connection is shared by pipeline stages
+        if readonly:
+            self.conn = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True, check_same_thread=False)
+            return
+        os.makedirs(destination_directory, exist_ok=True)
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS hashes ('
+            'path TEXT PRIMARY KEY, size INTEGER, mtime REAL, partial TEXT, full TEXT)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS hashes_size ON hashes (size)')
+        if self.conn.execute('SELECT COUNT(*) FROM hashes').fetchone()[0] == 0:
+            self.refresh()
+
+    def refresh(self):
+        """
+        Synchronize the index with the files currently in the destination directory.
+        Only size and mtime are read here; hashes of new or changed files are dropped and recomputed on demand.
+        """
+        from utils.file_utils import iter_files
+        with self.lock:
+            known = {row[0]: (row[1], row[2]) for row in self.conn.execute('SELECT path, size, mtime FROM hashes')}
+            for record in iter_files(self.destination_directory):
+                # Skip the tool's own hidden state (caches, thumbnails)
+                rel_path = os.path.relpath(record.path, self.destination_directory)
+                if any(part.startswith('.') for part in rel_path.split(os.sep)):
+                    continue
+                if known.pop(record.path, None) != (record.size, record.mtime):
+                    self.add(record.path, record.size, record.mtime)
+            self.conn.executemany('DELETE FROM hashes WHERE path = ?', ((path,) for path in known))
+            self.conn.commit()
+
+    def add(self, path: str, size: int, mtime: float, partial: str = None, full: str = None):
+        """
+        Index a destination file; paths outside the destination directory (e.g. sources) are ignored.
+        """
+        if self.readonly or not is_within(path, self.destination_directory):
+            return
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO hashes (path, size, mtime, partial, full) VALUES (?, ?, ?, ?, ?)',
+                              (path, size, mtime, partial, full))
+
+    def sizes(self, sizes) -> set:
+        """
+        Return the subset of the given sizes that occur in the index.
+        """
+        with self.lock:
+            found = set()
+            sizes = list(sizes)
+            for i in range(0, len(sizes), 500):
+                chunk = sizes[i:i + 500]
+                query = f"SELECT DISTINCT size FROM hashes WHERE size IN ({','.join('?' * len(chunk))})"
+                found.update(row[0] for row in self.conn.execute(query, chunk))
+            return found
+
+    def _drop(self, path: str):
+        if not self.readonly:
+            with self.lock:
+                self.conn.execute('DELETE FROM hashes WHERE path = ?', (path,))
+
+    def _stat(self, path: str, size: int, mtime: float):
+        """
+        Stat an indexed file. Entries whose file has disappeared are dropped (None is returned); entries whose
+        size or mtime changed since they were indexed are re-added without their stale hashes.
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            self._drop(path)
+            return None
+        if (st.st_size, st.st_mtime) != (size, mtime):
+            self.add(path, st.st_size, st.st_mtime)
+        return st
+
+    def candidates(self, size: int) -> list:
+        """
+        Return (path, partial_hash) for indexed files of the given size, computing missing partial hashes.
+        Each file is stat'ed first: stored hashes are only trusted while the file keeps the size and mtime
+        it was indexed with. Changed files are re-hashed, missing ones dropped.
+        """
+        with self.lock:
+            rows = self.conn.execute('SELECT path, mtime, partial FROM hashes WHERE size = ?', (size,)).fetchall()
+        result = []
+        for path, mtime, partial in rows:
+            st = self._stat(path, size, mtime)
+            if st is None or st.st_size != size:
+                continue
+            if st.st_mtime != mtime:
+                partial = None
+            if partial is None:
+                try:
+                    partial = partial_hash(path, size)
+                except OSError:
+                    self._drop(path)
+                    continue
+                if not self.readonly:
+                    with self.lock:
+                        self.conn.execute('UPDATE hashes SET partial = ? WHERE path = ?', (partial, path))
+            result.append((path, partial))
+        return result
+
+    def full(self, path: str, size: int) -> str:
+        """
+        Return the full hash of an indexed file, computing and storing it if needed.
+        A stored hash is only used while the file keeps its indexed size and mtime.
+        """
+        with self.lock:
+            row = self.conn.execute('SELECT mtime, full FROM hashes WHERE path = ?', (path,)).fetchone()
+        if row and row[1]:
+            st = self._stat(path, size, row[0])
+            if st is not None and (st.st_size, st.st_mtime) == (size, row[0]):
+                return row[1]
+        digest = full_hash(path)
+        if not self.readonly:
+            with self.lock:
+                self.conn.execute('UPDATE hashes SET full = ? WHERE path = ?', (digest, path))
+        return digest
+
+    def exists(self, path: str, size: int) -> bool:
+        """
+        True if an indexed file is still present with the given size (used before relying on a match).
+        """
+        try:
+            return os.stat(path).st_size == size
+        except OSError:
+            self._drop(path)
+            return False
+
+    def commit(self):
+        with self.lock:
+            if not self.readonly:
+                self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            if not self.readonly:
+                self.conn.commit()
+            self.conn.close()
+
+
+def find_duplicates(file_metadata, index: HashIndex = None) -> tuple:
+    """
+    Find source files whose content already exists in the destination index or earlier in this run.
+    Hashing is staged: group by size, then hash the first/last PARTIAL_SIZE bytes, then hash
+    whole files only within groups that still collide.
+    Returns (duplicates, hashes): duplicates maps a source path to the path holding the same content
+    (a destination file, or the first source file with that content); hashes maps hashed source paths
+    to their (partial, full) hashes so they can be stored in the index after copying.
+    """
+    by_size = defaultdict(list)
+    for meta in file_metadata:
+        if meta['size'] > 0:
+            by_size[meta['size']].append(meta['path'])
+    indexed_sizes = index.sizes(by_size) if index is not None else set()
+    duplicates = {}
+    hashes = {}
+    for size, paths in by_size.items():
+        if len(paths) < 2 and size not in indexed_sizes:
+            continue
+        # Stage 2: partial hashes
+        by_partial = defaultdict(list)
+        if size in indexed_sizes:
+            for path, partial in index.candidates(size):
+                by_partial[partial].append((path, True))
+        for path in paths:
+            try:
+                partial = partial_hash(path, size)
+            except OSError as e:
+                print(f"Error hashing file {path}: {e}")
+                continue
+            hashes[path] = (partial, partial if size <= 2 * PARTIAL_SIZE else None)
+            by_partial[partial].append((path, False))
+        # Stage 3: full hashes, only where partial hashes still collide
+        for partial, group in by_partial.items():
+            if len(group) < 2 or all(indexed for _, indexed in group):
+                continue
+            if size <= 2 * PARTIAL_SIZE:
+                # The partial hash covers the whole file; only check that indexed matches are still there
+                by_full = {partial: [(path, indexed) for path, indexed in group
+                                     if not indexed or index.exists(path, size)]}
+            else:
+                by_full = defaultdict(list)
+                for path, indexed in group:
+                    try:
+                        digest = index.full(path, size) if indexed else full_hash(path)
+                    except OSError as e:
+                        print(f"Error hashing file {path}: {e}")
+                        continue
+                    if not indexed:
+                        hashes[path] = (partial, digest)
+                    by_full[digest].append((path, indexed))
+            for same in by_full.values():
+                # Prefer a file already in the destination as the original
+                original = next((path for path, indexed in same if indexed), same[0][0])
+                for path, indexed in same:
+                    if not indexed and path != original:
+                        duplicates[path] = original
+    return duplicates, hashes
+
+
+class DuplicateFinder:
+    """
+    Incremental duplicate detection for files arriving one at a time (e.g. in the pipelined flow).
+    Uses the same stages as find_duplicates: a file is only hashed once another file of the same
+    size has been seen, and whole-file hashes are only computed when partial hashes match.
+    """
+
+    def __init__(self, index: HashIndex = None, moved: dict = None):
+        self.index = index
+        self.moved = moved  # source -> destination, for sources that may be moved away while still candidates
+        self.hashes = {}
+        self._by_size = {}  # size -> list of [path, partial, full, indexed]
+
+    def _hash(self, fn, path: str, *args) -> str:
+        try:
+            return fn(path, *args)
+        except FileNotFoundError:
+            if not self.moved or path not in self.moved:
+                raise
+            return fn(self.moved[path], *args)
+
+    def _partial(self, entry: list, size: int) -> str:
+        if entry[1] is None:
+            entry[1] = self._hash(partial_hash, entry[0], size)
+            if not entry[3]:
+                self.hashes[entry[0]] = (entry[1], entry[1] if size <= 2 * PARTIAL_SIZE else None)
+        return entry[1]
+
+    def _full(self, entry: list, size: int) -> str:
+        if size <= 2 * PARTIAL_SIZE:
+            return self._partial(entry, size)
+        if entry[2] is None:
+            entry[2] = self.index.full(entry[0], size) if entry[3] else self._hash(full_hash, entry[0])
+            if not entry[3]:
+                self.hashes[entry[0]] = (self._partial(entry, size), entry[2])
+        return entry[2]
+
+    def discard(self, path: str, size: int):
+        """
+        Stop offering a file checked earlier as an original (e.g. because it is not copied after all).
+        """
+        entries = self._by_size.get(size)
+        if entries:
+            entries[:] = [entry for entry in entries if entry[0] != path]
+
+    def check(self, path: str, size: int):
+        """
+        Return the path already holding this file's content (a destination file or an earlier source),
+        or None if the file is new, in which case it becomes a candidate original for later files.
+        """
+        if size <= 0:
+            return None
+        entries = self._by_size.get(size)
+        if entries is None:
+            entries = self._by_size[size] = []
+            if self.index is not None:
+                entries.extend([indexed, partial, None, True] for indexed, partial in self.index.candidates(size))
+        entry = [path, None, None, False]
+        try:
+            if entries:
+                partial = self._partial(entry, size)
+                for other in list(entries):
+                    if self._partial(other, size) == partial and self._full(other, size) == self._full(entry, size):
+                        if other[3] and not self.index.exists(other[0], size):
+                            entries.remove(other)  # indexed copy removed since the run started
+                            continue
+                        return other[0]
+        except OSError as e:
+            print(f"Error hashing file {path}: {e}")
+            return None
+        entries.append(entry)
+        return None
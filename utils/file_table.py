@@ -0,0 +1,524 @@
+import os
+import math
+import datetime
+import threading
+from array import array
+from collections.abc import Mapping
+
+# Enum-coded columns store the index into these tuples, or NONE
+TYPES = ('image', 'video', 'audio', 'other')
+CATEGORIES = ('images', 'videos', 'audio', 'other')
+ACTIONS = ('copy', 'unchanged', 'duplicate', 'failed', 'kept')  # kept: an existing destination file was kept
+OPERATIONS = ('copy', 'move', 'hardlink', 'symlink', 'copy+delete')
+NONE = -1
+# Files that have a destination of their own (duplicates and kept files point at another file; failed copies have none)
+PLACED_ACTIONS = ('copy', 'unchanged')
+
+
+def _codes(names: tuple) -> dict:
+    return {name: code for code, name in enumerate(names)}
+
+
+_TYPE_CODES = _codes(TYPES)
+_CATEGORY_CODES = _codes(CATEGORIES)
+_ACTION_CODES = _codes(ACTIONS)
+_OPERATION_CODES = _codes(OPERATIONS)
+_PLACED_CODES = frozenset(_ACTION_CODES[action] for action in PLACED_ACTIONS)
+
+
+def _decode(names: tuple, code: int):
+    return names[code] if code != NONE else None
+
+
+def _encode(codes: dict, name) -> int:
+    return codes[name] if name is not None else NONE
+
+
+class FileTable:
+    """
+    Columnar store for every file of a run, replacing per-file dicts and the nested category -> {source: destination}
+    maps. Each file gets an integer id; directories (of sources and destinations) are interned once and referenced by
+    id, type/category/action/operation are small enum codes, and sizes, timestamps and inode numbers live in typed
+    arrays. A destination whose file name equals the source's stores no name of its own.
+    Files are read and updated through FileRow accessors, and the Mapping views (planned, resolved, duplicates, ...)
+    give report generators the {source: destination} shapes they expect without materializing them.
+    Rows are only added from one thread; updates of existing rows are safe from several threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._dirs = []        # directory id -> path
+        self._dir_ids = {}     # path -> directory id
+        self._ids = {}         # source directory id -> {file name: file id}
+        self._names = []       # file id -> source file name
+        self._tags = {}        # file id -> audio tags (sparse)
+        self._checksums = {}   # file id -> SHA-256 digest of the placed file (sparse, only when verifying)
+        self._errors = {}      # file id -> why placing the file failed (sparse)
+        self._replace = set()  # file ids whose copy overwrites an existing destination file
+        self._dir = array('l')
+        self.size = array('q')
+        self.ctime = array('d')
+        self.mtime = array('d')
+        self.captured = array('d')  # NaN: not read yet
+        self.ino = array('Q')
+        self.dev = array('Q')
+        self.type = array('b')
+        self.category = array('b')
+        self.action = array('b')
+        self.operation = array('b')
+        # Destination from categorization, and the one conflict resolution (or the copy) settled on
+        self._planned_dir = array('l')
+        self._planned_names = []
+        self._resolved_dir = array('l')
+        self._resolved_names = []
+        self.planned = DestinationMap(self, 'planned')
+        self.resolved = DestinationMap(self, 'resolved')
+        self.unchanged = ActionView(self, 'unchanged')
+        self.duplicates = ActionView(self, 'duplicate')
+        self.kept = ActionView(self, 'kept')
+        self.failed = ColumnView(self, lambda i: self._errors.get(i, '') if self.action[i] == _ACTION_CODES['failed']
+                                 else None)
+        self.operations = ColumnView(self, lambda i: _decode(OPERATIONS, self.operation[i]))
+        self.audio_metadata = ColumnView(self, lambda i: self._tags.get(i, {}) if self.type[i] == _TYPE_CODES['audio']
+                                         else None)
+        self.mtimes = ColumnView(self, lambda i: self.mtime[i])
+        self.checksums = ColumnView(self, lambda i: self._checksums[i].hex() if i in self._checksums else None)
+
+    def _intern(self, directory: str) -> int:
+        dir_id = self._dir_ids.get(directory)
+        if dir_id is None:
+            with self._lock:
+                dir_id = self._dir_ids.get(directory)
+                if dir_id is None:
+                    dir_id = self._dir_ids[directory] = len(self._dirs)
+                    self._dirs.append(directory)
+        return dir_id
+
+    def add(self, record) -> 'FileRow':
+        """
+        Append a scanned file (a FileRecord or anything with the same fields) and return its row.
+        """
+        directory, name = os.path.split(record['path'])
+        dir_id = self._intern(directory)
+        file_id = len(self._names)
+        self._ids.setdefault(dir_id, {})[name] = file_id
+        self._names.append(name)
+        self._dir.append(dir_id)
+        self.size.append(record['size'])
+        self.ctime.append(record['ctime'])
+        self.mtime.append(record['mtime'])
+        captured = record['captured']
+        self.captured.append(math.nan if captured is None else captured)
+        self.ino.append(record['ino'])
+        self.dev.append(record['dev'])
+        self.type.append(_encode(_TYPE_CODES, record['type']))
+        self.category.append(NONE)
+        self.action.append(NONE)
+        self.operation.append(NONE)
+        self._planned_dir.append(NONE)
+        self._planned_names.append(None)
+        self._resolved_dir.append(NONE)
+        self._resolved_names.append(None)
+        if record['extra_metadata']:
+            self._tags[file_id] = record['extra_metadata']
+        return FileRow(self, file_id)
+
+    def __len__(self):
+        return len(self._names)
+
+    def __iter__(self):
+        for file_id in range(len(self._names)):
+            yield FileRow(self, file_id)
+
+    def row(self, file_id: int) -> 'FileRow':
+        return FileRow(self, file_id)
+
+    def id_of(self, path: str):
+        directory, name = os.path.split(path)
+        dir_id = self._dir_ids.get(directory)
+        if dir_id is None:
+            return None
+        return self._ids.get(dir_id, {}).get(name)
+
+    def find(self, path: str):
+        """
+        Row of the source file at path, or None.
+        """
+        file_id = self.id_of(path)
+        return FileRow(self, file_id) if file_id is not None else None
+
+    def rows(self, action: str = None, category: str = None):
+        """
+        Iterate the rows with the given action and/or category.
+        """
+        actions = self.action
+        categories = self.category
+        action = _encode(_ACTION_CODES, action)
+        category = _encode(_CATEGORY_CODES, category)
+        for file_id in range(len(self._names)):
+            if (action == NONE or actions[file_id] == action) and (category == NONE or categories[file_id] == category):
+                yield FileRow(self, file_id)
+
+    def path(self, file_id: int) -> str:
+        return os.path.join(self._dirs[self._dir[file_id]], self._names[file_id])
+
+    def _destination(self, which: str, file_id: int):
+        dir_id = getattr(self, f'_{which}_dir')[file_id]
+        if dir_id == NONE:
+            return None
+        name = getattr(self, f'_{which}_names')[file_id]
+        return os.path.join(self._dirs[dir_id], name if name is not None else self._names[file_id])
+
+    def _set_destination(self, which: str, file_id: int, path: str):
+        names = getattr(self, f'_{which}_names')
+        if path is None:
+            getattr(self, f'_{which}_dir')[file_id] = NONE
+            names[file_id] = None
+            return
+        directory, name = os.path.split(path)
+        getattr(self, f'_{which}_dir')[file_id] = self._intern(directory)
+        names[file_id] = name if name != self._names[file_id] else None
+
+    def _has_destination(self, which: str, file_id: int) -> bool:
+        if getattr(self, f'_{which}_dir')[file_id] == NONE:
+            return False
+        return which == 'planned' or self.action[file_id] in _PLACED_CODES
+
+
+class FileRow:
+    """
+    Accessor for one file of a FileTable, with the same attribute and dict-style interface as FileRecord
+    (so categorization, conflict resolution, the cache and the journal take either), plus the file's
+    category, destinations, action and operation.
+    """
+    __slots__ = ('table', 'id')
+
+    def __init__(self, table: FileTable, file_id: int):
+        self.table = table
+        self.id = file_id
+
+    @property
+    def path(self) -> str:
+        return self.table.path(self.id)
+
+    @property
+    def name(self) -> str:
+        return self.table._names[self.id]
+
+    @property
+    def size(self) -> int:
+        return self.table.size[self.id]
+
+    @property
+    def ctime(self) -> float:
+        return self.table.ctime[self.id]
+
+    @property
+    def mtime(self) -> float:
+        return self.table.mtime[self.id]
+
+    @property
+    def ino(self) -> int:
+        return self.table.ino[self.id]
+
+    @property
+    def dev(self) -> int:
+        return self.table.dev[self.id]
+
+    @property
+    def type(self):
+        return _decode(TYPES, self.table.type[self.id])
+
+    @type.setter
+    def type(self, value):
+        self.table.type[self.id] = _encode(_TYPE_CODES, value)
+
+    @property
+    def captured(self):
+        value = self.table.captured[self.id]
+        return None if math.isnan(value) else value
+
+    @captured.setter
+    def captured(self, value):
+        self.table.captured[self.id] = math.nan if value is None else value
+
+    @property
+    def extra_metadata(self):
+        return self.table._tags.get(self.id)
+
+    @extra_metadata.setter
+    def extra_metadata(self, value):
+        if value:
+            self.table._tags[self.id] = value
+        else:
+            self.table._tags.pop(self.id, None)
+
+    @property
+    def checksum(self):
+        """
+        SHA-256 (hex) of the placed file, recorded when copies are verified.
+        """
+        digest = self.table._checksums.get(self.id)
+        return digest.hex() if digest is not None else None
+
+    @checksum.setter
+    def checksum(self, value):
+        if value:
+            self.table._checksums[self.id] = bytes.fromhex(value)
+        else:
+            self.table._checksums.pop(self.id, None)
+
+    @property
+    def replace(self) -> bool:
+        """
+        Whether conflict resolution decided the copy overwrites the existing destination file.
+        """
+        return self.id in self.table._replace
+
+    @replace.setter
+    def replace(self, value):
+        if value:
+            self.table._replace.add(self.id)
+        else:
+            self.table._replace.discard(self.id)
+
+    @property
+    def error(self):
+        """
+        Why placing the file failed, for failed rows.
+        """
+        return self.table._errors.get(self.id)
+
+    @error.setter
+    def error(self, value):
+        if value:
+            self.table._errors[self.id] = value
+        else:
+            self.table._errors.pop(self.id, None)
+
+    @property
+    def category(self):
+        return _decode(CATEGORIES, self.table.category[self.id])
+
+    @category.setter
+    def category(self, value):
+        self.table.category[self.id] = _encode(_CATEGORY_CODES, value)
+
+    @property
+    def action(self):
+        return _decode(ACTIONS, self.table.action[self.id])
+
+    @action.setter
+    def action(self, value):
+        self.table.action[self.id] = _encode(_ACTION_CODES, value)
+
+    @property
+    def operation(self):
+        return _decode(OPERATIONS, self.table.operation[self.id])
+
+    @operation.setter
+    def operation(self, value):
+        self.table.operation[self.id] = _encode(_OPERATION_CODES, value)
+
+    @property
+    def destination(self):
+        """
+        Destination assigned by categorization.
+        """
+        return self.table._destination('planned', self.id)
+
+    @destination.setter
+    def destination(self, path):
+        self.table._set_destination('planned', self.id, path)
+
+    @property
+    def resolved(self):
+        """
+        Final destination: after conflict resolution and copying, or the file holding a duplicate's content.
+        """
+        return self.table._destination('resolved', self.id)
+
+    @resolved.setter
+    def resolved(self, path):
+        self.table._set_destination('resolved', self.id, path)
+
+    @property
+    def taken(self) -> datetime.datetime:
+        return datetime.datetime.fromtimestamp(self.captured or self.mtime)
+
+    @property
+    def created(self) -> datetime.datetime:
+        return datetime.datetime.fromtimestamp(self.ctime)
+
+    @property
+    def modified(self) -> datetime.datetime:
+        return datetime.datetime.fromtimestamp(self.mtime)
+
+    _KEYS = ('path', 'size', 'ctime', 'mtime', 'ino', 'dev', 'type', 'extra_metadata', 'captured',
+             'created', 'modified', 'taken')
+
+    def __getitem__(self, key):
+        if key not in self._KEYS:
+            raise KeyError(key)
+        value = getattr(self, key)
+        if key == 'extra_metadata' and value is None:
+            value = {}
+        return value
+
+    def __setitem__(self, key, value):
+        if key not in self._KEYS:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self._KEYS
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __repr__(self):
+        return f"FileRow({self.id}, {self.path!r})"
+
+
+class CategoryView(Mapping):
+    """
+    source path -> destination for one category, read from the table on demand.
+    """
+
+    def __init__(self, table: FileTable, which: str, category: str):
+        self.table = table
+        self.which = which
+        self.code = _CATEGORY_CODES[category]
+
+    def _ids(self):
+        table = self.table
+        categories = table.category
+        for file_id in range(len(table)):
+            if categories[file_id] == self.code and table._has_destination(self.which, file_id):
+                yield file_id
+
+    def __getitem__(self, src):
+        file_id = self.table.id_of(src)
+        if file_id is None or self.table.category[file_id] != self.code \
+                or not self.table._has_destination(self.which, file_id):
+            raise KeyError(src)
+        return self.table._destination(self.which, file_id)
+
+    def __iter__(self):
+        return (self.table.path(file_id) for file_id in self._ids())
+
+    def __len__(self):
+        return sum(1 for _ in self._ids())
+
+    def __bool__(self):
+        return next(self._ids(), None) is not None
+
+    def items(self):
+        return ((self.table.path(file_id), self.table._destination(self.which, file_id)) for file_id in self._ids())
+
+    def values(self):
+        return (self.table._destination(self.which, file_id) for file_id in self._ids())
+
+
+class DestinationMap(Mapping):
+    """
+    category -> CategoryView, the shape of the former categorized_files / conflict_resolved_files dicts.
+    which is 'planned' (destinations from categorization) or 'resolved' (final destinations; duplicates and failed
+    copies excluded).
+    """
+
+    def __init__(self, table: FileTable, which: str):
+        self.table = table
+        self.which = which
+
+    def __getitem__(self, category):
+        if category not in _CATEGORY_CODES:
+            raise KeyError(category)
+        view = CategoryView(self.table, self.which, category)
+        if not view:
+            raise KeyError(category)
+        return view
+
+    def __iter__(self):
+        present = set(self.table.category)
+        return (category for code, category in enumerate(CATEGORIES) if code in present and category in self)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def by_source(self) -> 'SourceView':
+        return SourceView(self.table, self.which)
+
+
+class SourceView(Mapping):
+    """
+    source path -> destination across all categories.
+    """
+
+    def __init__(self, table: FileTable, which: str):
+        self.table = table
+        self.which = which
+
+    def __getitem__(self, src):
+        file_id = self.table.id_of(src)
+        if file_id is None or not self.table._has_destination(self.which, file_id):
+            raise KeyError(src)
+        return self.table._destination(self.which, file_id)
+
+    def __iter__(self):
+        table = self.table
+        return (table.path(file_id) for file_id in range(len(table)) if table._has_destination(self.which, file_id))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+class ActionView(Mapping):
+    """
+    source path -> resolved destination for the files with one action (e.g. unchanged files, duplicates).
+    """
+
+    def __init__(self, table: FileTable, action: str):
+        self.table = table
+        self.code = _ACTION_CODES[action]
+
+    def __getitem__(self, src):
+        file_id = self.table.id_of(src)
+        if file_id is None or self.table.action[file_id] != self.code:
+            raise KeyError(src)
+        return self.table._destination('resolved', file_id)
+
+    def __iter__(self):
+        table = self.table
+        actions = table.action
+        return (table.path(file_id) for file_id in range(len(table)) if actions[file_id] == self.code)
+
+    def __len__(self):
+        return self.table.action.count(self.code)
+
+
+class ColumnView(Mapping):
+    """
+    source path -> value(file id), for the files where value is not None (mtimes, operations, audio tags, errors).
+    """
+
+    def __init__(self, table: FileTable, value):
+        self.table = table
+        self.value = value
+
+    def __getitem__(self, src):
+        file_id = self.table.id_of(src)
+        value = self.value(file_id) if file_id is not None else None
+        if value is None:
+            raise KeyError(src)
+        return value
+
+    def __iter__(self):
+        table = self.table
+        return (table.path(file_id) for file_id in range(len(table)) if self.value(file_id) is not None)
+
+    def __len__(self):
+        return sum(1 for _ in self)
@@ -0,0 +1,160 @@
+import os
+import json
+import hashlib
+import mimetypes
+import threading
+from typing import Dict
+from concurrent.futures import ThreadPoolExecutor
+
+# Extensions mimetypes does not know (or maps inconsistently across platforms)
+EXTRA_EXTENSIONS = {
+    '.heic': 'image', '.heif': 'image', '.avif': 'image', '.webp': 'image',
+    '.m4a': 'audio', '.flac': 'audio', '.opus': 'audio', '.ogg': 'audio', '.wma': 'audio',
+    '.mkv': 'video', '.m4v': 'video', '.3gp': 'video', '.mts': 'video', '.m2ts': 'video', '.wmv': 'video',
+}
+# Camera RAW formats; many platforms' mime tables lack some or all of them, so they can be added explicitly
+RAW_EXTENSIONS = ('.cr2', '.cr3', '.nef', '.nrw', '.arw', '.srf', '.sr2', '.dng', '.orf', '.rw2', '.raf',
+                  '.pef', '.srw', '.x3f', '.3fr', '.iiq', '.rwl')
+# ISO base media brands (bytes 8..12 of an 'ftyp' box) that are still images or audio rather than video
+HEIF_BRANDS = {b'heic', b'heix', b'hevc', b'hevx', b'heim', b'heis', b'mif1', b'msf1', b'avif'}
+AUDIO_BRANDS = {b'M4A ', b'M4B ', b'M4P '}
+SNIFF_SIZE = 16
+SNIFF_VERSION = 2  # bumped when sniffing rules change, so types classified by older rules are not reused
+SNIFF_MIN_PARALLEL = 64
+
+
+def _mime_type(ext: str) -> str:
+    mime, _ = mimetypes.guess_type('file' + ext)
+    if mime:
+        for ftype in ('image', 'video', 'audio'):
+            if mime.startswith(ftype):
+                return ftype
+    return 'other'
+
+
+def _default_table() -> dict:
+    mimetypes.init()
+    table = {}
+    for ext in mimetypes.types_map:
+        ftype = _mime_type(ext)
+        if ftype != 'other':
+            table[ext.lower()] = ftype
+    table.update(EXTRA_EXTENSIONS)
+    return table
+
+
+def _mpeg_frame(header: bytes) -> bool:
+    """
+    True if header starts with a valid MPEG audio frame header: 11 sync bits, a known version and layer, a
+    bitrate index other than free (0) or bad (15) and a known sample rate.
+    """
+    if len(header) < 4 or header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        return False
+    version, layer = header[1] >> 3 & 0x03, header[1] >> 1 & 0x03
+    bitrate, samplerate = header[2] >> 4, header[2] >> 2 & 0x03
+    return version != 1 and layer != 0 and bitrate not in (0, 15) and samplerate != 3 and header[3] & 0x03 != 2
+
+
+def sniff_type(header: bytes, weak: bool = True):
+    """
+    Identify a file from its first bytes (JPEG, PNG, HEIC/HEIF, MP4/MOV, M4A, MP3, FLAC). Returns None if unknown.
+    A bare MPEG audio frame header (an MP3 without an ID3 tag) is a weak signature that ordinary data such as
+    UTF-16 text can match by chance; weak=False ignores it.
+    """
+    if header[:3] == b'\xff\xd8\xff' or header[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'image'
+    if header[4:8] == b'ftyp':
+        brand = header[8:12]
+        if brand in HEIF_BRANDS:
+            return 'image'
+        return 'audio' if brand in AUDIO_BRANDS else 'video'
+    if header[:4] == b'fLaC' or header[:3] == b'ID3':
+        return 'audio'
+    if weak and _mpeg_frame(header):
+        return 'audio'
+    return None
+
+
+class FileTypeClassifier:
+    """
+    Classifies files as image, video, audio or other.
+    By default the type comes from a case-insensitive extension table (built once from mimetypes plus
+    EXTRA_EXTENSIONS); extensions missing from the table are looked up with mimetypes once and memoized.
+    With sniff=True the first SNIFF_SIZE bytes of each file are checked for known signatures first, so files
+    with a missing or wrong extension are still recognized; the extension decides when nothing matches, and weak
+    signatures are ignored for extensions known to be something other than media (e.g. .txt).
+    signature() identifies the configuration (sniffing and the extension table), so types stored by an earlier
+    run (e.g. in the metadata cache) are only reused while it is the same.
+    """
+
+    def __init__(self, sniff: bool = False, extensions: dict = None):
+        self.sniff = sniff
+        self._table = _default_table()
+        self._configured = dict(self._table)  # the table without memoized mimetypes lookups
+        self._lock = threading.Lock()
+        if extensions:
+            for ext, ftype in extensions.items():
+                self.add(ftype, ext)
+
+    def add(self, ftype: str, *extensions: str):
+        """
+        Map extensions (with or without the leading dot, any case) to ftype, e.g. add('image', *RAW_EXTENSIONS).
+        """
+        with self._lock:
+            for ext in extensions:
+                ext = ext.lower()
+                ext = ext if ext.startswith('.') else '.' + ext
+                self._table[ext] = self._configured[ext] = ftype
+
+    def signature(self) -> str:
+        """
+        Short digest of the sniff flag and the configured extension table.
+        """
+        with self._lock:
+            config = json.dumps([self.sniff and SNIFF_VERSION, sorted(self._configured.items())])
+        return hashlib.sha256(config.encode()).hexdigest()[:16]
+
+    def for_extension(self, ext: str) -> str:
+        ext = ext.lower()
+        ftype = self._table.get(ext)
+        if ftype is None:
+            ftype = _mime_type(ext)
+            with self._lock:
+                self._table[ext] = ftype
+        return ftype
+
+    def _known_other(self, ext: str) -> bool:
+        ext = ext.lower()
+        if ext in self._configured:
+            return self._configured[ext] == 'other'
+        return mimetypes.guess_type('file' + ext)[0] is not None and _mime_type(ext) == 'other'
+
+    def classify(self, path: str) -> str:
+        ext = os.path.splitext(path)[1]
+        if self.sniff:
+            try:
+                with open(path, 'rb') as f:
+                    ftype = sniff_type(f.read(SNIFF_SIZE), weak=not self._known_other(ext))
+                if ftype is not None:
+                    return ftype
+            except OSError as e:
+                print(f"Error reading file {path}: {e}")
+        return self.for_extension(ext)
+
+    def classify_batch(self, paths, workers: int = None, scheduler=None) -> Dict[str, str]:
+        """
+        Classify many files; when sniffing, the header reads run on a thread pool. Returns path -> type.
+        With a scheduler (utils.io_scheduler.IOScheduler), header reads go through it, in its order.
+        """
+        paths = list(paths)
+        classify = self.classify
+        if self.sniff and scheduler is not None:
+            paths = scheduler.order(paths)
+            classify = scheduler.wrap(self.classify, 'sniff', SNIFF_SIZE)
+        if not self.sniff or len(paths) < SNIFF_MIN_PARALLEL:
+            return {path: classify(path) for path in paths}
+        with ThreadPoolExecutor(max_workers=workers or min(32, (os.cpu_count() or 1) * 4)) as pool:
+            return dict(zip(paths, pool.map(classify, paths)))
+
+
+DEFAULT_CLASSIFIER = FileTypeClassifier()
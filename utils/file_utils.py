@@ -1,107 +1,268 @@
 import os
+import stat
 import datetime
-from typing import List, Dict
-import mimetypes
+from typing import Iterable, Iterator, List
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from mutagen import File as MutagenFile
-import shutil
+from mutagen.easyid3 import EasyID3
+from mutagen.id3 import ID3NoHeaderError
+from utils.copy_engine import CopyEngine
+from utils.file_types import DEFAULT_CLASSIFIER
+from utils.capture_date import read_capture_date
 
-def scan_files(source_directory: str) -> List[Dict]:
+# Below this many audio files, a process pool costs more than it saves
+AUDIO_BATCH_MIN_PARALLEL = 64
+# What a tag read is charged against a bandwidth cap: tags live in the first few KiB of a file
+AUDIO_TAG_BYTES = 64 * 1024
+
+class FileRecord:
+    """
+    Compact metadata record for a scanned file.
+    Timestamps are kept as raw floats; 'created', 'modified' and 'taken' are converted to datetimes on access.
+    captured is the capture date read from the file header: None until it has been read, 0 if there was none.
+    Supports dict-style access (record['path']) so existing consumers keep working.
+    """
+    __slots__ = ('path', 'size', 'ctime', 'mtime', 'ino', 'dev', 'type', 'extra_metadata', 'captured')
+
+    def __init__(self, path: str, size: int, ctime: float, mtime: float, ino: int = 0, dev: int = 0):
+        self.path = path
+        self.size = size
+        self.ctime = ctime
+        self.mtime = mtime
+        self.ino = ino
+        self.dev = dev
+        self.type = None  # To be filled by categorize_files
+        self.extra_metadata = None
+        self.captured = None
+
+    @property
+    def taken(self) -> datetime.datetime:
+        """
+        Capture date for date-based folders, falling back to the modification time (ctime is only the inode
+        change time on Linux, i.e. the restore date for files restored from a backup).
+        """
+        return datetime.datetime.fromtimestamp(self.captured or self.mtime)
+
+    @property
+    def created(self) -> datetime.datetime:
+        return datetime.datetime.fromtimestamp(self.ctime)
+
+    @property
+    def modified(self) -> datetime.datetime:
+        return datetime.datetime.fromtimestamp(self.mtime)
+
+    def __getitem__(self, key):
+        try:
+            value = getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+        if key == 'extra_metadata' and value is None:
+            value = self.extra_metadata = {}
+        return value
+
+    def __setitem__(self, key, value):
+        try:
+            setattr(self, key, value)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in ('created', 'modified', 'taken') or key in self.__slots__
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __repr__(self):
+        return f"FileRecord({self.path!r}, size={self.size})"
+
+
+def iter_files(source_directory: str, recursive: bool = True, scheduler=None, on_error=None) -> Iterator[FileRecord]:
+    """
+    Recursively scan the source directory with os.scandir and lazily yield a FileRecord per file.
+    Directory/file checks use the DirEntry type and the stat result is cached on the entry,
+    so each file is stat'ed at most once. With recursive=False only the files directly in the directory are yielded.
+    With a scheduler (utils.io_scheduler.IOScheduler), each listing and stat counts against its IOPS cap, and on
+    devices it reorders, entries are stat'ed in inode order.
+    Files and directories that cannot be read are skipped; each is passed to on_error(path, error) if given.
+    """
+    stack = [source_directory]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as it:
+                subdirs = []
+                entries = it
+                if scheduler is not None:
+                    scheduler.throttle(ops=1, stage='scan')
+                    if scheduler.reorders(os.path.join(directory, '')):
+                        entries = sorted(it, key=lambda entry: entry.inode())
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if recursive:
+                                subdirs.append(entry.path)
+                        elif entry.is_file():
+                            if scheduler is not None:
+                                scheduler.throttle(ops=1, stage='scan')
+                            st = entry.stat()
+                            yield FileRecord(entry.path, st.st_size, st.st_ctime, st.st_mtime, st.st_ino, st.st_dev)
+                    except OSError as e:
+                        if on_error is not None:
+                            on_error(entry.path, e)
+        except OSError as e:
+            if on_error is not None:
+                on_error(directory, e)
+            continue
+        # Reverse so subdirectories are visited in listing order
+        stack.extend(reversed(subdirs))
+
+
+def stat_files(paths: Iterable[str]) -> Iterator[FileRecord]:
+    """
+    Yield a FileRecord per path, e.g. for files reported by a watcher.
+    Paths that no longer exist or are not regular files are skipped.
+    """
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        if stat.S_ISREG(st.st_mode):
+            yield FileRecord(path, st.st_size, st.st_ctime, st.st_mtime, st.st_ino, st.st_dev)
+
+
+def scan_files(source_directory: str) -> List[FileRecord]:
     """
     Recursively scan the source directory and extract metadata for each file.
-    Returns a list of dicts with keys: path, type, size, created, modified, extra_metadata.
-    """
-    file_metadata = []
-    for root, _, files in os.walk(source_directory):
-        for name in files:
-            path = os.path.join(root, name)
-            try:
-                stat = os.stat(path)
-                created = datetime.datetime.fromtimestamp(stat.st_ctime)
-                modified = datetime.datetime.fromtimestamp(stat.st_mtime)
-                size = stat.st_size
-                file_metadata.append({
-                    "path": path,
-                    "type": None,  # To be filled by categorize_files
-                    "size": size,
-                    "created": created,
-                    "modified": modified,
-                    "extra_metadata": {}
-                })
-            except Exception as e:
-                print(f"Error reading file {path}: {e}")
-    return file_metadata
-
-def detect_file_type(file_path: str) -> str:
-    """
-    Detect file type: image, video, audio, other.
-    """
-    mime, _ = mimetypes.guess_type(file_path)
-    if mime:
-        if mime.startswith('image'):
-            return 'image'
-        elif mime.startswith('video'):
-            return 'video'
-        elif mime.startswith('audio'):
-            return 'audio'
-    return 'other'
-
-
-def categorize_files(file_metadata: list, destination_directory: str, source_directory: str = None) -> dict:
+    Returns a list of FileRecords with keys: path, type, size, created, modified, extra_metadata.
+    Prefer iter_files for large trees; this materializes the whole list.
+    """
+    return list(iter_files(source_directory))
+
+def detect_file_type(file_path: str, classifier=None) -> str:
+    """
+    Detect file type: image, video, audio, other (see FileTypeClassifier; the default one goes by extension).
+    """
+    return (classifier or DEFAULT_CLASSIFIER).classify(file_path)
+
+
+def category_for_type(ftype: str) -> str:
+    """
+    Map a detected file type to its destination category.
+    """
+    return ftype + 's' if ftype in ('image', 'video') else ftype if ftype == 'audio' else 'other'
+
+
+def categorize_file(meta, destination_directory: str, source_directory: str = None,
+                    known_destinations: dict = None) -> tuple:
+    """
+    Categorize a single file record. Returns (category, destination path).
+    A type or audio tags already set on the record (e.g. from the metadata cache) are reused,
+    and a file listed in known_destinations keeps that destination.
+    """
+    ftype = meta['type'] or detect_file_type(meta['path'])
+    meta['type'] = ftype
+    if known_destinations and meta['path'] in known_destinations:
+        return category_for_type(ftype), known_destinations[meta['path']]
+    if ftype == 'image' or ftype == 'video':
+        if meta['captured'] is None:
+            meta['captured'] = read_capture_date(meta['path']) or 0
+        year = meta['taken'].strftime('%Y')
+        month = meta['taken'].strftime('%m-%Y')
+        dest = os.path.join(destination_directory, ftype + 's', year, month)
+        fname = os.path.basename(meta['path'])
+        return ftype + 's', os.path.join(dest, fname)
+    elif ftype == 'audio':
+        # Extract audio metadata
+        audio_metadata = meta['extra_metadata'] or extract_audio_metadata(meta['path'])
+        meta['extra_metadata'] = audio_metadata
+        artist = audio_metadata.get('artist', 'UnknownArtist')
+        album = audio_metadata.get('album', 'UnknownAlbum')
+        dest = os.path.join(destination_directory, 'audio', artist, album)
+        fname = os.path.basename(meta['path'])
+        return 'audio', os.path.join(dest, fname)
+    else:
+        # Keep only subdirectories below source_directory for 'other'
+        if source_directory:
+            rel_path = os.path.relpath(meta['path'], source_directory)
+        else:
+            rel_path = os.path.relpath(meta['path'], os.path.dirname(destination_directory))
+        return 'other', os.path.join(destination_directory, 'other', rel_path)
+
+
+def categorize_files(file_metadata: Iterable, destination_directory: str, source_directory: str = None,
+                     known_destinations: dict = None) -> dict:
     """
     Categorize files by type and organize them into destination subdirectories.
     For 'other' files, preserve only the subdirectory structure below the source directory.
+    file_metadata may be any iterable (e.g. iter_files); it is consumed in a single pass.
+    See categorize_file for how cached types, tags and known destinations are reused.
     """
     categorized = defaultdict(dict)
     for meta in file_metadata:
-        ftype = detect_file_type(meta['path'])
-        meta['type'] = ftype
-        if ftype == 'image' or ftype == 'video':
-            year = meta['created'].strftime('%Y')
-            month = meta['created'].strftime('%m-%Y')
-            dest = os.path.join(destination_directory, ftype + 's', year, month)
-            fname = os.path.basename(meta['path'])
-            categorized[ftype + 's'][meta['path']] = os.path.join(dest, fname)
-        elif ftype == 'audio':
-            # Extract audio metadata
-            audio_metadata = extract_audio_metadata(meta['path'])
-            artist = audio_metadata.get('artist', 'UnknownArtist')
-            album = audio_metadata.get('album', 'UnknownAlbum')
-            title = audio_metadata.get('title', 'UnknownTitle')
-            dest = os.path.join(destination_directory, 'audio', artist, album)
-            fname = os.path.basename(meta['path'])
-            categorized['audio'][meta['path']] = os.path.join(dest, fname)
-        else:
-            # Keep only subdirectories below source_directory for 'other'
-            if source_directory:
-                rel_path = os.path.relpath(meta['path'], source_directory)
-            else:
-                rel_path = os.path.relpath(meta['path'], os.path.dirname(destination_directory))
-            categorized['other'][meta['path']] = os.path.join(destination_directory, 'other', rel_path)
+        category, dest = categorize_file(meta, destination_directory, source_directory, known_destinations)
+        categorized[category][meta['path']] = dest
     return categorized
 
 def extract_audio_metadata(audio_file_path: str) -> dict:
     """
     Extract artist, album, and title from audio file using mutagen.
+    MP3 files are read through EasyID3, which parses only the ID3 tag header, not the audio frames.
     """
     metadata = {'artist': 'UnknownArtist', 'album': 'UnknownAlbum', 'title': 'UnknownTitle'}
     try:
-        audio = MutagenFile(audio_file_path)
-        if audio:
-            metadata['artist'] = (audio.tags.get('TPE1') or ['UnknownArtist'])[0] if 'TPE1' in audio.tags else metadata['artist']
-            metadata['album'] = (audio.tags.get('TALB') or ['UnknownAlbum'])[0] if 'TALB' in audio.tags else metadata['album']
-            metadata['title'] = (audio.tags.get('TIT2') or ['UnknownTitle'])[0] if 'TIT2' in audio.tags else metadata['title']
+        if audio_file_path.lower().endswith('.mp3'):
+            tags = EasyID3(audio_file_path)
+        else:
+            audio = MutagenFile(audio_file_path, easy=True)
+            tags = audio.tags if audio else None
+        if tags:
+            for key in metadata:
+                values = tags.get(key)
+                if values:
+                    metadata[key] = str(values[0])
+    except ID3NoHeaderError:
+        pass  # untagged MP3
     except Exception as e:
         print(f"Error extracting audio metadata from {audio_file_path}: {e}")
     return metadata
 
-def copy_files(categorized_files: dict, destination_directory: str):
+
+def extract_audio_metadata_batch(audio_file_paths: list, workers: int = None, scheduler=None) -> dict:
+    """
+    Extract audio metadata for many files, reading each file's tags exactly once.
+    Large batches fan out across a process pool. Returns a dict mapping path -> metadata.
+    With a scheduler, files are read in its order and each read counts against its caps
+    (pooled reads are paced as they are submitted).
+    """
+    if scheduler is not None:
+        audio_file_paths = scheduler.order(audio_file_paths)
+    if len(audio_file_paths) < AUDIO_BATCH_MIN_PARALLEL:
+        read = scheduler.wrap(extract_audio_metadata, 'tags', AUDIO_TAG_BYTES) if scheduler is not None \
+            else extract_audio_metadata
+        return {path: read(path) for path in audio_file_paths}
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        if scheduler is not None:
+            results = scheduler.map_paced(pool, extract_audio_metadata, audio_file_paths, 'tags',
+                                          lambda path: (AUDIO_TAG_BYTES, 1), window=workers * 2)
+        else:
+            chunksize = max(1, min(256, len(audio_file_paths) // (workers * 4)))
+            results = pool.map(extract_audio_metadata, audio_file_paths, chunksize=chunksize)
+        return dict(zip(audio_file_paths, results))
+
+def copy_files(categorized_files: dict, destination_directory: str, workers: int = None,
+               per_device_limit: int = None, on_copied=None, mode: str = 'copy', no_clobber: bool = False,
+               index=None) -> list:
     """
-    Copy files to the destination directory.
+    Copy (or move/link, see CopyEngine) files to the destination directory in parallel using the CopyEngine.
+    on_copied(src, dest, operation, checksum) is called as each file is placed. Returns the (src, dest) pairs that failed.
     """
-    for category, files in categorized_files.items():
-        for src, dest in files.items():
-            os.makedirs(os.path.dirname(dest), exist_ok=True)
-            if not os.path.exists(dest):
-                shutil.copy2(src, dest)
-            # else: conflict resolution should have already handled naming
\ No newline at end of file
+    engine = CopyEngine(workers=workers, per_device_limit=per_device_limit, on_copied=on_copied, mode=mode,
+                        no_clobber=no_clobber, index=index)
+    pairs = ((src, dest) for files in categorized_files.values() for src, dest in files.items())
+    return engine.copy_all(pairs)
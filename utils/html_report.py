@@ -1,54 +1,209 @@
 import os
+import re
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
 from PIL import Image
 
-def generate_thumbnails(image_path: str, thumbnail_size=(128, 128)) -> str:
+THUMBNAIL_DIRNAME = '.thumbnails'
+VIDEO_PLACEHOLDER = 'video_placeholder.svg'
+GALLERY_PAGES_DIRNAME = '.pages'
+_YEAR_RE = re.compile(r'^\d{4}$')
+_MONTH_RE = re.compile(r'^\d{2}-\d{4}$')
+# Below this many missing thumbnails, a process pool costs more than it saves
+THUMBNAIL_MIN_PARALLEL = 16
+_VIDEO_PLACEHOLDER_SVG = (
+    '<svg xmlns="http://www.w3.org/2000/svg" width="128" height="96" viewBox="0 0 128 96">'
+    '<rect width="128" height="96" fill="#333"/>'
+    '<polygon points="52,30 52,66 82,48" fill="#eee"/></svg>')
+
+
+def thumbnail_path_for(image_path: str, cache_dir: str, size: int, mtime: float) -> str:
+    """
+    Return the cache path of the thumbnail for a given version (size, mtime) of an image.
+    A changed source gets a new name, so an existing file at this path is always up to date.
+    """
+    key = hashlib.sha1(image_path.encode('utf-8', 'surrogateescape')).hexdigest()[:20]
+    return os.path.join(cache_dir, f"{key}_{size}_{int(mtime)}.jpg")
+
+
+def generate_thumbnails(image_path: str, thumbnail_size=(128, 128), thumb_path: str = None) -> str:
     """
     Generate a thumbnail for the given image and return the thumbnail path.
+    JPEGs are decoded at reduced scale via Pillow's draft mode instead of at full resolution.
     """
-    thumb_dir = os.path.join(os.path.dirname(image_path), 'thumbnails')
-    os.makedirs(thumb_dir, exist_ok=True)
-    thumb_path = os.path.join(thumb_dir, os.path.basename(image_path))
+    if thumb_path is None:
+        thumb_dir = os.path.join(os.path.dirname(image_path), 'thumbnails')
+        thumb_path = os.path.join(thumb_dir, os.path.basename(image_path))
+    os.makedirs(os.path.dirname(thumb_path), exist_ok=True)
     try:
         with Image.open(image_path) as img:
+            img.draft('RGB', thumbnail_size)
             img.thumbnail(thumbnail_size)
+            if thumb_path.lower().endswith(('.jpg', '.jpeg')) and img.mode != 'RGB':
+                img = img.convert('RGB')
             img.save(thumb_path)
     except Exception as e:
         print(f"Error generating thumbnail for {image_path}: {e}")
     return thumb_path
 
 
-def generate_html_report(organized_files: dict, destination_directory: str, category: str):
+def _generate_thumbnail_job(job):
+    image_path, thumb_path, thumbnail_size = job
+    return generate_thumbnails(image_path, thumbnail_size, thumb_path)
+
+
+def generate_thumbnails_batch(image_paths, cache_dir: str, thumbnail_size=(128, 128), workers: int = None,
+                              scheduler=None) -> dict:
     """
-    Generate an HTML gallery report for images or videos, organized by year and month.
-    Displays each image as no larger than 100x100 pixels, sorted newest to oldest, with years in reverse chronological order.
+    Generate cached thumbnails for many images, skipping those already up to date (by source size and mtime).
+    Missing thumbnails are rendered in a process pool. Returns a dict mapping image path -> thumbnail path.
+    With a scheduler (utils.io_scheduler.IOScheduler), images are read in its order and each one is charged
+    against its caps (pooled renders are paced as they are submitted).
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    thumbnails = {}
+    jobs = []
+    for image_path in image_paths:
+        try:
+            st = os.stat(image_path)
+        except OSError:
+            continue
+        thumb_path = thumbnail_path_for(image_path, cache_dir, st.st_size, st.st_mtime)
+        thumbnails[image_path] = thumb_path
+        if not os.path.exists(thumb_path):
+            jobs.append((image_path, thumb_path, thumbnail_size, st))
+    sizes = {}
+    if scheduler is not None:
+        jobs = scheduler.order(jobs, path=lambda job: job[0], inode=lambda job: job[3].st_ino)
+        sizes = {job[0]: job[3].st_size for job in jobs}
+    jobs = [(image_path, thumb_path, size) for image_path, thumb_path, size, st in jobs]
+    if len(jobs) < THUMBNAIL_MIN_PARALLEL:
+        for job in jobs:
+            if scheduler is not None:
+                with scheduler.io(job[0], 'thumbnails', sizes[job[0]]):
+                    _generate_thumbnail_job(job)
+            else:
+                _generate_thumbnail_job(job)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            if scheduler is not None:
+                results = scheduler.map_paced(pool, _generate_thumbnail_job, jobs, 'thumbnails',
+                                              lambda job: (sizes[job[0]], 1),
+                                              window=2 * (workers or os.cpu_count() or 1))
+            else:
+                results = pool.map(_generate_thumbnail_job, jobs, chunksize=8)
+            for _ in results:
+                pass
+    return {path: thumb for path, thumb in thumbnails.items() if os.path.exists(thumb)}
+
+
+def video_placeholder(cache_dir: str) -> str:
+    """
+    Write (once) and return the poster-frame placeholder used for videos in the gallery.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, VIDEO_PLACEHOLDER)
+    if not os.path.exists(path):
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(_VIDEO_PLACEHOLDER_SVG)
+    return path
+
+
+def _gallery_months(category_directory: str) -> dict:
+    """
+    List the year/month folders of a gallery category on disk. Returns {year: [month, ...]}.
     """
-    report_path = os.path.join(destination_directory, category, 'index.html')
     years = {}
-    file_dates = {}
-    # Build mapping and collect modified dates
-    for src, dest in organized_files.get(category, {}).items():
-        parts = dest.split(os.sep)
-        if len(parts) >= 4:
-            year = parts[-3]
-            month = parts[-2]
-            years.setdefault(year, {}).setdefault(month, []).append(dest)
-            try:
-                file_dates[dest] = os.path.getmtime(dest)
-            except Exception:
-                file_dates[dest] = 0
-    html = ['<html><body>']
+    try:
+        with os.scandir(category_directory) as it:
+            year_dirs = [entry for entry in it if entry.is_dir() and _YEAR_RE.match(entry.name)]
+    except OSError:
+        return years
+    for year_dir in year_dirs:
+        with os.scandir(year_dir.path) as it:
+            months = [entry.name for entry in it if entry.is_dir() and _MONTH_RE.match(entry.name)]
+        if months:
+            years[year_dir.name] = months
+    return years
+
+
+def _write_month_page(page_path: str, month_directory: str, title: str, index_path: str,
+                      mtimes: dict, thumbnails: dict, default_thumbnail: str, thumb_cache_dir: str):
+    """
+    Stream one month page to disk, listing every file in the month folder, newest first.
+    """
+    files = []
+    with os.scandir(month_directory) as it:
+        for entry in it:
+            if not entry.is_file() or entry.name.startswith('.'):
+                continue
+            mtime = mtimes.get(entry.path)
+            if mtime is None:
+                mtime = entry.stat().st_mtime
+            files.append((mtime, entry.path))
+    files.sort(reverse=True)
+    page_dir = os.path.dirname(page_path)
+    with open(page_path, 'w', encoding='utf-8') as f:
+        f.write(f'<html><body>\n<p><a href="{os.path.relpath(index_path, page_dir)}">All months</a></p>\n')
+        f.write(f'<h2>{title}</h2><div style="display:flex;flex-wrap:wrap;">\n')
+        for mtime, file in files:
+            thumb = thumbnails.get(file) or default_thumbnail
+            if thumb is None:
+                st = os.stat(file)
+                cached = thumbnail_path_for(file, thumb_cache_dir, st.st_size, st.st_mtime)
+                thumb = cached if os.path.exists(cached) else file
+            rel_file = os.path.relpath(file, page_dir)
+            rel_thumb = os.path.relpath(thumb, page_dir)
+            f.write(f'<a href="{rel_file}" target="_blank"><img src="{rel_thumb}" loading="lazy" '
+                    f'style="max-width:100px;max-height:100px;margin:4px;object-fit:contain;"/></a>\n')
+        f.write('</div>\n</body></html>')
+
+
+def generate_html_report(organized_files: dict, destination_directory: str, category: str, thumbnails: dict = None,
+                         mtimes: dict = None, changed_months: set = None, default_thumbnail: str = None):
+    """
+    Generate a paginated HTML gallery for images or videos: an index page linking one page per year and month.
+    Displays each image as no larger than 100x100 pixels, sorted newest to oldest, with years in reverse chronological order.
+    thumbnails maps destination paths to thumbnail images (default_thumbnail is used for files without one);
+    each tile shows its thumbnail, lazily loaded, and links to the original.
+    mtimes maps destination paths to modification times already collected during the scan.
+    Only month pages in changed_months ((year, month) pairs) or missing on disk are rewritten;
+    with changed_months=None, the months of every file in organized_files[category] are rewritten.
+    The index is rewritten only when its list of months changed.
+    """
+    thumbnails = thumbnails or {}
+    mtimes = mtimes or {}
+    category_directory = os.path.join(destination_directory, category)
+    report_path = os.path.join(category_directory, 'index.html')
+    pages_directory = os.path.join(category_directory, GALLERY_PAGES_DIRNAME)
+    thumb_cache_dir = os.path.join(category_directory, THUMBNAIL_DIRNAME)
+    os.makedirs(pages_directory, exist_ok=True)
+    if changed_months is None:
+        changed_months = set()
+        for dest in organized_files.get(category, {}).values():
+            parts = dest.split(os.sep)
+            if len(parts) >= 4:
+                changed_months.add((parts[-3], parts[-2]))
+    years = _gallery_months(category_directory)
+    index = ['<html><body>\n']
     for year in sorted(years.keys(), reverse=True):
-        html.append(f'<h2>{year}</h2>')
-        months = years[year]
-        for month, files in sorted(months.items()):
-            # Sort files by modified date, newest first
-            files_sorted = sorted(files, key=lambda f: file_dates.get(f, 0), reverse=True)
-            html.append(f'<h3>{month}</h3><div style="display:flex;flex-wrap:wrap;">')
-            for file in files_sorted:
-                rel_file = os.path.relpath(file, os.path.dirname(report_path))
-                html.append(f'<a href="{rel_file}" target="_blank"><img src="{rel_file}" style="max-width:100px;max-height:100px;margin:4px;object-fit:contain;"/></a>')
-            html.append('</div>')
-    html.append('</body></html>')
-    with open(report_path, 'w', encoding='utf-8') as f:
-        f.write('\n'.join(html))
-    return report_path
\ No newline at end of file
+        index.append(f'<h2>{year}</h2>\n<ul>\n')
+        for month in sorted(years[year]):
+            page_path = os.path.join(pages_directory, f'{month}.html')
+            if (year, month) in changed_months or not os.path.exists(page_path):
+                _write_month_page(page_path, os.path.join(category_directory, year, month), month, report_path,
+                                  mtimes, thumbnails, default_thumbnail, thumb_cache_dir)
+            index.append(f'<li><a href="{os.path.relpath(page_path, category_directory)}">{month}</a></li>\n')
+        index.append('</ul>\n')
+    index.append('</body></html>')
+    index = ''.join(index)
+    # The index only changes when a month folder appears, so it is left untouched otherwise
+    try:
+        with open(report_path, encoding='utf-8') as f:
+            current = f.read()
+    except OSError:
+        current = None
+    if index != current:
+        with open(report_path, 'w', encoding='utf-8') as f:
+            f.write(index)
+    return report_path
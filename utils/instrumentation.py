@@ -0,0 +1,145 @@
+import os
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+
+class Instrumentation:
+    """
+    Collects wall time per span (nodes and hot utilities), file/byte/error counters and queue depths.
+    Optionally draws a live progress line on stderr and records events for a Chrome trace
+    (open the exported JSON in chrome://tracing or Perfetto).
+    """
+
+    def __init__(self, progress: bool = False, trace: bool = False, stream=sys.stderr, interval: float = 0.5):
+        self.progress = progress
+        self.trace = trace
+        self.stream = stream
+        self.interval = interval
+        self.counters = {}   # name -> {'files': n, 'bytes': n, 'errors': n}
+        self.timings = {}    # span name -> total seconds
+        self.depths = {}
+        self._depth_source = None
+        self._events = []
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _now_us(self) -> float:
+        return (time.perf_counter() - self._origin) * 1e6
+
+    @contextmanager
+    def span(self, name: str):
+        """
+        Time a block; the total per name is reported in summary() and each call becomes a trace event.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            with self._lock:
+                self.timings[name] = self.timings.get(name, 0.0) + end - start
+                if self.trace:
+                    self._events.append({
+                        'name': name, 'ph': 'X', 'pid': os.getpid(), 'tid': threading.get_ident(),
+                        'ts': (start - self._origin) * 1e6, 'dur': (end - start) * 1e6,
+                    })
+
+    def count(self, name: str, files: int = 0, nbytes: int = 0, errors: int = 0):
+        with self._lock:
+            counter = self.counters.setdefault(name, {'files': 0, 'bytes': 0, 'errors': 0})
+            counter['files'] += files
+            counter['bytes'] += nbytes
+            counter['errors'] += errors
+
+    def counted(self, name: str, records):
+        """
+        Pass records through unchanged while counting files and bytes under name.
+        """
+        for record in records:
+            self.count(name, 1, record['size'])
+            yield record
+
+    def watch_queues(self, depth_source):
+        """
+        Sample queue depths from depth_source() (a dict of name -> depth) while the progress thread runs.
+        """
+        self._depth_source = depth_source
+
+    def _sample(self):
+        if self._depth_source is not None:
+            depths = self._depth_source()
+            with self._lock:
+                self.depths = depths
+                if self.trace:
+                    self._events.append({'name': 'queue depth', 'ph': 'C', 'pid': os.getpid(),
+                                         'ts': self._now_us(), 'args': dict(depths)})
+
+    def progress_line(self) -> str:
+        elapsed = time.perf_counter() - self._origin
+        with self._lock:
+            parts = [f"{elapsed:7.1f}s"]
+            for name, counter in self.counters.items():
+                part = f"{name} {counter['files']:,}"
+                if counter['bytes']:
+                    part += f" ({counter['bytes'] / 1e6:,.1f} MB)"
+                if counter['errors']:
+                    part += f" [{counter['errors']} errors]"
+                parts.append(part)
+            if self.depths:
+                parts.append('queues ' + ' '.join(f'{name}={depth}' for name, depth in self.depths.items()))
+        return ' | '.join(parts)
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+            if self.progress:
+                self.stream.write('\r' + self.progress_line() + '\033[K')
+                self.stream.flush()
+
+    def start(self):
+        if (self.progress or self.trace) and self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='instrumentation', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            if self.progress:
+                self.stream.write('\r' + self.progress_line() + '\033[K\n')
+                self.stream.flush()
+
+    def summary(self) -> str:
+        lines = ['Timings:']
+        for name, seconds in self.timings.items():
+            lines.append(f"  {name:32} {seconds:9.3f}s")
+        for name, counter in self.counters.items():
+            lines.append(f"  {name:32} {counter['files']:,} files, {counter['bytes']:,} bytes, {counter['errors']} errors")
+        return '\n'.join(lines)
+
+    def export_trace(self, path: str):
+        """
+        Write recorded spans, counters and queue depths as Chrome trace JSON.
+        """
+        with self._lock:
+            events = list(self._events)
+            events.append({'name': 'totals', 'ph': 'i', 's': 'g', 'pid': os.getpid(), 'ts': self._now_us(),
+                           'args': {'timings': self.timings, 'counters': self.counters}})
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+_NULL = Instrumentation()
+
+
+def instrumentation_for(shared) -> Instrumentation:
+    """
+    Return the shared store's Instrumentation, or a process-wide default one when nodes run without a flow.
+    """
+    return shared.get('instrumentation') or _NULL
@@ -0,0 +1,448 @@
+import os
+import sys
+import time
+import ctypes
+import struct
+import platform
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+ORDERS = ('auto', 'inode', 'extent', 'none')
+PRIORITIES = ('normal', 'low', 'idle')
+# A request's latency is normalized per COST_UNIT bytes, so small and large files can be compared
+COST_UNIT = 1024 * 1024
+DEFAULT_TOLERANCE = 2.0
+LOW_PRIORITY_TOLERANCE = 1.25
+# Recent latency is a fast moving average; the baseline it is compared to a slow one, pulled down faster
+# than up, so it follows the device's normal latency (not the odd page-cache hit) and a rise stands out
+EWMA_WEIGHT = 0.2
+BASELINE_WEIGHT_DOWN = 0.05
+BASELINE_WEIGHT_UP = 0.01
+
+FS_IOC_FIEMAP = 0xC020660B
+_FIEMAP = struct.Struct('QQIIII')  # fm_start, fm_length, fm_flags, fm_mapped_extents, fm_extent_count, fm_reserved
+_FIEMAP_EXTENT = struct.Struct('QQQQQIIII')  # fe_logical, fe_physical, fe_length, reserved x2, fe_flags, reserved x3
+
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_CLASS_BE = 2
+IOPRIO_CLASS_IDLE = 3
+_SYS_IOPRIO_SET = {'x86_64': 251, 'i386': 289, 'i686': 289, 'aarch64': 30, 'armv7l': 314, 'ppc64le': 273,
+                   's390x': 282}
+
+
+def parse_rate(value: str) -> float:
+    """
+    Parse a rate such as '500', '20M' or '1.5G' (binary multiples) into units per second.
+    """
+    value = value.strip().upper().removesuffix('/S').rstrip('B')
+    multiplier = 1
+    if value and value[-1] in 'KMGT':
+        multiplier = 1024 ** ('KMGT'.index(value[-1]) + 1)
+        value = value[:-1]
+    rate = float(value) * multiplier
+    if not rate > 0:  # also rejects nan
+        raise ValueError('Rate must be positive')
+    return rate
+
+
+def set_io_priority(priority: str) -> bool:
+    """
+    Lower the I/O priority of this process and of the threads and processes it starts afterwards, like ionice:
+    'low' is best-effort level 7, 'idle' the idle class. Returns False where ioprio_set is unavailable.
+    Only some Linux I/O schedulers (BFQ, CFQ) honour it, and never for network filesystems.
+    """
+    if priority == 'normal':
+        return True
+    number = _SYS_IOPRIO_SET.get(platform.machine()) if sys.platform.startswith('linux') else None
+    if number is None:
+        return False
+    if priority == 'idle':
+        value = IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT
+    else:
+        value = (IOPRIO_CLASS_BE << IOPRIO_CLASS_SHIFT) | 7
+    try:
+        return ctypes.CDLL(None, use_errno=True).syscall(number, IOPRIO_WHO_PROCESS, 0, value) == 0
+    except (OSError, AttributeError):
+        return False
+
+
+def is_rotational(dev: int):
+    """
+    Whether the block device dev is a spinning disk, from sysfs (partitions look at their disk).
+    None if unknown, e.g. for network filesystems.
+    """
+    base = f'/sys/dev/block/{os.major(dev)}:{os.minor(dev)}'
+    for path in (base + '/queue/rotational', base + '/../queue/rotational'):
+        try:
+            with open(path) as f:
+                return f.read().strip() == '1'
+        except OSError:
+            continue
+    return None
+
+
+def physical_offset(path: str):
+    """
+    Physical byte offset of the first extent of a file (FIEMAP), or None if the filesystem cannot tell.
+    """
+    try:
+        import fcntl
+        request = bytearray(_FIEMAP.pack(0, 0xFFFFFFFFFFFFFFFF, 0, 0, 1, 0) + bytes(_FIEMAP_EXTENT.size))
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            fcntl.ioctl(fd, FS_IOC_FIEMAP, request)
+        finally:
+            os.close(fd)
+    except (ImportError, OSError):
+        return None
+    if _FIEMAP.unpack_from(request)[3] == 0:
+        return None  # empty or inline file
+    return _FIEMAP_EXTENT.unpack_from(request, _FIEMAP.size)[1]
+
+
+class TokenBucket:
+    """
+    Allows rate units per second with bursts up to burst (one second's worth by default). take() reserves its
+    amount at once and sleeps off any shortfall, so requests larger than the burst still keep the long-run rate.
+    """
+
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self, amount: float) -> float:
+        """
+        Take amount units, sleeping until the rate allows them. Returns the seconds waited.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate) - amount
+            self._last = now
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+class DeviceLimiter:
+    """
+    Concurrency limit for one device, adjusted to its measured latency: after each round of limit requests,
+    the limit grows (doubling until the first back-off, then by one) while recent normalized latency stays
+    within tolerance of the device's baseline, and is cut by 30% when it rises above it (AIMD).
+    """
+
+    def __init__(self, dev: int, max_limit: int, start: int, tolerance: float, adaptive: bool = True,
+                 rotational=None):
+        self.dev = dev
+        self.max_limit = max_limit
+        self.limit = float(min(start, max_limit) if adaptive else max_limit)
+        self.tolerance = tolerance
+        self.adaptive = adaptive
+        self.rotational = rotational
+        self.active = 0
+        self.peak = 0
+        self.baseline = None
+        self.latency = None
+        self.samples = 0
+        self.increases = 0
+        self.decreases = 0
+        self.waited = 0.0
+        self._round = 0
+        self._slow_start = True
+        self._cond = threading.Condition()
+
+    def acquire(self) -> float:
+        start = time.monotonic()
+        with self._cond:
+            while self.active >= int(self.limit):
+                self._cond.wait()
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+            waited = time.monotonic() - start
+            self.waited += waited
+        return waited
+
+    def release(self, cost: float = None):
+        with self._cond:
+            self.active -= 1
+            if cost is not None:
+                self._observe(cost)
+            self._cond.notify_all()
+
+    def _observe(self, cost: float):
+        self.samples += 1
+        self.latency = cost if self.latency is None else self.latency + EWMA_WEIGHT * (cost - self.latency)
+        if self.baseline is None:
+            self.baseline = cost
+        else:
+            weight = BASELINE_WEIGHT_DOWN if cost < self.baseline else BASELINE_WEIGHT_UP
+            self.baseline += weight * (cost - self.baseline)
+        self._round += 1
+        if not self.adaptive or self._round < int(self.limit):
+            return
+        self._round = 0
+        if self.latency > self.baseline * self.tolerance:
+            if self.limit > 1:
+                self.limit = max(1.0, self.limit * 0.7)
+                self.decreases += 1
+            self._slow_start = False
+        elif self.limit < self.max_limit:
+            self.limit = min(float(self.max_limit), self.limit * 2 if self._slow_start else self.limit + 1)
+            self.increases += 1
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                'device': f'{os.major(self.dev)}:{os.minor(self.dev)}',
+                'rotational': self.rotational,
+                'limit': int(self.limit),
+                'max_limit': self.max_limit,
+                'active': self.active,
+                'peak': self.peak,
+                'requests': self.samples,
+                'baseline_ms': round(self.baseline * 1000, 3) if self.baseline is not None else None,
+                'latency_ms': round(self.latency * 1000, 3) if self.latency is not None else None,
+                'increases': self.increases,
+                'decreases': self.decreases,
+                'waited_s': round(self.waited, 3),
+            }
+
+
+class IOScheduler:
+    """
+    Shared I/O policy for the scan, header/tag reads, thumbnails and copies:
+    - bytes_per_second and iops caps (token buckets shared by every stage; copies are charged chunk by chunk),
+    - a concurrency limit per device that adapts to measured latency (see DeviceLimiter), up to max_per_device,
+    - reads ordered by inode number or by physical extent on spinning disks (order 'auto'), on every device
+      ('inode', 'extent') or not at all ('none'),
+    - priority 'low' or 'idle' sets an ionice-style I/O priority and, since network storage ignores that,
+      also backs off at a smaller latency rise (and with half the concurrency) to yield to other traffic.
+    stats() reports per-stage and per-device figures for tuning.
+    """
+
+    def __init__(self, bytes_per_second: float = None, iops: float = None, max_per_device: int = 16,
+                 adaptive: bool = True, order: str = 'auto', priority: str = 'normal', tolerance: float = None):
+        if order not in ORDERS:
+            raise ValueError(f'Unknown order: {order}')
+        if priority not in PRIORITIES:
+            raise ValueError(f'Unknown priority: {priority}')
+        low = priority != 'normal'
+        self.order_mode = order
+        self.priority = priority
+        self.adaptive = adaptive
+        self.tolerance = tolerance or (LOW_PRIORITY_TOLERANCE if low else DEFAULT_TOLERANCE)
+        self.max_per_device = max(1, max_per_device // 2 if low else max_per_device)
+        self._start_limit = 1 if low else min(4, self.max_per_device)
+        self._bytes = TokenBucket(bytes_per_second) if bytes_per_second else None
+        self._ops = TokenBucket(iops) if iops else None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._dir_devices = {}
+        self._devices = {}  # dev -> DeviceLimiter
+        self._stages = {}   # stage -> counters
+        self.priority_set = set_io_priority(priority) if low else None
+        if self.priority_set is False:
+            print(f"I/O priority '{priority}' is not supported here; relying on latency back-off only")
+
+    def device_of(self, path: str) -> int:
+        # One stat per directory
+        directory = os.path.dirname(path) or '.'
+        with self._lock:
+            dev = self._dir_devices.get(directory)
+        if dev is None:
+            dev = os.stat(directory).st_dev
+            with self._lock:
+                self._dir_devices[directory] = dev
+        return dev
+
+    def _limiter(self, dev: int) -> DeviceLimiter:
+        with self._lock:
+            limiter = self._devices.get(dev)
+        if limiter is None:
+            rotational = is_rotational(dev)
+            with self._lock:
+                limiter = self._devices.setdefault(dev, DeviceLimiter(
+                    dev, self.max_per_device, self._start_limit, self.tolerance, self.adaptive, rotational))
+        return limiter
+
+    def _record(self, stage: str, ops: int = 0, nbytes: int = 0, throttled: float = 0.0, queued: float = 0.0,
+                busy: float = 0.0):
+        with self._lock:
+            counters = self._stages.get(stage)
+            if counters is None:
+                counters = self._stages[stage] = {'ops': 0, 'bytes': 0, 'throttled_s': 0.0, 'queued_s': 0.0,
+                                                  'busy_s': 0.0}
+            counters['ops'] += ops
+            counters['bytes'] += nbytes
+            counters['throttled_s'] += throttled
+            counters['queued_s'] += queued
+            counters['busy_s'] += busy
+
+    def _take(self, nbytes: int = 0, ops: int = 0) -> float:
+        waited = 0.0
+        if ops and self._ops is not None:
+            waited += self._ops.take(ops)
+        if nbytes and self._bytes is not None:
+            waited += self._bytes.take(nbytes)
+        return waited
+
+    def throttle(self, nbytes: int = 0, ops: int = 0, stage: str = None) -> float:
+        """
+        Wait until the caps allow nbytes and ops more. Inside io(), the bytes count towards that request and
+        the wait is not counted as device latency. Returns the seconds waited.
+        """
+        waited = self._take(nbytes, ops)
+        local = self._local
+        if getattr(local, 'depth', 0):
+            local.nbytes += nbytes
+            local.waited += waited
+        if stage is not None:
+            self._record(stage, ops, nbytes, waited)
+        return waited
+
+    @contextmanager
+    def io(self, paths, stage: str, nbytes: int = 0, ops: int = 1):
+        """
+        Run one request against the devices of paths (a path or a tuple of paths): waits for the caps to allow
+        ops and nbytes, then for a slot on each device (taken in device order, so requests touching two devices
+        cannot deadlock), and feeds the request's latency back to the devices' limits.
+        Bytes passed to throttle() inside the block are charged as they are transferred instead.
+        """
+        if isinstance(paths, str):
+            paths = (paths,)
+        limiters = [self._limiter(dev) for dev in sorted({self.device_of(path) for path in paths})]
+        throttled = self._take(nbytes, ops)
+        queued = 0.0
+        acquired = []
+        local = self._local
+        local.depth = getattr(local, 'depth', 0) + 1
+        local.nbytes = local.waited = 0
+        try:
+            for limiter in limiters:
+                queued += limiter.acquire()
+                acquired.append(limiter)
+            start = time.monotonic()
+            yield
+        finally:
+            busy = time.monotonic() - start if len(acquired) == len(limiters) else None
+            total = nbytes + local.nbytes
+            if busy is not None:
+                busy = max(0.0, busy - local.waited)
+            cost = busy / (1 + total / COST_UNIT) if busy is not None else None
+            for limiter in acquired:
+                limiter.release(cost)
+            local.depth -= 1
+            self._record(stage, ops, total, throttled + local.waited, queued, busy or 0.0)
+
+    def wrap(self, fn, stage: str, nbytes: int = 0):
+        """
+        fn(path, ...) run as one io() request on path's device.
+        """
+        def scheduled(path, *args, **kwargs):
+            with self.io(path, stage, nbytes):
+                return fn(path, *args, **kwargs)
+        return scheduled
+
+    def map_paced(self, pool, fn, items, stage: str, cost=None, window: int = 64):
+        """
+        Like pool.map(fn, items) for pools the scheduler cannot reach into (e.g. process pools): each item is
+        only submitted once the caps allow its (nbytes, ops) from cost(item), with at most window in flight.
+        Yields the results in order.
+        """
+        pending = deque()
+        for item in items:
+            nbytes, ops = cost(item) if cost is not None else (0, 1)
+            self._record(stage, ops, nbytes, self._take(nbytes, ops))
+            pending.append(pool.submit(fn, item))
+            while len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def reorders(self, path: str) -> bool:
+        """
+        Whether reads on path's device are put in inode or extent order.
+        """
+        if self.order_mode == 'none':
+            return False
+        if self.order_mode != 'auto':
+            return True
+        return bool(self._limiter(self.device_of(path)).rotational)
+
+    def order(self, items, path=None, inode=None) -> list:
+        """
+        Return items in the order their data should be read: on devices that are reordered (see reorders()),
+        grouped by device and sorted by inode number, or by the physical offset of the first extent with order
+        'extent' (falling back to the inode where FIEMAP is unsupported); other items keep their order.
+        path(item) gives an item's path (default: the item) and inode(item) its inode number, if already known.
+        """
+        items = list(items)
+        if self.order_mode == 'none' or not items:
+            return items
+        path = path or (lambda item: item)
+        keys = []
+        reordered = False
+        for position, item in enumerate(items):
+            item_path = path(item)
+            try:
+                dev = self.device_of(item_path)
+                if not self.reorders(item_path):
+                    keys.append((dev, 0, position))
+                    continue
+                offset = physical_offset(item_path) if self.order_mode == 'extent' else None
+                if offset is None:
+                    offset = inode(item) if inode is not None else os.stat(item_path).st_ino
+            except OSError:
+                keys.append((0, 0, position))
+                continue
+            keys.append((dev, offset, position))
+            reordered = True
+        if not reordered:
+            return items
+        return [items[key[2]] for key in sorted(keys)]
+
+    def stats(self) -> dict:
+        with self._lock:
+            stages = {stage: dict(counters) for stage, counters in self._stages.items()}
+            devices = list(self._devices.values())
+        for counters in stages.values():
+            for key in ('throttled_s', 'queued_s', 'busy_s'):
+                counters[key] = round(counters[key], 3)
+        return {
+            'caps': {'bytes_per_second': self._bytes.rate if self._bytes else None,
+                     'iops': self._ops.rate if self._ops else None},
+            'order': self.order_mode,
+            'priority': self.priority,
+            'priority_set': self.priority_set,
+            'adaptive': self.adaptive,
+            'tolerance': self.tolerance,
+            'stages': stages,
+            'devices': [limiter.stats() for limiter in devices],
+        }
+
+    def summary(self) -> str:
+        stats = self.stats()
+        lines = ['I/O scheduler:']
+        for stage, counters in sorted(stats['stages'].items()):
+            lines.append(f"  {stage:<12} {counters['ops']:>10,} ops {counters['bytes']:>16,} bytes "
+                         f"{counters['throttled_s']:>9.3f}s throttled {counters['queued_s']:>9.3f}s queued")
+        for device in stats['devices']:
+            if not device['requests']:
+                continue
+            kind = {True: 'HDD', False: 'SSD', None: '?'}[device['rotational']]
+            lines.append(f"  device {device['device']:<7} {kind:<3} limit {device['limit']}/{device['max_limit']} "
+                         f"(peak {device['peak']}, +{device['increases']}/-{device['decreases']}), "
+                         f"latency {device['latency_ms']} ms vs baseline {device['baseline_ms']} ms per MiB-op")
+        return '\n'.join(lines)
+
+
+def io_scheduler_for(shared):
+    """
+    The shared store's IOScheduler, or None when I/O is not scheduled.
+    """
+    return shared.get('io_scheduler')
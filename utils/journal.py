@@ -0,0 +1,100 @@
+import os
+import json
+import threading
+from utils.file_utils import FileRecord
+
+JOURNAL_FILENAME = '.organizer_journal.jsonl'
+
+
+def entry_for(meta, category: str, dest: str, action: str) -> dict:
+    """
+    Everything needed to rebuild a file's record and placement without touching the source again.
+    """
+    return {
+        'src': meta['path'], 'dest': dest, 'category': category, 'action': action,
+        'size': meta['size'], 'ctime': meta['ctime'], 'mtime': meta['mtime'],
+        'ino': meta['ino'], 'dev': meta['dev'], 'type': meta['type'], 'tags': meta['extra_metadata'] or None,
+        'captured': meta['captured'],
+    }
+
+
+def record_from_entry(entry: dict) -> FileRecord:
+    meta = FileRecord(entry['src'], entry['size'], entry['ctime'], entry['mtime'], entry['ino'], entry['dev'])
+    meta.type = entry['type']
+    meta.extra_metadata = entry['tags']
+    meta.captured = entry.get('captured')
+    return meta
+
+
+class CopyJournal:
+    """
+    Append-only journal of a run, stored as JSON lines in the destination directory.
+    'plan' entries record each resolved file (enough to rebuild the run without rescanning or rehashing),
+    'done' entries record finished copies and a final 'complete' entry marks a finished run.
+    Every line is flushed as it is written, so the journal survives the process being killed.
+    A 'done' entry is only written once the file and its directory entry have been fsynced (see CopyEngine), so
+    after a crash or power loss every file the journal records as done is intact under its final name; at worst
+    the last 'done' lines are lost and those files are checked again on --resume.
+    """
+
+    def __init__(self, destination_directory: str, filename: str = JOURNAL_FILENAME):
+        self.path = os.path.join(destination_directory, filename)
+        self._file = None
+        self._lock = threading.Lock()
+
+    def load(self) -> tuple:
+        """
+        Read an existing journal.
+        Returns (plan entries in order, dict of done source path -> (final destination, operation, checksum),
+        complete flag).
+        A torn last line from a crash is ignored.
+        """
+        plan, done, complete = [], {}, False
+        if not os.path.exists(self.path):
+            return plan, done, complete
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                op = entry.get('op')
+                if op == 'plan':
+                    plan.append(entry)
+                elif op == 'done':
+                    done[entry['src']] = (entry['dest'], entry.get('operation'), entry.get('sha256'))
+                elif op == 'complete':
+                    complete = True
+        return plan, done, complete
+
+    def open(self, append: bool = False):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._file = open(self.path, 'a' if append else 'w', encoding='utf-8')
+
+    def _write(self, entry: dict):
+        line = json.dumps(entry) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def plan(self, meta, category: str, dest: str, action: str, replace: bool = False):
+        entry = dict(entry_for(meta, category, dest, action), op='plan')
+        if replace:
+            entry['replace'] = True  # the copy overwrites the existing destination file
+        self._write(entry)
+
+    def done(self, src: str, dest: str, operation: str = None, checksum: str = None):
+        entry = {'op': 'done', 'src': src, 'dest': dest, 'operation': operation}
+        if checksum:
+            entry['sha256'] = checksum
+        self._write(entry)
+
+    def complete(self):
+        self._write({'op': 'complete'})
+
+    def close(self):
+        if self._file is not None:
+            with self._lock:
+                os.fsync(self._file.fileno())
+                self._file.close()
+                self._file = None
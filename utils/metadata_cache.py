@@ -0,0 +1,134 @@
+import os
+import json
+import sqlite3
+import threading
+
+CACHE_FILENAME = '.organizer_cache.sqlite'
+
+
+class MetadataCache:
+    """
+    On-disk cache of per-file metadata, stored as SQLite in the destination directory.
+    Entries are keyed by source path and are only valid while inode, size and mtime still match.
+    Each entry stores the detected type, extracted tags, capture date and the final destination path.
+    classifier is the signature of the file type classifier in use (FileTypeClassifier.signature()); it is stored
+    with each entry, and a stored type is only returned while the signature matches (e.g. not after --sniff or
+    --raw was switched).
+    With readonly=True (shard workers) the cache is only read and every write is skipped;
+    the reduce step writes the entries instead.
+    """
+
+    def __init__(self, destination_directory: str, filename: str = CACHE_FILENAME, readonly: bool = False,
+                 classifier: str = None):
+        self.path = os.path.join(destination_directory, filename)
+        self.readonly = readonly
+        self.classifier = classifier
+        self.lock = threading.RLock()  # the connection is shared by pipeline stages
+        self.hits = 0
+        self.misses = 0
+        if readonly:
+            self.conn = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True, check_same_thread=False)
+            self.run = None
+            columns = {row[1] for row in self.conn.execute('PRAGMA table_info(files)')}
+            self._classifier_column = 'classifier' if 'classifier' in columns else 'NULL'
+            return
+        os.makedirs(destination_directory, exist_ok=True)
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS files ('
+            'path TEXT PRIMARY KEY, ino INTEGER, size INTEGER, mtime REAL, '
+            'type TEXT, tags TEXT, destination TEXT, run INTEGER, captured REAL, classifier TEXT)')
+        columns = {row[1] for row in self.conn.execute('PRAGMA table_info(files)')}
+        if 'captured' not in columns:
+            # Caches written before capture dates were stored; their entries get the date on the next update
+            self.conn.execute('ALTER TABLE files ADD COLUMN captured REAL')
+        if 'classifier' not in columns:
+            # Entries written before classifier signatures were stored are re-classified once
+            self.conn.execute('ALTER TABLE files ADD COLUMN classifier TEXT')
+        self._classifier_column = 'classifier'
+        self.run = (self.conn.execute('SELECT MAX(run) FROM files').fetchone()[0] or 0) + 1
+
+    def lookup(self, record):
+        """
+        Return the cached entry (dict with type, tags, captured, destination) for an unchanged file, or None.
+        type is None if the entry was classified with another classifier configuration.
+        A stale entry counts as a miss and is left to be overwritten by update().
+        """
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT ino, size, mtime, type, tags, destination, captured, '
+                f'{self._classifier_column} FROM files WHERE path = ?',
+                (record['path'],)).fetchone()
+            if row is None or (row[0], row[1], row[2]) != (record['ino'], record['size'], record['mtime']):
+                self.misses += 1
+                return None
+            self.hits += 1
+            if not self.readonly:
+                self.conn.execute('UPDATE files SET run = ? WHERE path = ?', (self.run, record['path']))
+            return {
+                'type': row[3] if row[7] == self.classifier else None,
+                'tags': json.loads(row[4]) if row[4] else {},
+                'destination': row[5],
+                'captured': row[6],
+            }
+
+    def update(self, record, destination: str = None):
+        """
+        Insert or replace the entry for a file from its current record.
+        """
+        if self.readonly:
+            return
+        with self.lock:
+            tags = record['extra_metadata'] or None
+            self.conn.execute(
+                'INSERT OR REPLACE INTO files (path, ino, size, mtime, type, tags, destination, run, captured, '
+                'classifier) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (record['path'], record['ino'], record['size'], record['mtime'], record['type'],
+                 json.dumps(tags) if tags else None, destination, self.run, record['captured'], self.classifier))
+
+    def invalidate(self, path: str):
+        """
+        Drop the entry for a single path.
+        """
+        if self.readonly:
+            return
+        with self.lock:
+            self.conn.execute('DELETE FROM files WHERE path = ?', (path,))
+
+    def clear(self):
+        """
+        Drop every entry, forcing a full re-run.
+        """
+        if self.readonly:
+            return
+        with self.lock:
+            self.conn.execute('DELETE FROM files')
+
+    def compact(self) -> int:
+        """
+        Remove entries for files not seen in this run and reclaim space once enough rows were dropped.
+        Returns the number of removed entries.
+        """
+        if self.readonly:
+            return 0
+        with self.lock:
+            removed = self.conn.execute('DELETE FROM files WHERE run < ?', (self.run,)).rowcount
+            self.conn.commit()
+            remaining = self.conn.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+            if removed and removed * 4 >= remaining:
+                self.conn.execute('VACUUM')
+            return removed
+
+    def summary(self) -> str:
+        return f"Metadata cache: {self.hits} hits, {self.misses} misses"
+
+    def commit(self):
+        with self.lock:
+            if not self.readonly:
+                self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            if not self.readonly:
+                self.conn.commit()
+            self.conn.close()
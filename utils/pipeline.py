@@ -0,0 +1,92 @@
+import queue
+import threading
+
+_DONE = object()
+
+
+class Stage:
+    """
+    One step of a Pipeline: fn(item) is called on each input item by `workers` threads.
+    Whatever fn returns is passed to the next stage; returning None drops the item.
+    """
+
+    def __init__(self, name: str, fn, workers: int = 1):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+
+
+class Pipeline:
+    """
+    Runs a source iterable through a chain of stages on threads connected by bounded queues.
+    A full queue blocks the stage feeding it (backpressure), so the number of items in flight
+    is bounded by the queue sizes rather than by the size of the input.
+    The first exception raised by any stage stops the pipeline and is re-raised from run().
+    """
+
+    def __init__(self, source, stages: list, maxsize: int = 1024):
+        self.source = source
+        self.stages = stages
+        self.queues = [queue.Queue(maxsize) for _ in stages]
+        self._stop = threading.Event()
+        self._errors = []
+
+    def depths(self) -> dict:
+        """
+        Current number of items waiting in front of each stage.
+        """
+        return {stage.name: q.qsize() for stage, q in zip(self.stages, self.queues)}
+
+    def _fail(self, error: BaseException):
+        self._errors.append(error)
+        self._stop.set()
+
+    def _feed(self):
+        try:
+            for item in self.source:
+                if self._stop.is_set():
+                    break
+                self.queues[0].put(item)
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            self.queues[0].put(_DONE)
+
+    def _work(self, index: int, remaining: list, lock: threading.Lock):
+        stage = self.stages[index]
+        inbox = self.queues[index]
+        outbox = self.queues[index + 1] if index + 1 < len(self.queues) else None
+        while True:
+            item = inbox.get()
+            if item is _DONE:
+                inbox.put(_DONE)  # let sibling workers see it too
+                break
+            if self._stop.is_set():
+                continue  # keep draining so upstream stages never block
+            try:
+                result = stage.fn(item)
+            except BaseException as e:
+                self._fail(e)
+                continue
+            if result is not None and outbox is not None:
+                outbox.put(result)
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last and outbox is not None:
+            outbox.put(_DONE)
+
+    def run(self):
+        threads = [threading.Thread(target=self._feed, name='pipeline-source', daemon=True)]
+        for index, stage in enumerate(self.stages):
+            remaining = [stage.workers]
+            lock = threading.Lock()
+            for n in range(stage.workers):
+                threads.append(threading.Thread(target=self._work, args=(index, remaining, lock),
+                                                name=f'pipeline-{stage.name}-{n}', daemon=True))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if self._errors:
+            raise self._errors[0]
@@ -0,0 +1,117 @@
+import os
+import json
+import heapq
+
+SHARD_DIRNAME = '.organizer_shards'
+PLAN_FILENAME = 'plan.json'
+
+
+def shard_directory(destination_directory: str) -> str:
+    return os.path.join(destination_directory, SHARD_DIRNAME)
+
+
+def manifest_path(destination_directory: str, shard_id: int) -> str:
+    return os.path.join(shard_directory(destination_directory), f'manifest-{shard_id}.jsonl')
+
+
+def journal_filename(shard_id: int) -> str:
+    return os.path.join(SHARD_DIRNAME, f'journal-{shard_id}.jsonl')
+
+
+def count_tree(source_directory: str) -> tuple:
+    """
+    Count files per directory without stat'ing them (DirEntry types only).
+    Returns (direct file counts, recursive file counts, subdirectories) keyed by directory.
+    """
+    direct, children, order = {}, {}, []
+    stack = [source_directory]
+    while stack:
+        directory = stack.pop()
+        order.append(directory)
+        files, subdirs = 0, []
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.path)
+                        elif entry.is_file():
+                            files += 1
+                    except OSError:
+                        pass
+        except OSError as e:
+            print(f"Error reading directory {directory}: {e}")
+        direct[directory] = files
+        children[directory] = sorted(subdirs)
+        stack.extend(subdirs)
+    total = {}
+    for directory in reversed(order):  # children are always counted before their parent
+        total[directory] = direct[directory] + sum(total[child] for child in children[directory])
+    return direct, total, children
+
+
+def plan_shards(source_directory: str, shard_count: int) -> list:
+    """
+    Split the source tree into shard_count shards of similar file counts.
+    Subtrees larger than an even share are split into their own files plus their subdirectories;
+    the resulting units are then packed largest first onto the currently smallest shard.
+    Returns a list of {'id', 'files', 'units': [[directory, recursive], ...]}.
+    """
+    direct, total, children = count_tree(source_directory)
+    target = max(1, total[source_directory] // max(1, shard_count))
+    units = []
+    pending = [source_directory]
+    while pending:
+        directory = pending.pop()
+        if total[directory] <= target or not children[directory]:
+            if total[directory]:
+                units.append((total[directory], directory, True))
+            continue
+        if direct[directory]:
+            units.append((direct[directory], directory, False))
+        pending.extend(children[directory])
+    shards = [{'id': i, 'files': 0, 'units': []} for i in range(shard_count)]
+    heap = [(0, i) for i in range(shard_count)]
+    for files, directory, recursive in sorted(units, reverse=True):
+        count, i = heapq.heappop(heap)
+        shards[i]['files'] += files
+        shards[i]['units'].append([directory, recursive])
+        heapq.heappush(heap, (count + files, i))
+    return shards
+
+
+def write_plan(destination_directory: str, plan: dict) -> str:
+    directory = shard_directory(destination_directory)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, PLAN_FILENAME)
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(plan, f, indent=1)
+    os.replace(tmp, path)
+    return path
+
+
+def read_plan(destination_directory: str) -> dict:
+    with open(os.path.join(shard_directory(destination_directory), PLAN_FILENAME), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def write_manifest(destination_directory: str, shard_id: int, entries) -> str:
+    """
+    Write a shard's manifest (one JSON entry per file) atomically; its presence marks the shard as finished.
+    """
+    path = manifest_path(destination_directory, shard_id)
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        for entry in entries:
+            f.write(json.dumps(entry) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return path
+
+
+def read_manifest(destination_directory: str, shard_id: int):
+    with open(manifest_path(destination_directory, shard_id), encoding='utf-8') as f:
+        for line in f:
+            yield json.loads(line)
@@ -0,0 +1,307 @@
+import os
+import sys
+import json
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import datetime
+from collections import deque
+
+STATUS_FILENAME = '.organizer_status.json'
+
+# inotify(7) constants
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_ONLYDIR | IN_DONT_FOLLOW
+_EVENT = struct.Struct('iIII')  # wd, mask, cookie, len
+_READ_SIZE = 64 * 1024
+
+
+def _walk_dirs(root: str):
+    """
+    Yield root and every directory below it (not following symlinks).
+    """
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        yield directory
+        try:
+            with os.scandir(directory) as it:
+                stack.extend(entry.path for entry in it if entry.is_dir(follow_symlinks=False))
+        except OSError:
+            pass
+
+
+def _files_in(directory: str) -> list:
+    files = []
+    for subdir in _walk_dirs(directory):
+        try:
+            with os.scandir(subdir) as it:
+                files.extend(entry.path for entry in it if entry.is_file(follow_symlinks=False))
+        except OSError:
+            pass
+    return files
+
+
+class InotifyWatcher:
+    """
+    Reports files written and closed (IN_CLOSE_WRITE) or moved into the source tree (IN_MOVED_TO), using
+    inotify through ctypes. New subdirectories are watched as they appear and the files already in them
+    reported. After a queue overflow, overflowed is set and the caller should rescan the whole tree.
+    Raises OSError if inotify is unavailable or the watch limit (fs.inotify.max_user_watches) is reached.
+    """
+    backend = 'inotify'
+
+    def __init__(self, root: str):
+        if not sys.platform.startswith('linux'):
+            raise OSError(errno.ENOSYS, 'inotify is only available on Linux')
+        self.root = root
+        self.overflowed = False
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+        self._dirs = {}  # watch descriptor -> directory
+        try:
+            for directory in _walk_dirs(root):
+                self._add_watch(directory)
+        except OSError:
+            self.close()
+            raise
+
+    def _add_watch(self, directory: str):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            e = ctypes.get_errno()
+            if e in (errno.ENOENT, errno.ENOTDIR):
+                return  # removed again before it could be watched
+            raise OSError(e, f'inotify_add_watch: {os.strerror(e)}', directory)
+        self._dirs[wd] = directory
+
+    def read(self, timeout: float) -> list:
+        """
+        Wait up to timeout seconds for events; return the paths of files that were written or moved in.
+        """
+        if not select.select([self._fd], [], [], timeout)[0]:
+            return []
+        paths = []
+        while True:
+            try:
+                data = os.read(self._fd, _READ_SIZE)
+            except BlockingIOError:
+                break
+            pos = 0
+            while pos + _EVENT.size <= len(data):
+                wd, mask, _, length = _EVENT.unpack_from(data, pos)
+                name = data[pos + _EVENT.size:pos + _EVENT.size + length].split(b'\0', 1)[0]
+                pos += _EVENT.size + length
+                if mask & IN_Q_OVERFLOW:
+                    self.overflowed = True
+                    continue
+                if mask & IN_IGNORED:
+                    self._dirs.pop(wd, None)
+                    continue
+                directory = self._dirs.get(wd)
+                if directory is None:
+                    continue
+                path = os.path.join(directory, os.fsdecode(name))
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        # Watch the new tree first, then report what was written into it before the watch existed
+                        for subdir in _walk_dirs(path):
+                            self._add_watch(subdir)
+                        paths.extend(_files_in(path))
+                elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                    paths.append(path)
+        return paths
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class PollingWatcher:
+    """
+    Fallback for systems without inotify (or past its watch limit): every interval seconds each directory is
+    stat'ed, and only directories whose mtime changed are listed again to find new names. Files rewritten in
+    place are not noticed (their directory does not change); the Debouncer waits for new files to stop growing.
+    """
+    backend = 'poll'
+
+    def __init__(self, root: str, interval: float = 5.0):
+        self.root = root
+        self.interval = interval
+        self.overflowed = False
+        self._dirs = {}  # directory -> (mtime_ns, names)
+        self._next = 0.0
+        for directory in _walk_dirs(root):
+            self._list(directory)
+
+    def _list(self, directory: str):
+        # Returns (new file paths, new subdirectories) compared to the last listing
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+            with os.scandir(directory) as it:
+                entries = [(entry.name, entry.is_dir(follow_symlinks=False), entry.is_file(follow_symlinks=False))
+                           for entry in it]
+        except OSError:
+            self._dirs.pop(directory, None)
+            return [], []
+        old = self._dirs.get(directory, (None, frozenset()))[1]
+        self._dirs[directory] = (mtime, frozenset(name for name, _, _ in entries))
+        new_files = [os.path.join(directory, name) for name, is_dir, is_file in entries if is_file and name not in old]
+        new_dirs = [os.path.join(directory, name) for name, is_dir, _ in entries if is_dir and name not in old]
+        return new_files, new_dirs
+
+    def read(self, timeout: float) -> list:
+        wait = self._next - time.monotonic()
+        if wait > 0:
+            time.sleep(min(wait, timeout))
+            if wait > timeout:
+                return []
+        self._next = time.monotonic() + self.interval
+        paths = []
+        for directory, (mtime, _) in list(self._dirs.items()):
+            try:
+                if os.stat(directory).st_mtime_ns == mtime:
+                    continue
+            except OSError:
+                self._dirs.pop(directory, None)
+                continue
+            new_files, new_dirs = self._list(directory)
+            paths.extend(new_files)
+            for new_dir in new_dirs:
+                for subdir in _walk_dirs(new_dir):
+                    paths.extend(self._list(subdir)[0])
+        return paths
+
+    def close(self):
+        pass
+
+
+def open_watcher(root: str, poll: bool = False, interval: float = 5.0):
+    """
+    An InotifyWatcher for root, or a PollingWatcher if poll is set or inotify cannot be used.
+    """
+    if not poll:
+        try:
+            return InotifyWatcher(root)
+        except (OSError, AttributeError) as e:
+            print(f"inotify unavailable ({e}); polling every {interval}s instead")
+    return PollingWatcher(root, interval)
+
+
+class Debouncer:
+    """
+    Holds reported paths until they have settled: no new event for settle seconds and the same size and mtime
+    as when last seen. A file still being written is re-armed instead of being ingested half-written.
+    """
+
+    def __init__(self, settle: float = 2.0):
+        self.settle = settle
+        self._pending = {}  # path -> (deadline, (size, mtime_ns))
+
+    @staticmethod
+    def _signature(path: str):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_size, st.st_mtime_ns
+
+    def add(self, path: str, now: float = None):
+        now = time.monotonic() if now is None else now
+        self._pending[path] = (now + self.settle, self._signature(path))
+
+    def __len__(self):
+        return len(self._pending)
+
+    def ready(self, limit: int = None, now: float = None) -> list:
+        """
+        Remove and return up to limit settled paths (oldest first). Paths that vanished are dropped.
+        """
+        now = time.monotonic() if now is None else now
+        settled = []
+        for path, (deadline, signature) in sorted(self._pending.items(), key=lambda item: item[1][0]):
+            if deadline > now or (limit is not None and len(settled) >= limit):
+                break
+            current = self._signature(path)
+            if current is None:
+                del self._pending[path]
+            elif current != signature:
+                self._pending[path] = (now + self.settle, current)
+            else:
+                del self._pending[path]
+                settled.append(path)
+        return settled
+
+
+class WatchStatus:
+    """
+    Status of a watch run, rewritten atomically as JSON in the destination (STATUS_FILENAME):
+    state, watcher backend, queue depth (files waiting to settle or for the next batch), batches, files and bytes
+    ingested, and the ingest rate over the last window seconds. io_stats, if given, is called for an 'io' entry
+    (e.g. IOScheduler.stats).
+    """
+
+    def __init__(self, destination_directory: str, backend: str, window: float = 60.0, io_stats=None):
+        self.path = os.path.join(destination_directory, STATUS_FILENAME)
+        self.backend = backend
+        self.io_stats = io_stats
+        self.window = window
+        self.started = time.time()
+        self.batches = 0
+        self.files = 0
+        self.bytes = 0
+        self.errors = 0
+        self.last_batch = None
+        self._recent = deque()  # (time, files, bytes) per batch within the window
+
+    def batch(self, files: int, nbytes: int, seconds: float, errors: int = 0):
+        now = time.time()
+        self.batches += 1
+        self.files += files
+        self.bytes += nbytes
+        self.errors += errors
+        self.last_batch = {'files': files, 'bytes': nbytes, 'seconds': round(seconds, 3),
+                           'finished': datetime.datetime.fromtimestamp(now).isoformat(timespec='seconds')}
+        self._recent.append((now, files, nbytes))
+
+    def write(self, state: str, pending: int = 0, ready: int = 0):
+        now = time.time()
+        while self._recent and self._recent[0][0] < now - self.window:
+            self._recent.popleft()
+        window = min(self.window, max(now - self.started, 1e-3))
+        status = {
+            'state': state,
+            'backend': self.backend,
+            'pid': os.getpid(),
+            'started': datetime.datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+            'updated': datetime.datetime.fromtimestamp(now).isoformat(timespec='seconds'),
+            'queue': {'settling': pending, 'ready': ready},
+            'batches': self.batches,
+            'ingested': {'files': self.files, 'bytes': self.bytes, 'errors': self.errors},
+            'rate': {
+                'window_s': round(window, 1),
+                'files_per_s': round(sum(files for _, files, _ in self._recent) / window, 2),
+                'mb_per_s': round(sum(nbytes for _, _, nbytes in self._recent) / window / 1e6, 3),
+            },
+            'last_batch': self.last_batch,
+        }
+        if self.io_stats is not None:
+            status['io'] = self.io_stats()
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(status, f, indent=1)
+        os.replace(tmp, self.path)
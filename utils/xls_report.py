@@ -5,107 +5,233 @@ import openpyxl
 from openpyxl import Workbook
 from openpyxl.utils import get_column_letter
 from openpyxl.styles import Alignment
+from openpyxl.cell import WriteOnlyCell
 
-def generate_csv_report(organized_files: dict, destination_directory: str, report_type: str):
+# Data rows per sheet: Excel's 1,048,576-row limit minus the header row
+MAX_ROWS_PER_SHEET = 1048576 - 1
+
+def _write_csv(report_path: str, header: list, rows, append: bool = False):
+    # When appending to an existing report, the header is already there
+    existing = append and os.path.exists(report_path)
+    with open(report_path, 'a' if existing else 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        if not existing:
+            writer.writerow(header)
+        writer.writerows(rows)
+
+
+def generate_csv_report(organized_files: dict, destination_directory: str, report_type: str,
+                        audio_metadata: dict = None, mtimes: dict = None, append: bool = False):
     """
     Generate a CSV report for audio or other files.
     For audio: columns = title, artist, album, file path
     For other: columns = file name, directory, last modified date
+    audio_metadata maps source path -> tags; defaults to organized_files['audio_metadata'].
+    mtimes maps source paths to modification times collected during the scan; files missing from it are stat'ed.
+    With append, rows are added to an existing report instead of replacing it.
     """
     if report_type == 'audio':
         report_path = os.path.join(destination_directory, 'audio', 'audio_report.csv')
+        if audio_metadata is None:
+            audio_metadata = organized_files.get('audio_metadata', {})
         rows = []
         for src, dest in organized_files.get('audio', {}).items():
-            meta = organized_files.get('audio_metadata', {}).get(src, {})
+            meta = audio_metadata.get(src, {})
             rows.append([
                 meta.get('title', 'UnknownTitle'),
                 meta.get('artist', 'UnknownArtist'),
                 meta.get('album', 'UnknownAlbum'),
                 dest
             ])
-        with open(report_path, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow(['Title', 'Artist', 'Album', 'File Path'])
-            writer.writerows(rows)
+        _write_csv(report_path, ['Title', 'Artist', 'Album', 'File Path'], rows, append)
         return report_path
     elif report_type == 'other':
         report_path = os.path.join(destination_directory, 'other', 'other_report.csv')
+        mtimes = mtimes or {}
         rows = []
         for src, dest in organized_files.get('other', {}).items():
             fname = os.path.basename(src)
             directory = os.path.dirname(src)
-            mtime = os.path.getmtime(src)
+            mtime = mtimes.get(src)
+            if mtime is None:
+                mtime = os.path.getmtime(src)
             rows.append([fname, directory, mtime])
-        with open(report_path, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow(['File Name', 'Directory', 'Last Modified Date'])
-            writer.writerows(rows)
+        _write_csv(report_path, ['File Name', 'Directory', 'Last Modified Date'], rows, append)
         return report_path
     else:
         raise ValueError('Unknown report type')
 
-def generate_excel_report(organized_files: dict, destination_directory: str):
+def _write_only_sheet(wb, title: str, header: list, widths: list):
+    ws = wb.create_sheet(title)
+    # Column widths must be set before rows are streamed out
+    for idx, width in enumerate(widths, start=1):
+        ws.column_dimensions[get_column_letter(idx)].width = width
+    ws.append(header)
+    return ws
+
+
+def _write_rows(wb, title: str, header: list, widths: list, rows, date_column: int = None) -> int:
+    """
+    Stream rows into write-only sheets, rolling over to '<title> (2)', '<title> (3)', ... when a sheet is full.
+    date_column (0-based) gets an Excel date format. Returns the number of rows written.
+    """
+    ws = _write_only_sheet(wb, title, header, widths)
+    sheet_rows = 0
+    sheet_number = 1
+    count = 0
+    for row in rows:
+        if sheet_rows == MAX_ROWS_PER_SHEET:
+            sheet_number += 1
+            ws = _write_only_sheet(wb, f'{title} ({sheet_number})', header, widths)
+            sheet_rows = 0
+        if date_column is not None:
+            cell = WriteOnlyCell(ws, value=row[date_column])
+            cell.number_format = 'mm/dd/yyyy'
+            row = list(row)
+            row[date_column] = cell
+        ws.append(row)
+        sheet_rows += 1
+        count += 1
+    return count
+
+
+def generate_excel_report(organized_files: dict, destination_directory: str, mtimes: dict = None):
     """
     Generate an Excel (.xlsx) report for 'other' files, showing file name, destination path (without file name), and last modified date (Excel date format).
     Columns are wide enough to avoid text wrapping.
+    The workbook is streamed in write-only mode and rolls over to a new sheet past Excel's row limit.
+    mtimes maps source paths to modification times collected during the scan; files missing from it are stat'ed.
     """
     report_path = os.path.join(destination_directory, 'other', 'other_report.xlsx')
-    wb = Workbook()
-    ws = wb.active
-    ws.title = 'Other Files'
-    ws.append(['File Name', 'Destination Path', 'Last Modified Date'])
-    for src, dest in organized_files.get('other', {}).items():
-        fname = os.path.basename(src)
-        dest_path = os.path.dirname(dest)
-        mtime = os.path.getmtime(dest) if os.path.exists(dest) else os.path.getmtime(src)
-        excel_date = datetime.datetime.fromtimestamp(mtime)
-        ws.append([fname, dest_path, excel_date])
-    # Format columns
-    ws.column_dimensions[get_column_letter(1)].width = 30
-    ws.column_dimensions[get_column_letter(2)].width = 60
-    ws.column_dimensions[get_column_letter(3)].width = 20
-    for cell in ws[get_column_letter(3)][1:]:
-        cell.number_format = 'mm/dd/yyyy'
+    mtimes = mtimes or {}
+    def rows():
+        for src, dest in organized_files.get('other', {}).items():
+            fname = os.path.basename(src)
+            dest_path = os.path.dirname(dest)
+            mtime = mtimes.get(src)
+            if mtime is None:
+                mtime = os.path.getmtime(dest) if os.path.exists(dest) else os.path.getmtime(src)
+            yield [fname, dest_path, datetime.datetime.fromtimestamp(mtime)]
+    wb = Workbook(write_only=True)
+    _write_rows(wb, 'Other Files', ['File Name', 'Destination Path', 'Last Modified Date'], [30, 60, 20],
+                rows(), date_column=2)
     wb.save(report_path)
     return report_path
 
-def generate_master_report(file_metadata: list, categorized_files: dict, copied_files: dict, destination_directory: str):
+
+OPERATION_LABELS = {
+    'copy': 'Copied', 'move': 'Moved', 'hardlink': 'Hard-linked', 'symlink': 'Symlinked',
+    'copy+delete': 'Moved (copied across devices)',
+}
+
+
+def master_report_rows(file_metadata, copied_files: dict, duplicates: dict = None, operations: dict = None,
+                       checksums: dict = None, failed=None, unchanged=None, kept=None):
     """
-    Generate a master Excel report with file name, source path, destination path, and result (Copied, Ignored, Renamed).
-    If ignored, destination path is N/A.
-    Columns are wide enough to avoid text wrapping.
+    Yield (file name, source path, destination path, result, size, operation, checksum) for every scanned file.
+    Results are looked up in a source -> destination map (built once, unless copied_files is a file table view that
+    provides one through by_source()), so each row costs O(1).
+    operation is the label of what was actually done to the file this run, or '' if nothing was;
+    checksum is the SHA-256 recorded for the placed file (checksums maps source -> checksum), or ''.
+    Sources in failed (source -> error message) are reported as Failed with no destination and the error as
+    operation; sources in unchanged (already placed by an earlier run) as Unchanged; sources in kept (source ->
+    existing destination file that was kept instead of copying them) as Kept existing.
     """
-    report_path = os.path.join(destination_directory, 'master_report.xlsx')
-    wb = Workbook()
-    ws = wb.active
-    ws.title = 'Master Report'
-    ws.append(['File Name', 'Source Path', 'Destination Path', 'Result'])
-    all_dest_paths = set()
-    for category, files in copied_files.items():
-        all_dest_paths.update(files.values())
+    duplicates = duplicates or {}
+    failed = failed or {}
+    unchanged = unchanged or {}
+    kept = kept or {}
+    operations = operations or {}
+    checksums = checksums or {}
+    if hasattr(copied_files, 'by_source'):
+        destinations = copied_files.by_source()
+    else:
+        destinations = {}
+        for files in copied_files.values():
+            destinations.update(files)
     for meta in file_metadata:
-        fname = os.path.basename(meta['path'])
         src_path = meta['path']
-        dest_path = 'N/A'
-        result = 'Ignored'
-        for category, files in categorized_files.items():
-            if src_path in files:
-                candidate_dest = files[src_path]
-                if candidate_dest in all_dest_paths:
-                    dest_path = candidate_dest
-                    if fname != os.path.basename(dest_path):
-                        result = 'Renamed'
-                    else:
-                        result = 'Copied'
-                else:
-                    dest_path = 'N/A'
-                    result = 'Ignored'
-                break
-        ws.append([fname, src_path, dest_path, result])
-    # Format columns
-    ws.column_dimensions[get_column_letter(1)].width = 30
-    ws.column_dimensions[get_column_letter(2)].width = 60
-    ws.column_dimensions[get_column_letter(3)].width = 60
-    ws.column_dimensions[get_column_letter(4)].width = 15
+        fname = os.path.basename(src_path)
+        if src_path in duplicates:
+            yield fname, src_path, duplicates[src_path], 'Duplicate', meta['size'], '', ''
+            continue
+        if src_path in failed:
+            yield fname, src_path, 'N/A', 'Failed', meta['size'], failed[src_path], ''
+            continue
+        if src_path in kept:
+            yield fname, src_path, kept[src_path], 'Kept existing', meta['size'], '', ''
+            continue
+        dest_path = destinations.get(src_path)
+        operation = OPERATION_LABELS.get(operations.get(src_path), '')
+        checksum = checksums.get(src_path, '')
+        if dest_path is None or dest_path == src_path:
+            # Not organized
+            yield fname, src_path, 'N/A', 'Ignored', meta['size'], '', ''
+        elif fname != os.path.basename(dest_path):
+            yield fname, src_path, dest_path, 'Renamed', meta['size'], operation, checksum
+        else:
+            result = operation or ('Unchanged' if src_path in unchanged else 'Copied')
+            yield fname, src_path, dest_path, result, meta['size'], operation, checksum
+
+
+def generate_master_report(file_metadata: list, categorized_files: dict, copied_files: dict, destination_directory: str,
+                           duplicates: dict = None, output_format: str = 'xlsx', operations: dict = None,
+                           checksums: dict = None, append: bool = False, failed=None, unchanged=None, kept=None):
+    """
+    Generate a master report with file name, source path, destination path, result (Copied, Moved, Hard-linked,
+    Symlinked, Unchanged, Ignored, Renamed, Duplicate, Kept existing, Failed) and the operation actually performed (operations maps
+    source -> operation). If ignored or failed, destination path is N/A. Duplicates list the destination file that
+    already holds their content. failed maps source -> error message (shown as the operation of Failed rows);
+    unchanged is a collection of source paths already placed by an earlier run; kept maps sources that were not
+    copied because an existing destination file won the conflict to that file.
+    With checksums (source -> SHA-256 of the verified copy) a SHA-256 column is added.
+    A Summary sheet records the number of duplicates skipped and the bytes saved.
+    Columns are wide enough to avoid text wrapping.
+    The xlsx workbook is streamed in write-only mode and rolls over to a new sheet past Excel's row limit;
+    output_format='csv' writes master_report.csv (plus master_report_summary.csv) instead, for very large runs.
+    With append (csv only), rows are added to an existing master_report.csv and the summary counts accumulate.
+    """
+    if append and output_format != 'csv':
+        raise ValueError('Only csv reports can be appended to')
+    header = ['File Name', 'Source Path', 'Destination Path', 'Result', 'Operation']
+    widths = [30, 60, 60, 15, 30]
+    if checksums is not None:
+        header.append('SHA-256')
+        widths.append(70)
+    stats = {'duplicates': 0, 'bytes_saved': 0}
+    def rows():
+        for fname, src_path, dest_path, result, size, operation, checksum in master_report_rows(
+                file_metadata, copied_files, duplicates, operations, checksums, failed, unchanged, kept):
+            if result == 'Duplicate':
+                stats['duplicates'] += 1
+                stats['bytes_saved'] += size
+            row = [fname, src_path, dest_path, result, operation]
+            if checksums is not None:
+                row.append(checksum)
+            yield row
+    if output_format == 'csv':
+        report_path = os.path.join(destination_directory, 'master_report.csv')
+        summary_path = os.path.join(destination_directory, 'master_report_summary.csv')
+        _write_csv(report_path, header, rows(), append)
+        if append and os.path.exists(summary_path):
+            with open(summary_path, newline='', encoding='utf-8') as f:
+                previous = [int(value) for _, value in csv.reader(f)]
+            stats['duplicates'] += previous[0]
+            stats['bytes_saved'] += previous[1]
+        with open(summary_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['Duplicates Skipped', stats['duplicates']])
+            writer.writerow(['Bytes Saved', stats['bytes_saved']])
+        return report_path
+    elif output_format != 'xlsx':
+        raise ValueError('Unknown report format')
+    report_path = os.path.join(destination_directory, 'master_report.xlsx')
+    wb = Workbook(write_only=True)
+    _write_rows(wb, 'Master Report', header, widths, rows())
+    summary = wb.create_sheet('Summary')
+    summary.column_dimensions[get_column_letter(1)].width = 20
+    summary.column_dimensions[get_column_letter(2)].width = 20
+    summary.append(['Duplicates Skipped', stats['duplicates']])
+    summary.append(['Bytes Saved', stats['bytes_saved']])
     wb.save(report_path)
     return report_path